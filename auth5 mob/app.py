@@ -1,18 +1,37 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, send_file, g
 from flask_cors import CORS
-from supabase import create_client, Client
 from gemini_client import GeminiClient
 from openrouter_client import OpenRouterClient
-from system_control import SystemControl
 from weather_service import WeatherService
 from news_service import NewsService
+from news_aggregator import NewsAggregator, NewsStore
 from imagen_client import ImagenClient
 from stability_client import StabilityClient
 from crypto_service import CryptoService
 from stock_service import StockService
 from runway_client import RunwayClient
 from youtube_service import YouTubeService
+from intent_router import FanOut
+from intents import build_router, CRYPTO_NAMES
+from video_jobs import VideoJobStore, VideoJobPoller
+from http_transport import get_transport
+from quota_scheduler import TokenBucket, QuotaScheduler, QuotaLedger, LastResults
+from ttl_cache import TTLCache
+from response_cache import ResponseCache
+from conversation_store import ConversationStore, ContextAssembler, truncate_summary
+from attachments import AttachmentPipeline, AttachmentError, MAX_TEXT_CHARS
+from document_index import DocumentStore, DocumentRetriever
+from media_store import MediaStore
+from avatars import AvatarStore, AvatarError
+from provider_router import ProviderRouter
+from resilience import guard_stats
+from service_registry import ServiceRegistry
+from token_auth import SigningKeys, TokenVerifier, AuthError, HAS_JWT, current_user, set_user
+import metrics
+from metrics import instrument, text_outcome, pair_outcome, stream_outcome
 import os
+import re
+import json
 
 from dotenv import load_dotenv
 import os
@@ -20,6 +39,8 @@ import os
 load_dotenv()
 
 import logging
+import time
+import uuid
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -33,6 +54,11 @@ logger.addHandler(file_handler)
 
 app = Flask(__name__)
 CORS(app)
+# Reject oversized uploads before the JSON body is even parsed
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_REQUEST_BYTES", 16 * 1024 * 1024))
+
+# Clients behind slow imports are built on first use, or by the warm-up after the first request
+services = ServiceRegistry()
 
 # Load API key from environment variable
 API_KEY = os.getenv("GEMINI_API_KEY") 
@@ -43,34 +69,240 @@ if not API_KEY:
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+def create_supabase():
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def instrument_supabase(client):
+    instrument(client.auth, "supabase", ["sign_up", "sign_in_with_password"])
+    instrument(client.auth.admin, "supabase", ["update_user_by_id"])
+
 supabase = None
 if SUPABASE_URL and SUPABASE_KEY:
-    try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception as e:
-        print(f"Error initializing Supabase: {e}")
+    supabase = services.register("supabase", create_supabase, setup=instrument_supabase)
 else:
     print("Warning: SUPABASE_URL or SUPABASE_KEY not found in .env file.")
 
-gemini = GeminiClient(API_KEY)
-system = SystemControl()
+# Access tokens handed out by /login are verified locally (signature, expiry, audience)
+# against cached signing keys, so an authenticated request never waits on Supabase
+SUPABASE_AUTH_URL = f"{SUPABASE_URL.rstrip('/')}/auth/v1" if SUPABASE_URL else None
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "0") == "1"
+auth = None
+if HAS_JWT and (SUPABASE_AUTH_URL or SUPABASE_JWT_SECRET):
+    signing_keys = SigningKeys(
+        jwks_url=os.getenv("SUPABASE_JWKS_URL") or (f"{SUPABASE_AUTH_URL}/.well-known/jwks.json" if SUPABASE_AUTH_URL else None),
+        secret=SUPABASE_JWT_SECRET,
+        api_key=SUPABASE_KEY,
+        refresh=float(os.getenv("SUPABASE_JWKS_REFRESH", 600))
+    )
+    auth = TokenVerifier(
+        signing_keys,
+        audience=os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated"),
+        issuer=os.getenv("SUPABASE_JWT_ISSUER") or SUPABASE_AUTH_URL,
+        leeway=float(os.getenv("SUPABASE_JWT_LEEWAY", 30)),
+        cache_size=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 4096))
+    )
+    services.register("auth_keys", signing_keys.start)
+elif SUPABASE_URL:
+    print("Warning: PyJWT not installed; access tokens can't be verified, so chats stay anonymous and profile updates are refused.")
+
+def create_system_control():
+    # pyautogui needs a display to import, and OpenCV is large
+    from system_control import SystemControl
+    return SystemControl()
+
+system = services.register("system_control", create_system_control)
 weather = WeatherService(os.getenv("OPENWEATHER_API_KEY"))
 news = NewsService(os.getenv("NEWS_API_KEY"))
 crypto = CryptoService(os.getenv("CMC_API_KEY"))
-stock = StockService(os.getenv("ALPHA_VANTAGE_API_KEY"))
-youtube = YouTubeService(os.getenv("YOUTUBE_API_KEY"))
+# Alpha Vantage allows only a few calls per minute; the bucket lives in SQLite so all workers share it
+stock_scheduler = QuotaScheduler(
+    TokenBucket(
+        os.getenv("QUOTA_DB", "quota.db"), "alpha_vantage",
+        per_minute=int(os.getenv("ALPHA_VANTAGE_CALLS_PER_MINUTE", 5)),
+        per_day=int(os.getenv("ALPHA_VANTAGE_CALLS_PER_DAY", 25))
+    ),
+    deadline=float(os.getenv("STOCK_QUEUE_DEADLINE", 10)),
+    max_queue=int(os.getenv("STOCK_MAX_QUEUE", 20))
+)
+stock = StockService(
+    os.getenv("ALPHA_VANTAGE_API_KEY"), scheduler=stock_scheduler,
+    last_results=LastResults(os.getenv("QUOTA_DB", "quota.db"), "alpha_vantage")
+)
+# Headlines and market news are prefetched into one store, with near-duplicate stories collapsed
+NEWS_PREFETCH = [("headlines", *feed.split(":", 1)) for feed in os.getenv("NEWS_PREFETCH", "general:us").split(",") if feed]
+if os.getenv("MARKET_NEWS_PREFETCH", "1") == "1":
+    NEWS_PREFETCH.append(("market", ""))
+news_feed = NewsAggregator(
+    news, stock,
+    store=NewsStore(
+        max_items=int(os.getenv("NEWS_MAX_STORIES", 50)),
+        overlap=float(os.getenv("NEWS_DUPLICATE_OVERLAP", 0.7))
+    ),
+    refresh=float(os.getenv("NEWS_REFRESH", 1800)),
+    market_refresh=float(os.getenv("MARKET_NEWS_REFRESH", 3600)),
+    prefetch=NEWS_PREFETCH,
+    market_reserve=int(os.getenv("MARKET_NEWS_RESERVE", 10))
+)
+services.register("news", news_feed.start)
+# YouTube prices calls in quota units; searches are cached and trending charts refreshed on a schedule
+youtube = YouTubeService(
+    os.getenv("YOUTUBE_API_KEY"),
+    ledger=QuotaLedger(os.getenv("QUOTA_DB", "quota.db"), "youtube", daily_units=int(os.getenv("YOUTUBE_DAILY_QUOTA", 10000))),
+    search_cache=TTLCache(
+        maxsize=int(os.getenv("YOUTUBE_SEARCH_CACHE_SIZE", 1024)),
+        ttl=float(os.getenv("YOUTUBE_SEARCH_CACHE_TTL", 6 * 3600)),
+        stale_ttl=float(os.getenv("YOUTUBE_SEARCH_STALE_TTL", 18 * 3600)),
+        negative_ttl=float(os.getenv("YOUTUBE_SEARCH_CACHE_TTL", 6 * 3600))
+    ),
+    search_reserve=int(os.getenv("YOUTUBE_SEARCH_RESERVE", 200)),
+    trending_refresh=float(os.getenv("YOUTUBE_TRENDING_REFRESH", 1800))
+)
+services.register("youtube", youtube.client)
 
 # Initialize AI Assistant
 OR_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OR_MODEL = os.getenv("OPENROUTER_MODEL")
 
-if OR_API_KEY:
-    ai_assistant = OpenRouterClient(OR_API_KEY, OR_MODEL)
+# Opt-in cache of complete answers for repeated prompts
+response_cache = None
+if os.getenv("LLM_CACHE", "0") == "1":
+    response_cache = ResponseCache(
+        max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+        ttl=float(os.getenv("LLM_CACHE_TTL", 3600)),
+        path=os.getenv("LLM_CACHE_DB") or None
+    )
+
+if OR_API_KEY and API_KEY and os.getenv("PROVIDER_HEDGING", "1") == "1":
+    # Both providers configured: route between them, hedging slow calls and skipping failing ones
+    ai_assistant = ProviderRouter(
+        [OpenRouterClient(OR_API_KEY, OR_MODEL), GeminiClient(API_KEY)],
+        cache=response_cache,
+        hedge_default=float(os.getenv("PROVIDER_HEDGE_DEFAULT", 4.0)),
+        hedge_min=float(os.getenv("PROVIDER_HEDGE_MIN", 0.5)),
+        max_workers=int(os.getenv("PROVIDER_THREADS", 64)),
+        eject_after=int(os.getenv("PROVIDER_EJECT_AFTER", 3)),
+        eject_seconds=float(os.getenv("PROVIDER_EJECT_SECONDS", 30))
+    )
+    logger.info(f"Using OpenRouter AI ({OR_MODEL}) with Gemini as hedge/failover")
+elif OR_API_KEY:
+    ai_assistant = OpenRouterClient(OR_API_KEY, OR_MODEL, cache=response_cache)
     logger.info(f"Using OpenRouter AI: {OR_MODEL}")
 else:
-    ai_assistant = GeminiClient(API_KEY)
+    ai_assistant = GeminiClient(API_KEY, cache=response_cache)
     logger.info("Using Gemini AI")
 
+for client in getattr(ai_assistant, "providers", [ai_assistant]):
+    if isinstance(client, GeminiClient):
+        # Imports the Gemini SDK and picks the model ahead of the first chat turn
+        services.register("gemini", client._configure_model)
+
+def summarize_turns(previous, turns, max_tokens):
+    """Folds older turns into the rolling summary with the chat model, falling back to truncation."""
+    if os.getenv("CONTEXT_SUMMARIZER", "llm") != "llm":
+        return truncate_summary(previous, turns, max_tokens)
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    prompt = (
+        f"Summarize this conversation in at most {max_tokens * 3 // 4} words. Keep names, facts, numbers and "
+        f"decisions the user may refer back to.\n\nEarlier summary:\n{previous or '(none)'}\n\nConversation:\n{transcript}"
+    )
+    result, ok = ai_assistant.fetch_full_response(prompt)
+    return result["response"] if ok else truncate_summary(previous, turns, max_tokens)
+
+# Server-side chat memory: recent turns plus a rolling summary, within a token budget
+conversations = ContextAssembler(
+    ConversationStore(os.getenv("CONVERSATION_DB", "conversations.db")),
+    budget_tokens=int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000)),
+    summary_tokens=int(os.getenv("CONTEXT_SUMMARY_TOKENS", 400)),
+    keep_turns=int(os.getenv("CONTEXT_KEEP_TURNS", 6)),
+    summarize=summarize_turns
+)
+
+# Attachments are decoded, downscaled and hashed once, then shared by every client
+attachments = AttachmentPipeline(
+    cache_dir=os.getenv("ATTACHMENT_CACHE_DIR", "attachment_cache"),
+    max_edge=int(os.getenv("ATTACHMENT_MAX_EDGE", 1568)),
+    quality=int(os.getenv("ATTACHMENT_QUALITY", 85)),
+    image_format=os.getenv("ATTACHMENT_FORMAT", "JPEG"),
+    max_bytes=int(os.getenv("ATTACHMENT_MAX_BYTES", 10 * 1024 * 1024)),
+    max_text_chars=int(os.getenv("ATTACHMENT_MAX_TEXT_CHARS", MAX_TEXT_CHARS)),
+    cache_max_bytes=int(os.getenv("ATTACHMENT_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+)
+
+# Text attachments are indexed per conversation; each turn sends only the most relevant chunks
+documents = DocumentRetriever(
+    DocumentStore(os.getenv("DOCUMENT_DB", "documents.db")),
+    budget_tokens=int(os.getenv("DOCUMENT_TOKEN_BUDGET", 1500)),
+    top_k=int(os.getenv("DOCUMENT_TOP_K", 8)),
+    chunk_chars=int(os.getenv("DOCUMENT_CHUNK_CHARS", 800)),
+    memory_documents=int(os.getenv("DOCUMENT_MEMORY_DOCS", 4))
+)
+
+# Generated images are served by URL from a content-addressed store instead of inlined as base64
+media_store = MediaStore(
+    directory=os.getenv("MEDIA_DIR", "media"),
+    max_bytes=int(os.getenv("MEDIA_MAX_BYTES", 500 * 1024 * 1024))
+)
+
+def prepare_attachment(data):
+    """
+    Runs data['file'] through the attachment pipeline. Text files are indexed
+    rather than sent: their digest goes to data['documents'] for chat_history().
+    Returns an error reply, or None.
+    """
+    try:
+        data['file'] = attachments.process(data.get('file'))
+    except AttachmentError as e:
+        return {"response": f"⚠️ {e}", "emotion": "Neutral"}
+    file_data = data.get('file')
+    if file_data and file_data.get('isText') and file_data.get('data'):
+        data['documents'] = [documents.add(file_data, conversation_key(data))]
+        data['file'] = None
+    return None
+
+def keeps_turn(result):
+    """
+    Whether an intent's reply belongs in the conversation history. Service
+    failures ("⚠️ … unavailable", "Error fetching …") and fan-out parts still
+    pending would be sent back to the model as context, so they are not kept.
+    """
+    return not result.get("pending") and metrics.text_outcome(result.get("response")) == "ok"
+
+def chat_history(data, conversation, prompt):
+    """Earlier turns of the conversation plus the excerpts of its documents that match the prompt."""
+    history = conversations.build(*conversation) if conversation else None
+    excerpts = documents.context(prompt, conversation, data.get('documents') or ())
+    if excerpts:
+        history = (history or []) + [{"role": "system", "content": excerpts}]
+    return history
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"response": "⚠️ The attachment is too large to upload.", "emotion": "Neutral"}), 413
+
+CHAT_ID = re.compile(r"[0-9a-f]{32}")
+
+def conversation_key(data):
+    """
+    (user_id, chat_id) for a signed-in user's chat, otherwise None: anonymous
+    requests keep no history. The user comes from the verified access token,
+    never from the request body, and chat ids are random ones issued here;
+    anything else (such as an old client's timestamp id) gets a new one, which
+    replaces data['chat_id'] and goes back to the client with the answer.
+    """
+    user = current_user()
+    if not user:
+        return None
+    chat_id = str(data.get('chat_id') or "")
+    if not CHAT_ID.fullmatch(chat_id):
+        chat_id = data['chat_id'] = uuid.uuid4().hex
+    return user["id"], chat_id
+
+def with_chat_id(result, conversation):
+    # A copy, since the result may be a cached answer shared with other chats
+    return dict(result, chat_id=conversation[1]) if conversation else result
+
 # Initialize Image Assistant
 IMAGEN_API_KEY = os.getenv("IMAGEN_API_KEY")
 IMAGEN_MODEL = os.getenv("IMAGEN_MODEL")
@@ -93,10 +325,171 @@ if STABILITY_API_KEY:
 RUNWAYML_API_KEY = os.getenv("RUNWAYML_API_KEY")
 runway_assistant = None
 
+video_jobs = None
+
 if RUNWAYML_API_KEY:
-    runway_assistant = RunwayClient(RUNWAYML_API_KEY)
+    runway_assistant = services.register(
+        "runway", lambda: RunwayClient(RUNWAYML_API_KEY),
+        setup=lambda client: instrument(client, "runway", ["start_video", "get_task_status", "generate_video"], text_outcome)
+    )
+    # Videos render in the background; /ask returns a job id and /jobs/<id> reports progress
+    video_jobs = VideoJobPoller(
+        runway_assistant, VideoJobStore(os.getenv("VIDEO_JOBS_DB", "video_jobs.db")),
+        max_age=float(os.getenv("VIDEO_JOB_MAX_AGE", 1800))
+    )
+    video_jobs.start()
     logger.info("RunwayML Video AI enabled")
 
+# Open pooled keep-alive connections to every configured HTTP provider in the background,
+# so the first chat turn doesn't pay the TCP+TLS handshake
+if os.getenv("HTTP_PREWARM", "1") == "1":
+    http_clients = [weather, news, crypto, stock, *getattr(ai_assistant, "providers", [ai_assistant]),
+                    imagen_assistant, stability_assistant]
+    get_transport().prewarm([
+        client.base_url for client in http_clients
+        if client is not None and getattr(client, "api_key", None) and hasattr(client, "http")
+    ])
+
+# Profile pictures are kept as thumbnails on disk; user_metadata only holds a short URL
+avatars = AvatarStore(directory=os.getenv("AVATAR_DIR", "avatars"))
+
+# Latency/outcome histograms per upstream client method, exported at /metrics.
+# Methods are wrapped on the instances, so the clients stay unaware of metrics.
+instrument(weather, "openweather", ["get_weather"], text_outcome)
+instrument(news, "newsapi", {"get_top_news": text_outcome, "fetch_headlines": None})
+instrument(crypto, "coinmarketcap", ["get_price", "get_top_cryptos"], text_outcome)
+instrument(stock, "alphavantage", {"get_stock_price": text_outcome, "get_market_news": text_outcome, "fetch_market_news": None})
+instrument(youtube, "youtube", ["search_videos", "get_trending_videos"], text_outcome)
+instrument(imagen_assistant, "imagen", ["generate_image"], text_outcome)
+instrument(stability_assistant, "stability", ["generate_image"], text_outcome)
+LLM_METHODS = {"respond": pair_outcome, "fetch_full_response": pair_outcome, "stream_full_response": stream_outcome}
+for provider in getattr(ai_assistant, "providers", []):
+    instrument(provider, ProviderRouter._name(provider), LLM_METHODS)
+instrument(ai_assistant, "llm", LLM_METHODS)
+
+@metrics.REGISTRY.collector
+def cache_metrics():
+    caches = [
+        ("weather", weather.cache.stats(), ("hits", "stale_hits", "negative_hits", "misses", "refreshes")),
+        ("crypto", crypto.broker.stats(), ("requests", "cache_hits", "coalesced", "batches", "errors")),
+        ("stock", stock_scheduler.stats(), ("granted", "queued", "rejected", "served_stale")),
+        ("attachments", attachments.stats(), ("images", "cache_hits", "resized", "rejected")),
+        ("media", media_store.stats(), ("stored", "deduplicated", "evicted")),
+        ("documents", documents.stats(), ("indexed", "reused", "queries")),
+        ("youtube_search", youtube.search_cache.stats(), ("hits", "stale_hits", "negative_hits", "misses", "refreshes")),
+        ("news", news_feed.stats(), ("hits", "misses", "refreshes", "ingested", "duplicates", "skipped_old")),
+    ]
+    if response_cache:
+        caches.append(("llm", response_cache.stats(), ("hits", "misses", "stores", "evictions", "expired")))
+    if auth:
+        caches.append(("auth_tokens", auth.stats(), ("hits", "misses", "verified", "evicted")))
+    samples = [({"cache": name, "event": event}, stats[event]) for name, stats, events in caches for event in events]
+    return [("cache_events_total", "counter", "Cache hits, misses and related events per cache.", samples)]
+
+def prompt_usage():
+    """Token usage per chat provider, keyed by the same names as the upstream metrics."""
+    clients = getattr(ai_assistant, "providers", [ai_assistant])
+    return {ProviderRouter._name(client): client.usage.stats() for client in clients if hasattr(client, "usage")}
+
+@metrics.REGISTRY.collector
+def prompt_cache_metrics():
+    usage = prompt_usage()
+    kinds = ("prompt_tokens", "cached_tokens", "cache_write_tokens", "completion_tokens")
+    return [
+        ("llm_tokens_total", "counter", "Tokens reported by the chat providers; cached_tokens were served from the provider's prompt cache.",
+         [({"upstream": name, "kind": kind}, stats[kind]) for name, stats in usage.items() for kind in kinds]),
+        ("llm_calls_total", "counter", "Chat calls with token usage, and how many of them hit the provider's prompt cache.",
+         [({"upstream": name, "prompt_cache": cache}, stats[key]) for name, stats in usage.items()
+          for cache, key in (("any", "calls"), ("hit", "calls_with_cache_hit"))]),
+    ]
+
+@metrics.REGISTRY.collector
+def upstream_guard_metrics():
+    guards = guard_stats()
+    return [
+        ("upstream_circuit_open", "gauge", "1 while the upstream's circuit breaker is open or half-open.",
+         [({"upstream": name}, int(stats["state"] != "closed")) for name, stats in guards.items()]),
+        ("upstream_rejected_total", "counter", "Calls rejected without reaching the upstream.",
+         [({"upstream": name, "reason": reason}, stats[key]) for name, stats in guards.items()
+          for reason, key in (("circuit_open", "rejected"), ("bulkhead_full", "bulkhead_rejected"))]),
+    ]
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    metrics.set_intent("none")
+
+@app.before_request
+def warm_up_services():
+    # A request means the server is accepting traffic: build the lazy clients in the background now
+    if os.getenv("SERVICE_WARM_UP", "1") == "1":
+        services.warm_up()
+
+LOGIN_REQUIRED = "Please log in to chat."
+CHAT_ROUTES = ("/ask", "/ask/stream")
+# Only these act as the user; elsewhere (e.g. /login with a stale token) the header is ignored
+AUTH_ROUTES = (*CHAT_ROUTES, "/update_profile")
+
+def auth_error(message):
+    # Readable by the chat UI (response/emotion) as well as by API clients (error)
+    return {"error": message, "response": f"⚠️ {message}", "emotion": "Neutral"}
+
+def check_auth(header, route):
+    """(user or None, None) for an Authorization header, or (None, 401 body)."""
+    if route not in AUTH_ROUTES:
+        return None, None
+    try:
+        user = auth.authenticate(header) if auth else None
+    except AuthError as e:
+        return None, auth_error(str(e))
+    if user is None and AUTH_REQUIRED and route in CHAT_ROUTES:
+        return None, auth_error(LOGIN_REQUIRED)
+    return user, None
+
+@app.before_request
+def authenticate_request():
+    # Once a token has been verified, later requests with it are an LRU lookup
+    user, error = check_auth(request.headers.get("Authorization"), request.path)
+    set_user(user)
+    if error:
+        return jsonify(error), 401
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    status = response.status_code
+    labels = (
+        request.url_rule.rule if request.url_rule else "unmatched", request.method, str(status),
+        metrics.current_intent(), "ok" if status < 400 else "client_error" if status < 500 else "error"
+    )
+    # Observed on close, so streamed responses are timed until the last event is sent
+    response.call_on_close(lambda: metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, *labels))
+    return response
+
+@app.teardown_request
+def count_request_exception(exc):
+    if exc is not None:
+        metrics.REQUEST_EXCEPTIONS.inc(request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of the request, upstream and cache metrics of this worker."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/avatars/<avatar_id>', methods=['GET'])
+def avatar(avatar_id):
+    size = request.args.get('s', type=int)
+    path = avatars.lookup(avatar_id, size)
+    if not path:
+        return jsonify({"error": "Not found"}), 404
+    # The id is a content hash, so each thumbnail can be cached forever
+    etag = os.path.basename(path).rsplit(".", 1)[0]
+    response = send_file(path, conditional=True, etag=etag, max_age=31536000)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -112,6 +505,11 @@ def signup():
     full_name = data.get('full_name', '')
     avatar_url = data.get('avatar_url', '')
     
+    # Anyone can call /signup, so it writes nothing to disk: a picture chosen here is
+    # uploaded through /update_profile once the user has signed in
+    if avatars.is_inline(avatar_url):
+        avatar_url = ''
+
     try:
         response = supabase.auth.sign_up({
             "email": email, 
@@ -160,6 +558,13 @@ def login():
             user_metadata = response.user.user_metadata or {}
             full_name = user_metadata.get('full_name', '')
             avatar_url = user_metadata.get('avatar_url', '')
+            if avatars.is_inline(avatar_url):
+                # Not migrated yet (see migrate_avatars.py); at least keep the response small
+                try:
+                    avatar_url = avatars.save(avatar_url)
+                except AvatarError as e:
+                    logger.warning(f"Dropping unreadable avatar: {e}")
+                    avatar_url = ''
             
             return jsonify({
                 "message": "Login successful", 
@@ -184,17 +589,21 @@ def update_profile():
     if not supabase:
         return jsonify({"error": "Supabase not configured"}), 500
 
+    # Only the signed-in user's own profile, whatever user_id the body names
+    user = current_user()
+    if not user:
+        return jsonify({"error": "Please log in to update your profile."}), 401
+
     data = request.json
-    user_id = data.get('user_id')
+    user_id = user["id"]
     avatar_url = data.get('avatar_url')
     full_name = data.get('full_name')
-    
-    if not user_id:
-        return jsonify({"error": "Missing user_id"}), 400
         
     try:
         update_data = {}
         if avatar_url:
+            if avatars.is_inline(avatar_url):
+                avatar_url = avatars.save(avatar_url)
             update_data["avatar_url"] = avatar_url
         if full_name:
             update_data["full_name"] = full_name
@@ -204,184 +613,279 @@ def update_profile():
 
         # Update user metadata via admin API (assuming server key has permissions)
         supabase.auth.admin.update_user_by_id(user_id, {"user_metadata": update_data})
-        return jsonify({"message": "Profile updated successfully"}), 200
+        return jsonify({"message": "Profile updated successfully", "avatar_url": update_data.get("avatar_url")}), 200
+    except AvatarError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"UPDATE PROFILE ERROR: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# --- Intent dispatch ---
+# Intents (intents.py) are matched in priority order; a handler returning None falls through to the LLM.
+# Prompts asking for several parallel intents at once run them concurrently and merge the answers.
+fan_out = None
+if os.getenv("FAN_OUT", "1") == "1":
+    fan_out = FanOut(
+        max_workers=int(os.getenv("FAN_OUT_THREADS", 8)),
+        deadline=float(os.getenv("FAN_OUT_DEADLINE", 4.0)),
+        max_parts=int(os.getenv("FAN_OUT_MAX_PARTS", 5))
+    )
+router = build_router(on_match=metrics.set_intent, fan_out=fan_out)
+
+@router.handles("screenshot")
+def handle_screenshot(slots, data):
+    system.take_screenshot()
+    return {"response": "Screenshot taken successfully.", "emotion": "Neutral"}
+
+@router.handles("camera")
+def handle_camera(slots, data):
+    system.capture_camera()
+    return {"response": "Camera image captured.", "emotion": "Neutral"}
+
+@router.handles("open_app")
+def handle_open_app(slots, data):
+    return {"response": system.open_app(slots["app"]), "emotion": "Neutral"}
+
+@router.handles("weather")
+def handle_weather(slots, data):
+    city = slots["city"] or "London" # Default
+    return {"response": weather.get_weather(city), "emotion": "Neutral"}
+
+@router.handles("news")
+def handle_news(slots, data):
+    return {"response": news_feed.top_news(), "emotion": "Neutral"}
+
+@router.handles("stock")
+def handle_stock(slots, data):
+    if slots["symbol"]:
+        return {"response": stock.get_stock_price(slots["symbol"]), "emotion": "Neutral"}
+    return {"response": news_feed.market_news(), "emotion": "Neutral"}
+
+@router.handles("crypto_price")
+def handle_crypto_price(slots, data):
+    symbol = slots["symbol"]
+    if not symbol:
+        return None
+    # Map common names to symbols
+    symbol = CRYPTO_NAMES.get(symbol.lower(), symbol)
+    return {"response": crypto.get_price(symbol), "emotion": "Neutral"}
+
+@router.handles("crypto_top")
+def handle_crypto_top(slots, data):
+    return {"response": crypto.get_top_cryptos(), "emotion": "Neutral"}
+
+@router.handles("youtube")
+def handle_youtube(slots, data):
+    if slots["trending"]:
+        return {"response": youtube.get_trending_videos(), "emotion": "Happy"}
+    if not slots["query"]:
+        return {"response": "What would you like to search for on YouTube?", "emotion": "Neutral"}
+    return {"response": youtube.search_videos(slots["query"]), "emotion": "Happy"}
+
+@router.handles("image")
+def handle_image(slots, data):
+    active_image_assistant = stability_assistant or imagen_assistant
+
+    if not active_image_assistant:
+        return {"response": "Image generation is not configured. Please add an API key.", "emotion": "Neutral"}
+
+    if not slots["prompt"]:
+        return {"response": "Please provide a description for the image.", "emotion": "Neutral"}
+
+    return image_reply(active_image_assistant.generate_image(slots["prompt"]))
+
+def image_reply(image_url):
+    """The /ask answer for a generated image (URL or data URL), or the apology when there is none."""
+    if image_url:
+        preview_url = None
+        if image_url.startswith("data:"):
+            media = media_store.put_data_url(image_url)
+            image_url, preview_url = media["url"], media["preview_url"]
+        return {
+            "response": f"I've generated that image for you! ![Generated Image]({image_url})",
+            "emotion": "Happy",
+            "image_url": image_url,
+            "preview_url": preview_url
+        }
+    return {"response": "I'm sorry, I couldn't generate that image right now.", "emotion": "Sad"}
+
+@router.handles("video")
+def handle_video(slots, data):
+    if not runway_assistant:
+        return {"response": "Video generation is not configured. Please add a RunwayML API key.", "emotion": "Neutral"}
+
+    prompt = video_prompt(slots, data)
+    return video_reply(video_jobs.submit(prompt, image_url=video_source_image(data.get('file'))))
+
+def video_prompt(slots, data):
+    prompt = slots["prompt"]
+    if not prompt:
+        prompt = "Animate this image" if data.get('file') else "A cinematic scene"
+    return prompt
+
+def video_source_image(file_data):
+    if file_data and file_data.get('type', '').startswith('image/'):
+        return file_data.get('data') # This is the base64 data URL
+    return None
+
+def video_reply(job_id):
+    if job_id:
+        return {
+            "response": "I'm generating that video for you! It usually takes a minute or two, and it will appear here as soon as it's ready.",
+            "emotion": "Happy",
+            "job_id": job_id
+        }
+    return {"response": "I'm sorry, I couldn't generate that video right now. There might be an issue with the service.", "emotion": "Sad"}
+
+def video_job_json(job):
+    result = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "updated_at": job["updated_at"]
+    }
+    if job["status"] == "SUCCEEDED":
+        video_url = job["video_url"]
+        result["video_url"] = video_url
+        result["response"] = f"I've generated that video for you! \n\n<video controls width='100%' style='border-radius:10px; margin-top:10px;'><source src='{video_url}' type='video/mp4'>Your browser does not support the video tag.</video>"
+        result["emotion"] = "Happy"
+    elif job["status"] in ("FAILED", "CANCELLED"):
+        result["error"] = job["error"]
+        result["response"] = "I'm sorry, I couldn't generate that video right now. It might take a few minutes or there might be an issue with the service."
+        result["emotion"] = "Sad"
+    return result
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = video_jobs.store.get(job_id) if video_jobs else None
+    if not job:
+        return jsonify({"error": "Unknown job"}), 404
+
+    # Optional long-poll: ?wait=<seconds>&since=<updated_at> returns as soon as the job changes
+    wait = request.args.get('wait', type=float)
+    if wait:
+        since = request.args.get('since', type=float) or job["updated_at"]
+        job = video_jobs.store.wait_for_change(job_id, since, timeout=min(wait, 30))
+
+    return jsonify(video_job_json(job))
+
+@app.route('/media/<name>', methods=['GET'])
+def media(name):
+    """Serves stored media; names are content hashes, so responses never change."""
+    found = media_store.lookup(name)
+    if not found:
+        return jsonify({"error": "Not found"}), 404
+    path, etag = found
+    # conditional=True answers If-None-Match with 304 and Range with 206
+    response = send_file(path, conditional=True, etag=etag, max_age=31536000)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
 @app.route('/ask', methods=['POST'])
 def ask():
     data = request.json
-    user_input = data.get('prompt')
-    
-    # Check for system commands first (conceptual)
-    if "screenshot" in user_input.lower():
-        system.take_screenshot()
-        return jsonify({"response": "Screenshot taken successfully.", "emotion": "Neutral"})
-    elif "camera" in user_input.lower() or "photo" in user_input.lower():
-        system.capture_camera()
-        return jsonify({"response": "Camera image captured.", "emotion": "Neutral"})
-    elif "open" in user_input.lower():
-        app_name = user_input.lower().split("open")[-1].strip()
-        response_text = system.open_app(app_name)
-        return jsonify({"response": response_text, "emotion": "Neutral"})
-    elif "weather" in user_input.lower():
-        # Try to extract city name
-        words = user_input.lower().split()
-        city = "London" # Default
-        if "in" in words:
-            try:
-                city = user_input.lower().split("in")[-1].strip().strip('?').strip('.')
-            except:
-                pass
-        elif "for" in words:
-            try:
-                city = user_input.lower().split("for")[-1].strip().strip('?').strip('.')
-            except:
-                pass
-        
-        weather_info = weather.get_weather(city)
-        return jsonify({"response": weather_info, "emotion": "Neutral"})
-    elif "news" in user_input.lower():
-        news_info = news.get_top_news()
-        return jsonify({"response": news_info, "emotion": "Neutral"})
-    elif "price of" in user_input.lower() or "price for" in user_input.lower():
-        # Try to extract crypto symbol
-        words = user_input.lower().split()
-        symbol = None
-        if "of" in words:
-            symbol = words[words.index("of") + 1].strip("?").strip(".")
-        elif "for" in words:
-            symbol = words[words.index("for") + 1].strip("?").strip(".")
-        
-        if symbol:
-            # Map common names to symbols
-            mapping = {"bitcoin": "BTC", "ethereum": "ETH", "solana": "SOL", "dogecoin": "DOGE", "cardano": "ADA"}
-            symbol = mapping.get(symbol, symbol)
-            
-            crypto_info = crypto.get_price(symbol)
-            return jsonify({"response": crypto_info, "emotion": "Neutral"})
-    elif "crypto" in user_input.lower() or "cryptocurrency" in user_input.lower():
-         top_cryptos = crypto.get_top_cryptos()
-         return jsonify({"response": top_cryptos, "emotion": "Neutral"})
-    elif "stock" in user_input.lower() or "share price" in user_input.lower():
-        # Try to extract stock symbol
-        words = user_input.lower().split()
-        symbol = None
-        if "of" in words:
-            symbol = words[words.index("of") + 1].strip("?").strip(".")
-        elif "for" in words:
-            symbol = words[words.index("for") + 1].strip("?").strip(".")
-        elif words:
-            # Fallback to last word if it looks like a ticker (e.g. "Price of aapl")
-            # But the logic above already handles "of" and "for"
-            pass
-        
-        if symbol:
-            stock_info = stock.get_stock_price(symbol)
-            return jsonify({"response": stock_info, "emotion": "Neutral"})
-        else:
-            news_info = stock.get_market_news()
-            return jsonify({"response": news_info, "emotion": "Neutral"})
-    
-    elif "youtube" in user_input.lower():
-        if "trending" in user_input.lower() or "popular" in user_input.lower():
-            trending = youtube.get_trending_videos()
-            return jsonify({"response": trending, "emotion": "Happy"})
-        
-        # Extract search query
-        query = user_input.lower().replace("youtube", "").replace("search", "").replace("find", "").strip()
-        if not query:
-            return jsonify({"response": "What would you like to search for on YouTube?", "emotion": "Neutral"})
-        
-        results = youtube.search_videos(query)
-        return jsonify({"response": results, "emotion": "Happy"})
-    
-    elif "generate" in user_input.lower() and "image" in user_input.lower():
-        active_image_assistant = stability_assistant or imagen_assistant
-        
-        if not active_image_assistant:
-            return jsonify({"response": "Image generation is not configured. Please add an API key.", "emotion": "Neutral"})
-        
-        # Extract prompt
-        prompt = user_input.lower().replace("generate", "").replace("an", "").replace("image", "").replace("of", "").strip()
-        if not prompt:
-             return jsonify({"response": "Please provide a description for the image.", "emotion": "Neutral"})
-        
-        image_data = active_image_assistant.generate_image(prompt)
-        if image_data:
-            return jsonify({
-                "response": f"I've generated that image for you! ![Generated Image]({image_data})",
-                "emotion": "Happy",
-                "image_data": image_data
-            })
-        else:
-            return jsonify({"response": "I'm sorry, I couldn't generate that image right now.", "emotion": "Sad"})
-    
-    # Image Generation
-    elif any(word in user_input.lower() for word in ["generate image", "create image", "make image", "draw", "paint"]):
-        active_image_assistant = stability_assistant or imagen_assistant
-        
-        if not active_image_assistant:
-            return jsonify({"response": "Image generation is not configured. Please add an API key.", "emotion": "Neutral"})
-        
-        # Extract prompt - remove trigger words
-        prompt = user_input.lower()
-        for word in ["generate", "create", "make", "an", "image", "of", "draw", "paint", "me"]:
-            prompt = prompt.replace(word, "")
-        prompt = prompt.strip()
-        
-        if not prompt:
-             return jsonify({"response": "Please provide a description for the image.", "emotion": "Neutral"})
-        
-        image_data = active_image_assistant.generate_image(prompt)
-        if image_data:
-            return jsonify({
-                "response": f"I've generated that image for you! ![Generated Image]({image_data})",
-                "emotion": "Happy",
-                "image_data": image_data
-            })
-        else:
-            return jsonify({"response": "I'm sorry, I couldn't generate that image right now.", "emotion": "Sad"})
-    
-    # Video Generation
-    elif any(word in user_input.lower() for word in ["generate video", "create video", "make video", "animate"]):
-        if not runway_assistant:
-            return jsonify({"response": "Video generation is not configured. Please add a RunwayML API key.", "emotion": "Neutral"})
-        
-        # Extract prompt
-        prompt = user_input.lower()
-        for word in ["generate", "create", "make", "a", "video", "of", "animate", "me"]:
-            prompt = prompt.replace(word, "")
-        prompt = prompt.strip()
-        
-        if not prompt:
-            prompt = "Animate this image" if data.get('file') else "A cinematic scene"
-            
-        file_data = data.get('file')
-        image_url = None
-        if file_data and file_data.get('type', '').startswith('image/'):
-            image_url = file_data.get('data') # This is the base64 data URL
-        
-        # If it's just 'animate' and there's a file, but no text, prompt might be empty
-        video_url = runway_assistant.generate_video(prompt, image_url=image_url)
-        if video_url:
-            return jsonify({
-                "response": f"I've generated that video for you! \n\n<video controls width='100%' style='border-radius:10px; margin-top:10px;'><source src='{video_url}' type='video/mp4'>Your browser does not support the video tag.</video>",
-                "emotion": "Happy",
-                "video_url": video_url
-            })
-        else:
-            return jsonify({"response": "I'm sorry, I couldn't generate that video right now. It might take a few minutes or there might be an issue with the service.", "emotion": "Sad"})
+    user_input = data.get('prompt') or ""
+    conversation = conversation_key(data)
+
+    error = prepare_attachment(data)
+    if error:
+        return jsonify(with_chat_id(error, conversation))
+    result = router.dispatch(user_input, data)
+    if result is not None:
+        if conversation and keeps_turn(result):
+            conversations.record(*conversation, user_input, result.get("response", ""))
+        return jsonify(with_chat_id(result, conversation))
 
     # Get combined response and emotion in ONE call
+    metrics.set_intent("chat")
     file_data = data.get('file')
-    result = ai_assistant.get_full_response(user_input, file_data=file_data)
-    
-    return jsonify({
+    history = chat_history(data, conversation, user_input)
+    result, ok = ai_assistant.respond(user_input, file_data=file_data, history=history)
+    if conversation and ok:
+        conversations.record(*conversation, user_input, result["response"])
+
+    return jsonify(with_chat_id({
         "response": result["response"],
         "emotion": result["emotion"]
+    }, conversation))
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss/refresh counters for the service caches, used to size them."""
+    return jsonify({
+        "weather": weather.cache.stats(),
+        "crypto": crypto.broker.stats(),
+        "stock": stock_scheduler.stats(),
+        "llm": response_cache.stats() if response_cache else None,
+        "prompt_cache": prompt_usage(),
+        "attachments": attachments.stats(),
+        "media": media_store.stats(),
+        "documents": documents.stats(),
+        "youtube": youtube.stats(),
+        "news": news_feed.stats(),
+        "auth": auth.stats() if auth else None
     })
 
+@app.route('/upstream_stats', methods=['GET'])
+def upstream_stats():
+    """Circuit breaker state, failure/slow rates and bulkhead occupancy/rejections per upstream API."""
+    return jsonify(guard_stats())
+
+@app.route('/service_stats', methods=['GET'])
+def service_stats():
+    """Which lazily built clients exist yet, whether a request or the warm-up built them, and how long it took."""
+    return jsonify(services.stats())
+
+@app.route('/provider_stats', methods=['GET'])
+def provider_stats():
+    """Per-provider latency percentiles, error rates, hedges and ejections."""
+    if not isinstance(ai_assistant, ProviderRouter):
+        return jsonify({"error": "Provider routing is not enabled"}), 404
+    return jsonify(ai_assistant.stats())
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/ask/stream', methods=['POST'])
+def ask_stream():
+    """
+    Server-sent-event variant of /ask. LLM answers arrive as `delta` events carrying
+    text as it is generated; a final `done` event carries the same JSON as /ask.
+    """
+    data = request.json
+    user_input = data.get('prompt') or ""
+    conversation = conversation_key(data)
+
+    error = prepare_attachment(data)
+    result = error or router.dispatch(user_input, data)
+    if result is None:
+        metrics.set_intent("chat")
+
+    def generate():
+        if result is not None:
+            if conversation and not error and keeps_turn(result):
+                conversations.record(*conversation, user_input, result.get("response", ""))
+            yield sse_event("done", with_chat_id(result, conversation))
+            return
+        history = chat_history(data, conversation, user_input)
+        for kind, payload in ai_assistant.stream_full_response(user_input, file_data=data.get('file'), history=history):
+            if kind == "delta":
+                yield sse_event("delta", {"text": payload})
+            else:
+                # An "error" event carries a message for the user, not an answer worth remembering
+                if conversation and kind == "done":
+                    conversations.record(*conversation, user_input, payload["response"])
+                yield sse_event("done", with_chat_id(payload, conversation))
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+if os.getenv("LAZY_SERVICES", "1") != "1":
+    # Build every client now, as startup used to: slower, but configuration errors show up immediately
+    services.warm_up().join()
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,321 @@
+"""
+ASGI entry point: asyncio serving for the chat path.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+/ask and /ask/stream run on the event loop with the Async* client variants,
+which share one httpx connection pool, so a single process can hold hundreds
+of in-flight LLM calls instead of one per worker thread. Every other route is
+the Flask app's, served through asgiref's WSGI adapter, and the request and
+response JSON is the same as with `python app.py`.
+
+Work without an async client runs in a bounded thread pool (ASGI_THREADS):
+crypto quote batching, the Alpha Vantage quota queue, YouTube's discovery
+client, local system control, attachment decoding and the SQLite stores.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as web
+import metrics
+import token_auth
+from async_transport import get_async_transport
+from gemini_client import GeminiClient, AsyncGeminiClient
+from imagen_client import AsyncImagenClient
+from metrics import instrument, text_outcome, pair_outcome, stream_outcome
+from openrouter_client import OpenRouterClient, AsyncOpenRouterClient
+from provider_router import ProviderRouter, AsyncProviderRouter
+from runway_client import AsyncRunwayClient
+from stability_client import AsyncStabilityClient
+from weather_service import AsyncWeatherService
+
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("ASGI_THREADS", 32)), thread_name_prefix="asgi")
+
+
+async def in_thread(fn, *args):
+    """Runs blocking work in the pool, keeping the request's context (metrics labels)."""
+    return await asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+
+def async_llm(client):
+    """The async counterpart of one of app.py's chat clients, sharing its response cache and token usage."""
+    if isinstance(client, ProviderRouter):
+        return AsyncProviderRouter.from_router(client, [async_llm(provider) for provider in client.providers])
+    if isinstance(client, OpenRouterClient):
+        async_client = AsyncOpenRouterClient(client.api_key, client.model, cache=client.cache)
+    elif isinstance(client, GeminiClient):
+        async_client = AsyncGeminiClient(web.API_KEY, cache=client.cache)
+    else:
+        raise TypeError(f"No async variant for {type(client).__name__}")
+    async_client.usage = client.usage
+    return async_client
+
+
+# Async clients share caches, circuit breakers and stats with the sync ones in app.py
+weather = AsyncWeatherService(os.getenv("OPENWEATHER_API_KEY"), cache=web.weather.cache)
+image_assistant = None
+if web.stability_assistant:
+    image_assistant = AsyncStabilityClient(web.STABILITY_API_KEY, web.STABILITY_MODEL)
+elif web.imagen_assistant:
+    image_assistant = AsyncImagenClient(web.IMAGEN_API_KEY, web.IMAGEN_MODEL)
+runway = None
+if web.runway_assistant:
+    runway = web.services.register(
+        "runway_async", lambda: AsyncRunwayClient(web.RUNWAYML_API_KEY),
+        setup=lambda client: instrument(client, "runway", ["start_video"], text_outcome)
+    )
+ai_assistant = async_llm(web.ai_assistant)
+
+instrument(weather, "openweather", ["get_weather"], text_outcome)
+instrument(image_assistant, "stability" if web.stability_assistant else "imagen", ["generate_image"], text_outcome)
+LLM_METHODS = {"respond": pair_outcome, "fetch_full_response": pair_outcome, "stream_full_response": stream_outcome}
+for provider in getattr(ai_assistant, "providers", []):
+    instrument(provider, ProviderRouter._name(provider), LLM_METHODS)
+instrument(ai_assistant, "llm", LLM_METHODS)
+
+
+# --- Intent handlers with an async client; every other intent runs app.py's handler in the pool ---
+
+async def handle_weather(slots, data):
+    city = slots["city"] or "London" # Default
+    return {"response": await weather.get_weather(city), "emotion": "Neutral"}
+
+async def handle_news(slots, data):
+    # Answered from the aggregator's store; only a feed's very first request waits on NewsAPI, in the pool
+    text = web.news_feed.top_news(wait=False)
+    if text is None:
+        text = await in_thread(web.news_feed.top_news)
+    return {"response": text, "emotion": "Neutral"}
+
+async def handle_image(slots, data):
+    if not slots["prompt"]:
+        return {"response": "Please provide a description for the image.", "emotion": "Neutral"}
+    image_url = await image_assistant.generate_image(slots["prompt"])
+    # Storing the image and its preview is disk work
+    return await in_thread(web.image_reply, image_url)
+
+async def handle_video(slots, data):
+    # The first use builds the SDK client (imports included), so do that in the pool, not on the loop
+    client = await in_thread(web.services.get, "runway_async")
+    task_id = await client.start_video(web.video_prompt(slots, data), image_url=web.video_source_image(data.get('file')))
+    job_id = await in_thread(web.video_jobs.track, task_id, web.video_prompt(slots, data)) if task_id else None
+    return web.video_reply(job_id)
+
+ASYNC_HANDLERS = {"weather": handle_weather, "news": handle_news}
+if image_assistant:
+    ASYNC_HANDLERS["image"] = handle_image
+if runway:
+    ASYNC_HANDLERS["video"] = handle_video
+
+
+# Fan-out parts left running past the deadline
+background = set()
+
+
+async def run_part(match, data):
+    handler = ASYNC_HANDLERS.get(match.name)
+    if handler:
+        return await handler(match.slots, data)
+    return await in_thread(match.intent.handler, match.slots, data)
+
+
+async def fan_out(matches, data):
+    """Async FanOut.run(): parts are tasks, and one still running at the deadline is reported as pending."""
+    matches = matches[:web.fan_out.max_parts]
+    tasks = [asyncio.ensure_future(run_part(match, data)) for match in matches]
+    done, pending = await asyncio.wait(tasks, timeout=web.fan_out.deadline)
+    for task in pending:
+        # Let it finish and fill the service's cache; keep a reference so it isn't collected
+        background.add(task)
+        task.add_done_callback(background.discard)
+    outcomes = [
+        ("pending", None) if task not in done else ("error", task.exception()) if task.exception() else ("done", task.result())
+        for task in tasks
+    ]
+    return web.fan_out.merge(matches, outcomes)
+
+
+async def dispatch(user_input, data):
+    """Async IntentRouter.dispatch(): returns the handler's result, or None to fall back to the LLM."""
+    if web.fan_out:
+        matches = web.router.match_all(user_input)
+    else:
+        found = web.router.match(user_input)
+        matches = [found] if found else []
+    if len(matches) > 1:
+        metrics.set_intent("multi")
+        return await fan_out(matches, data)
+
+    if not matches:
+        return None
+    found = matches[0]
+    metrics.set_intent(found.name)
+    return await run_part(found, data)
+
+
+async def prepare(data):
+    """Attachment check plus intent dispatch, as at the top of app.ask(). Returns (reply or None, attachment error)."""
+    if data.get('file'):
+        error = await in_thread(web.prepare_attachment, data)
+        if error:
+            return error, error
+    return await dispatch(data.get('prompt') or "", data), None
+
+
+async def ask(data, send):
+    user_input = data.get('prompt') or ""
+    conversation = web.conversation_key(data)
+
+    result, error = await prepare(data)
+    if result is not None:
+        if conversation and not error and web.keeps_turn(result):
+            await in_thread(web.conversations.record, *conversation, user_input, result.get("response", ""))
+        return await send_json(send, 200, web.with_chat_id(result, conversation))
+
+    metrics.set_intent("chat")
+    history = await in_thread(web.chat_history, data, conversation, user_input)
+    result, ok = await ai_assistant.respond(user_input, file_data=data.get('file'), history=history)
+    if conversation and ok:
+        await in_thread(web.conversations.record, *conversation, user_input, result["response"])
+
+    return await send_json(send, 200, web.with_chat_id({
+        "response": result["response"],
+        "emotion": result["emotion"]
+    }, conversation))
+
+
+async def ask_stream(data, send):
+    user_input = data.get('prompt') or ""
+    conversation = web.conversation_key(data)
+
+    result, error = await prepare(data)
+    await send_start(send, 200, "text/event-stream", [(b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")])
+    if result is not None:
+        if conversation and not error and web.keeps_turn(result):
+            await in_thread(web.conversations.record, *conversation, user_input, result.get("response", ""))
+        return await send_body(send, web.sse_event("done", web.with_chat_id(result, conversation)), more=False)
+
+    metrics.set_intent("chat")
+    history = await in_thread(web.chat_history, data, conversation, user_input)
+    async for kind, payload in ai_assistant.stream_full_response(user_input, file_data=data.get('file'), history=history):
+        if kind == "delta":
+            await send_body(send, web.sse_event("delta", {"text": payload}))
+        else:
+            if conversation and kind == "done":
+                await in_thread(web.conversations.record, *conversation, user_input, payload["response"])
+            await send_body(send, web.sse_event("done", web.with_chat_id(payload, conversation)))
+    await send_body(send, "", more=False)
+
+
+# --- Minimal ASGI plumbing for the native routes ---
+
+async def send_start(send, status, content_type, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"access-control-allow-origin", b"*"), *headers]
+    })
+
+async def send_body(send, text, more=True):
+    await send({"type": "http.response.body", "body": text.encode(), "more_body": more})
+
+async def send_json(send, status, payload):
+    # Same serializer as jsonify(), so both entry points return identical bytes
+    await send_start(send, status, "application/json")
+    await send_body(send, web.app.json.dumps(payload) + "\n", more=False)
+    return status
+
+
+async def read_json(receive):
+    """Returns (data, error status). Enforces MAX_CONTENT_LENGTH like Flask does."""
+    limit = web.app.config.get("MAX_CONTENT_LENGTH")
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None, 499
+        body += message.get("body", b"")
+        if limit and len(body) > limit:
+            return None, 413
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body or b"null")
+    except ValueError:
+        return None, 400
+    return (data, None) if isinstance(data, dict) else (None, 400)
+
+
+NATIVE_ROUTES = {"/ask": ask, "/ask/stream": ask_stream}
+flask_asgi = WsgiToAsgi(web.app)
+
+
+async def authenticate(scope, route):
+    """app.check_auth() for the native routes; only a token that isn't verified yet leaves the event loop."""
+    header = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"authorization"), None)
+    if header and web.auth:
+        user = web.auth.cached(header)
+        if user is not None:
+            return user, None
+        # A token signed with a new key means fetching the JWKS first
+        return await in_thread(web.check_auth, header, route)
+    return web.check_auth(header, route)
+
+
+async def serve_native(scope, handler, receive, send):
+    route = scope["path"]
+    started = time.perf_counter()
+    metrics.set_intent("none")
+    status = 200
+    try:
+        user, error = await authenticate(scope, route)
+        token_auth.set_user(user)
+        data, status = (None, 401) if error else await read_json(receive)
+        if status == 401:
+            await send_json(send, 401, error)
+        elif status == 413:
+            await send_json(send, 413, {"response": "⚠️ The attachment is too large to upload.", "emotion": "Neutral"})
+        elif status == 400:
+            await send_json(send, 400, {"error": "Invalid JSON body"})
+        elif status is None:
+            status = 200
+            await handler(data, send)
+    except Exception:
+        metrics.REQUEST_EXCEPTIONS.inc(route)
+        status = 500
+        raise
+    finally:
+        metrics.REQUEST_SECONDS.observe(
+            time.perf_counter() - started, route, "POST", str(status), metrics.current_intent(),
+            "ok" if status < 400 else "client_error" if status < 500 else "error"
+        )
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+            if os.getenv("SERVICE_WARM_UP", "1") == "1":
+                # Native routes skip Flask's before_request hook, so start the warm-up here
+                web.services.warm_up()
+        elif message["type"] == "lifespan.shutdown":
+            await get_async_transport().aclose()
+            executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    handler = NATIVE_ROUTES.get(scope.get("path")) if scope["type"] == "http" and scope["method"] == "POST" else None
+    if handler:
+        return await serve_native(scope, handler, receive, send)
+    await flask_asgi(scope, receive, send)
@@ -0,0 +1,78 @@
+import logging
+import os
+import threading
+
+try:
+    import httpx
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+
+# httpx logs every request at INFO; requests/urllib3 keep that at DEBUG
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class AsyncHttpTransport:
+    """
+    asyncio counterpart of HttpTransport for the ASGI entry point (asgi.py).
+
+    One httpx.AsyncClient holds the keep-alive pool for every host, so hundreds
+    of in-flight upstream calls share a few connections per host without a
+    thread each. Connection failures are retried; responses never are, so
+    POSTs are safe. Must be used from a single event loop.
+    """
+
+    def __init__(self, max_connections=None, max_keepalive=None, retries=None, timeout=None):
+        if not HAS_HTTPX:
+            raise RuntimeError("The async serving mode needs httpx (pip install httpx)")
+        self.max_connections = max_connections or int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", 200))
+        self.max_keepalive = max_keepalive or int(os.getenv("ASYNC_HTTP_MAX_KEEPALIVE", 50))
+        retries = int(os.getenv("HTTP_RETRIES", 2)) if retries is None else retries
+        connect, read = timeout or (float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)), float(os.getenv("HTTP_READ_TIMEOUT", 120)))
+        self.timeout = httpx.Timeout(read, connect=connect)
+        self.client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(retries=retries),
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive),
+            timeout=self.timeout
+        )
+
+    async def request(self, method, url, **kwargs):
+        return await self.client.request(method, url, **_compat(kwargs))
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    def stream(self, method, url, **kwargs):
+        """`async with transport.stream(...) as response:` for chunked/SSE bodies."""
+        return self.client.stream(method, url, **_compat(kwargs))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def _compat(kwargs):
+    # requests-style keyword arguments used by the clients, mapped to httpx
+    if isinstance(kwargs.get("data"), (str, bytes)):
+        kwargs["content"] = kwargs.pop("data")
+    if isinstance(kwargs.get("timeout"), tuple):
+        connect, read = kwargs["timeout"]
+        kwargs["timeout"] = httpx.Timeout(read, connect=connect)
+    kwargs.pop("stream", None)
+    return kwargs
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_async_transport():
+    """Returns the process-wide async transport shared by the Async* client variants."""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = AsyncHttpTransport()
+    return _shared
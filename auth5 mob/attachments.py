@@ -0,0 +1,209 @@
+import base64
+import binascii
+import glob
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image, ImageOps
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+
+class AttachmentError(ValueError):
+    """Raised for attachments that are rejected before reaching the model."""
+
+
+FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+# Text files are indexed into chunks (see document_index), so they may be far larger than an image
+MAX_TEXT_CHARS = 16 * 1024 * 1024
+
+
+class AttachmentPipeline:
+    """
+    Prepares chat attachments once, before either AI client sees them.
+
+    Images are base64-decoded a single time, downscaled so the longest edge is at
+    most `max_edge` and re-encoded (JPEG by default) when that makes them smaller.
+    The result is stored under the hash of the uploaded data in a small in-memory
+    LRU backed by files in `cache_dir`, so an image re-sent in a follow-up turn
+    skips decoding and resizing; once the directory grows past `cache_max_bytes`
+    the least recently used files are deleted. Oversized uploads are rejected
+    from the length of the base64 string, before anything is decoded.
+
+    Without Pillow images are still decoded once, size-checked and cached, just
+    not resized.
+    """
+
+    def __init__(self, cache_dir="attachment_cache", max_edge=1568, quality=85, image_format="JPEG",
+                 max_bytes=10 * 1024 * 1024, max_text_chars=MAX_TEXT_CHARS, memory_items=32,
+                 cache_max_bytes=200 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_edge = max_edge
+        self.quality = quality
+        self.image_format = image_format.upper()
+        self.max_bytes = max_bytes
+        self.max_text_chars = max_text_chars
+        self.memory_items = memory_items
+        self.cache_max_bytes = cache_max_bytes
+        self.memory = OrderedDict()  # hash -> (mime, bytes)
+        self.lock = threading.Lock()
+        self.counters = {"images": 0, "cache_hits": 0, "resized": 0, "rejected": 0, "bytes_in": 0, "bytes_out": 0,
+                         "evicted": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+
+    def process(self, file_data):
+        """
+        Returns a copy of `file_data` ready for the clients. Images get a compact
+        data URL in "data", the raw bytes in "bytes" and their content hash in "hash".
+        """
+        if not file_data or not file_data.get('data'):
+            return file_data
+
+        if file_data.get('isText') or not file_data.get('type', '').startswith('image/'):
+            if len(file_data['data']) > self.max_text_chars:
+                self._count("rejected")
+                raise AttachmentError(f"The attached file is too large (limit {self.max_text_chars // 1024} KB of text).")
+            return file_data
+
+        encoded = file_data['data'].split(',')[-1]
+        # base64 needs 4 characters per 3 bytes, so the size is known without decoding
+        if len(encoded) * 3 // 4 > self.max_bytes:
+            self._count("rejected")
+            raise AttachmentError(f"The attached image is too large (limit {self.max_bytes // (1024 * 1024)} MB).")
+
+        digest = hashlib.sha256(encoded.encode("ascii", "ignore")).hexdigest()
+        self._count("images")
+        cached = self._lookup(digest)
+        if cached:
+            self._count("cache_hits")
+            mime, data = cached
+        else:
+            try:
+                raw = base64.b64decode(encoded, validate=False)
+            except (binascii.Error, ValueError):
+                self._count("rejected")
+                raise AttachmentError("The attached image could not be read.")
+            mime, data = self._shrink(raw, file_data['type'])
+            self._store(digest, mime, data)
+            with self.lock:
+                self.counters["bytes_in"] += len(raw)
+                self.counters["bytes_out"] += len(data)
+
+        return dict(
+            file_data,
+            type=mime,
+            data=f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}",
+            bytes=data,
+            hash=digest
+        )
+
+    def _shrink(self, raw, mime):
+        """Returns (mime, bytes) for the smaller of the original and the resized re-encode."""
+        if not HAS_PIL:
+            return mime, raw
+        try:
+            image = Image.open(io.BytesIO(raw))
+            if getattr(image, "is_animated", False):
+                return mime, raw
+            image = ImageOps.exif_transpose(image)
+            resized = max(image.size) > self.max_edge
+            if resized:
+                image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+            if self.image_format == "JPEG" and image.mode != "RGB":
+                # JPEG has no alpha channel; flatten onto white
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+                image = background
+            out = io.BytesIO()
+            image.save(out, self.image_format, quality=self.quality, optimize=True)
+        except Exception as e:
+            print(f"Could not downscale attachment: {e}")
+            return mime, raw
+
+        if not resized and out.tell() >= len(raw):
+            return mime, raw
+        if resized:
+            self._count("resized")
+        return FORMATS.get(self.image_format, mime), out.getvalue()
+
+    def _lookup(self, digest):
+        with self.lock:
+            cached = self.memory.get(digest)
+            if cached:
+                self.memory.move_to_end(digest)
+                return cached
+        for path in glob.glob(os.path.join(self.cache_dir, f"{digest}.*")):
+            if path.endswith(".tmp"):
+                continue
+            try:
+                with open(path, "rb") as f:
+                    cached = (f"image/{path.rsplit('.', 1)[-1]}", f.read())
+                # Eviction goes by mtime, so a file read back counts as recently used
+                os.utime(path)
+            except OSError:
+                continue  # evicted meanwhile
+            self._remember(digest, cached)
+            return cached
+        return None
+
+    def _store(self, digest, mime, data):
+        self._remember(digest, (mime, data))
+        path = os.path.join(self.cache_dir, f"{digest}.{mime.split('/')[-1]}")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Could not write attachment cache {path}: {e}")
+            return
+        with self.lock:
+            self.cache_bytes += len(data)
+        self._evict(keep=os.path.basename(path))
+
+    def _evict(self, keep):
+        """Deletes the least recently used cache files until the directory is back under cache_max_bytes."""
+        with self.lock:
+            if self.cache_bytes <= self.cache_max_bytes:
+                return
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir)
+             if entry.is_file() and not entry.name.endswith(".tmp") and entry.name != keep),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in entries:
+            with self.lock:
+                if self.cache_bytes <= self.cache_max_bytes:
+                    return
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            with self.lock:
+                self.cache_bytes -= size
+                self.counters["evicted"] += 1
+
+    def _remember(self, digest, entry):
+        with self.lock:
+            self.memory[digest] = entry
+            self.memory.move_to_end(digest)
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, memory_items=len(self.memory), cache_bytes=self.cache_bytes,
+                         cache_max_bytes=self.cache_max_bytes, has_pil=HAS_PIL)
+        stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+        return stats
@@ -0,0 +1,92 @@
+import base64
+import binascii
+import glob
+import hashlib
+import io
+import os
+import re
+
+try:
+    from PIL import Image, ImageOps
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+AVATAR_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class AvatarError(ValueError):
+    """Raised for avatar uploads that can't be stored."""
+
+
+class AvatarStore:
+    """
+    Stores profile pictures as fixed-size square thumbnails.
+
+    An upload (a data URL) is center-cropped and saved once per size in `sizes`,
+    named after the hash of the uploaded bytes. Only the short URL
+    `/avatars/<hash>` goes into Supabase user_metadata; `?s=<size>` picks a
+    thumbnail. Without Pillow the original image is stored for every size.
+    """
+
+    def __init__(self, directory="avatars", sizes=(64, 128, 256), max_bytes=5 * 1024 * 1024, url_prefix="/avatars/"):
+        self.directory = directory
+        self.sizes = tuple(sorted(sizes))
+        self.max_bytes = max_bytes
+        self.url_prefix = url_prefix
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def is_inline(avatar_url):
+        return bool(avatar_url) and avatar_url.startswith("data:")
+
+    def _decode(self, data_url):
+        """Returns the data URL's header, its image bytes and the avatar id they are stored under."""
+        header, _, encoded = data_url.partition(",")
+        if len(encoded) * 3 // 4 > self.max_bytes:
+            raise AvatarError(f"Avatar image is too large (limit {self.max_bytes // (1024 * 1024)} MB).")
+        try:
+            raw = base64.b64decode(encoded)
+        except (binascii.Error, ValueError):
+            raise AvatarError("Avatar image could not be read.")
+        return header, raw, hashlib.sha256(raw).hexdigest()[:32]
+
+    def url_for(self, data_url):
+        """The short avatar URL save() would return for a data URL, without writing anything."""
+        return self.url_prefix + self._decode(data_url)[2]
+
+    def save(self, data_url):
+        """Stores the thumbnails for a data URL and returns the short avatar URL."""
+        header, raw, avatar_id = self._decode(data_url)
+        if not glob.glob(os.path.join(self.directory, f"{avatar_id}-*")):
+            ext = header[len("data:"):].split(";")[0].split("/")[-1] or "bin"
+            for size, (data, size_ext) in self._thumbnails(raw, ext).items():
+                path = os.path.join(self.directory, f"{avatar_id}-{size}.{size_ext}")
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+        return self.url_prefix + avatar_id
+
+    def _thumbnails(self, raw, ext):
+        if not HAS_PIL:
+            return {size: (raw, ext) for size in self.sizes}
+        try:
+            image = ImageOps.exif_transpose(Image.open(io.BytesIO(raw))).convert("RGB")
+        except Exception:
+            raise AvatarError("Avatar image could not be read.")
+        thumbnails = {}
+        for size in self.sizes:
+            out = io.BytesIO()
+            ImageOps.fit(image, (size, size), Image.LANCZOS).save(out, "JPEG", quality=85, optimize=True)
+            thumbnails[size] = (out.getvalue(), "jpg")
+        return thumbnails
+
+    def lookup(self, avatar_id, size=None):
+        """Returns the path of the thumbnail closest to `size` (at least as large when possible), or None."""
+        if not AVATAR_ID.match(avatar_id):
+            return None
+        size = size or 128
+        wanted = next((s for s in self.sizes if s >= size), self.sizes[-1])
+        paths = [p for p in glob.glob(os.path.join(self.directory, f"{avatar_id}-{wanted}.*")) if not p.endswith(".tmp")]
+        return paths[0] if paths else None
@@ -0,0 +1,163 @@
+"""
+Benchmark for verifying Supabase access tokens per request.
+
+Serves a JWKS with an ES256 and an RS256 key from a local HTTP server and
+configures app.py against it (plus an HS256 shared secret, as on legacy
+projects), with databases in a scratch directory. Reports, per signing
+algorithm, what a first request with a token costs (signature, expiry,
+audience and issuer checks) and what every later request with it costs
+(verified-token LRU hit). For scale it times a GET through the shared HTTP
+transport to the local server: a supabase.auth.get_user() call is at least
+that plus the real network round trip to Supabase. It then times Flask's
+before_request hooks for /ask with and without a bearer token, and what key
+rotation costs: the first token signed with a newly published key, and
+cached tokens whose key was withdrawn.
+
+Usage: python bench_auth.py [--requests 20000] [--tokens 2000]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import jwt
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+except ImportError:
+    sys.exit("bench_auth.py needs PyJWT with cryptography: pip install 'pyjwt[crypto]'")
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ISSUER = "https://bench.supabase.co/auth/v1"
+SECRET = "bench-jwt-secret-" * 4
+
+
+def public_jwk(private_key, kid, algorithm):
+    jwk = json.loads(jwt.algorithms.get_default_algorithms()[algorithm].to_jwk(private_key.public_key()))
+    jwk.update(kid=kid, alg=algorithm, use="sig")
+    return jwk
+
+
+class JWKSServer:
+    """Serves whatever is in `keys` as /auth/v1/.well-known/jwks.json."""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                body = json.dumps({"keys": server.keys}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/auth/v1/.well-known/jwks.json"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+
+def token(key, algorithm, kid=None, user=0):
+    claims = {"sub": f"bench-user-{user}", "aud": "authenticated", "iss": ISSUER, "role": "authenticated",
+              "email": f"user{user}@bench.invalid", "exp": int(time.time()) + 3600, "session_id": f"session-{user}"}
+    return jwt.encode(claims, key, algorithm=algorithm, headers={"kid": kid} if kid else None)
+
+
+def timed(fn, items):
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def report(label, samples):
+    print(f"  {label:<44} p50 {percentile(samples, 0.5) * 1e6:9.1f} µs   p99 {percentile(samples, 0.99) * 1e6:9.1f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000, help="requests per cached-token measurement")
+    parser.add_argument("--tokens", type=int, default=2000, help="distinct tokens per first-request measurement")
+    args = parser.parse_args()
+
+    ec_key = ec.generate_private_key(ec.SECP256R1())
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server = JWKSServer([public_jwk(ec_key, "ec-1", "ES256"), public_jwk(rsa_key, "rsa-1", "RS256")])
+
+    # app.py reads its configuration at import time; keep its databases out of the checkout
+    scratch = tempfile.mkdtemp(prefix="globlexgpt-auth-")
+    os.environ.update(SUPABASE_URL="https://bench.supabase.co", SUPABASE_KEY="bench-key", SUPABASE_JWT_SECRET=SECRET,
+                      SUPABASE_JWKS_URL=server.url, HTTP_PREWARM="0", SERVICE_WARM_UP="0",
+                      GEMINI_MODEL_CACHE=os.path.join(scratch, "gemini_models.json"))
+    os.chdir(scratch)
+    sys.path.insert(0, APP_DIR)
+    import app as web
+    from http_transport import get_transport
+
+    web.auth.cache_size = max(web.auth.cache_size, args.tokens)
+    web.auth.keys.start()
+    signers = {"HS256": (SECRET, None), "ES256": (ec_key, "ec-1"), "RS256": (rsa_key, "rsa-1")}
+
+    print(f"per-request verification cost ({args.tokens} distinct tokens, {args.requests} repeat requests)")
+    for algorithm, (key, kid) in signers.items():
+        headers = [f"Bearer {token(key, algorithm, kid, user)}" for user in range(args.tokens)]
+        report(f"{algorithm} first request (signature check)", timed(web.auth.authenticate, headers))
+        cached = timed(web.auth.authenticate, [headers[0]] * args.requests)
+        report(f"{algorithm} later requests (LRU hit)", cached)
+
+    round_trips = timed(lambda _: get_transport().get(server.url, timeout=5).content, range(200))
+    report("GET over loopback (get_user() is this + RTT)", round_trips)
+
+    # The hooks Flask runs before /ask: timer, warm-up check and authentication
+    print("\nFlask before_request hooks for /ask")
+    header = f"Bearer {token(ec_key, 'ES256', 'ec-1', user=0)}"
+    for label, headers in (("anonymous", {}), ("bearer token (cached)", {"Authorization": header})):
+        def hooks(_):
+            with web.app.test_request_context("/ask", method="POST", headers=headers):
+                web.app.preprocess_request()
+        hooks(None)
+        report(label, timed(hooks, range(args.requests)))
+
+    # Key rotation: a token signed with a newly published key, then withdrawing the old one
+    print("\nkey rotation")
+    new_key = ec.generate_private_key(ec.SECP256R1())
+    server.keys = server.keys + [public_jwk(new_key, "ec-2", "ES256")]
+    web.auth.keys.attempted_at = 0.0  # as if min_refetch had passed since the last fetch
+    fetches = server.requests
+    [seconds] = timed(web.auth.authenticate, [f"Bearer {token(new_key, 'ES256', 'ec-2', user=1)}"])
+    print(f"  first token signed with a new key: {seconds * 1000:.2f} ms, {server.requests - fetches} JWKS fetch")
+    server.keys = [jwk for jwk in server.keys if jwk["kid"] != "ec-1"]
+    web.auth.keys.attempted_at = 0.0
+    web.auth.keys.fetch()
+    try:
+        web.auth.authenticate(header)
+        print("  cached token signed with the withdrawn key: still accepted")
+    except web.AuthError as e:
+        print(f"  cached token signed with the withdrawn key: rejected ({e.reason})")
+
+    stats = web.auth.stats()
+    print(f"\nverified {stats['verified']}, LRU hits {stats['hits']} (hit ratio {stats['hit_ratio']:.1%}), "
+          f"rejected {stats['rejected']}, JWKS fetches {stats['signing_keys']['fetches']}")
+    print(f"a loopback GET costs {statistics.median(round_trips) / statistics.median(cached):.0f}x a cached verification")
+
+
+if __name__ == "__main__":
+    main()
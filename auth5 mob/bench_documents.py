@@ -0,0 +1,88 @@
+"""
+Benchmark for retrieval over text attachments.
+
+Generates log-like documents from 10 KB to 50 MB with one planted error line,
+then compares pasting the whole file into the prompt (the old Gemini path)
+against DocumentRetriever: prompt tokens sent, time to index and persist the
+file, and query latency for the first turn (index in memory) and for a
+follow-up turn (index read back from SQLite). Model prefill time is
+simulated from --prefill tokens/s. "found" says whether the excerpts
+contained the planted line.
+
+Usage: python bench_documents.py [--sizes 10K,100K,1M,10M,50M] [--prefill 5000] [--budget 1500]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from conversation_store import estimate_tokens
+from document_index import DocumentStore, DocumentRetriever
+
+WORDS = ("worker scheduler request cache upstream timeout retry queue user session token payload "
+         "response latency batch commit index shard replica lease heartbeat socket").split()
+NEEDLE = "ERROR billing-7 ledger reconciliation aborted: checksum mismatch on invoice 88412"
+QUESTION = "why was the ledger reconciliation aborted?"
+
+
+def make_document(size, seed=7):
+    rnd = random.Random(seed)
+    lines, total = [], 0
+    while total < size:
+        line = (f"2026-10-18 {rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d} INFO "
+                f"{rnd.choice(WORDS)}-{rnd.randint(1, 9)} " + " ".join(rnd.choices(WORDS, k=8)) + f" {rnd.randint(1, 99999)}")
+        lines.append(line)
+        total += len(line) + 1
+    lines[len(lines) * 2 // 3] = "2026-10-18 13:37:00 " + NEEDLE
+    return "\n".join(lines)[:size]
+
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 * 1024}
+    return int(float(text[:-1]) * units[text[-1].upper()]) if text[-1].upper() in units else int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10K,100K,1M,10M,50M")
+    parser.add_argument("--prefill", type=float, default=5000, help="simulated model prefill, tokens/s")
+    parser.add_argument("--budget", type=int, default=1500, help="DOCUMENT_TOKEN_BUDGET")
+    args = parser.parse_args()
+
+    print(f"{'size':>7} | {'before tokens':>13} {'prefill s':>9} | {'after tokens':>12} {'prefill s':>9} "
+          f"{'index s':>8} {'persist s':>9} {'query ms':>8} {'follow-up ms':>12} {'found':>5}")
+    for label in args.sizes.split(","):
+        text = make_document(parse_size(label))
+        before = estimate_tokens(text)
+        with tempfile.TemporaryDirectory() as directory:
+            store = DocumentStore(os.path.join(directory, "documents.db"))
+            retriever = DocumentRetriever(store, budget_tokens=args.budget)
+            owner = ("bench", label)
+
+            start = time.perf_counter()
+            digest = retriever.add({"name": "app.log", "data": text}, owner)
+            indexed = time.perf_counter() - start
+            start = time.perf_counter()
+            excerpts = retriever.context(QUESTION, owner, [digest])
+            query = time.perf_counter() - start
+
+            start = time.perf_counter()
+            while retriever.stats()["unsaved"]:
+                time.sleep(0.01)
+            persisted = time.perf_counter() - start + query
+
+            # A follow-up after the in-memory copy is gone reads only the query's postings from SQLite
+            retriever.memory.clear()
+            start = time.perf_counter()
+            follow_up = retriever.context("which invoice had the checksum mismatch?", owner)
+            follow_up_time = time.perf_counter() - start
+
+        after = estimate_tokens(excerpts)
+        print(f"{label:>7} | {before:>13,} {before / args.prefill:>9.1f} | {after:>12,} {after / args.prefill:>9.2f} "
+              f"{indexed:>8.2f} {persisted:>9.2f} {query * 1000:>8.1f} {follow_up_time * 1000:>12.1f} "
+              f"{'yes' if NEEDLE in excerpts and NEEDLE in follow_up else 'no':>5}")
+
+
+if __name__ == "__main__":
+    main()
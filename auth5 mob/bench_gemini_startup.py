@@ -0,0 +1,80 @@
+"""
+Startup benchmark for Gemini model discovery.
+
+Before the shared discovery cache each GeminiClient constructor called
+genai.list_models() synchronously; now discovery runs once per process,
+persisted to disk for the next start. With a cache file the client's first
+call (or the startup warm-up) picks the model immediately and the refresh
+runs in the background; without one, all clients share a single wait for
+the first discovery instead of guessing a model. genai.list_models is
+replaced with a fake that sleeps for --latency seconds so the numbers don't
+depend on the network or an API key.
+
+Usage: python bench_gemini_startup.py [--latency 0.8] [--clients 2]
+"""
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import google.generativeai as genai
+
+import model_discovery
+from gemini_client import GeminiClient
+from model_discovery import select_model
+
+
+def fake_list_models(latency):
+    def list_models():
+        time.sleep(latency)
+        return [SimpleNamespace(name=f"models/{name}", supported_generation_methods=["generateContent"])
+                for name in ("gemini-1.0-pro", "gemini-1.5-flash", "gemini-1.5-pro")]
+    return list_models
+
+
+def legacy_construct():
+    # What GeminiClient.__init__ did before: blocking discovery per instance
+    models = [m.name.replace('models/', '') for m in genai.list_models()
+              if 'generateContent' in m.supported_generation_methods]
+    return genai.GenerativeModel(select_model(models))
+
+
+def timed(construct, clients):
+    start = time.perf_counter()
+    for _ in range(clients):
+        construct()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.8, help="simulated list_models() round trip (s)")
+    parser.add_argument("--clients", type=int, default=2, help="GeminiClients built at startup")
+    args = parser.parse_args()
+    genai.list_models = fake_list_models(args.latency)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["GEMINI_MODEL_CACHE"] = os.path.join(directory, "gemini_models.json")
+
+        def fresh_process():
+            model_discovery._discoveries.clear()
+
+        print(f"{args.clients} GeminiClients, list_models() latency {args.latency * 1000:.0f} ms")
+        print(f"{'legacy (blocking discovery)':<30} {timed(legacy_construct, args.clients):8.1f} ms")
+
+        fresh_process()
+        cold = timed(lambda: GeminiClient("bench-key")._configure_model(), args.clients)
+        print(f"{'cold start (no cache file)':<30} {cold:8.1f} ms   (one shared discovery)")
+        discovery = model_discovery.get_discovery("bench-key")
+        while discovery.refreshing:
+            time.sleep(0.01)
+
+        fresh_process()
+        warm = timed(lambda: GeminiClient("bench-key")._configure_model(), args.clients)
+        selected = model_discovery.get_discovery("bench-key").current()
+        print(f"{'warm start (cache file)':<30} {warm:8.1f} ms   -> {selected}")
+
+
+if __name__ == "__main__":
+    main()
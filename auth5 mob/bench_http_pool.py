@@ -0,0 +1,113 @@
+"""
+Benchmark for the shared pooled HTTP transport.
+
+Starts a local stub HTTPS server (self-signed certificate, generated with the
+openssl CLI) and measures per-call latency of bare requests.get, which opens a
+new TCP+TLS connection every time, against HttpTransport, which keeps the
+connection alive in its pool. An optional --delay adds simulated network
+round-trip time to every new connection.
+
+Usage: python bench_http_pool.py [--calls 300] [--delay 0.02]
+"""
+import argparse
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from http_transport import HttpTransport
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    # Send headers and body in one segment so delayed ACKs don't skew the numbers
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps({"main": {"temp": 21.5, "humidity": 40}, "weather": [{"description": "clear sky"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    connect_delay = 0.0
+
+    def get_request(self):
+        sock, address = super().get_request()
+        # Simulated round trips for the TCP and TLS handshakes of a new connection
+        time.sleep(self.connect_delay)
+        return sock, address
+
+
+def make_certificate(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+         "-days", "1", "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+def start_server(cert, key, delay):
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    server.connect_delay = delay
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(name, get, url, cert, calls):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        response = get(url, verify=cert)
+        response.json()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    print(f"{name:<22} mean {statistics.fmean(samples):7.2f} ms | p50 {samples[len(samples) // 2]:7.2f} ms | "
+          f"p95 {samples[int(len(samples) * 0.95)]:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--delay", type=float, default=0.0, help="simulated handshake delay per new connection (s)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        server = start_server(cert, key, args.delay)
+        url = f"https://localhost:{server.server_address[1]}/data/2.5/weather?q=London"
+
+        transport = HttpTransport()
+        transport.get(url, verify=cert)  # first call opens the pooled connection
+
+        print(f"{args.calls} GETs against a local HTTPS stub (handshake delay {args.delay * 1000:.0f} ms)")
+        measure("requests.get (no pool)", requests.get, url, cert, args.calls)
+        measure("HttpTransport (pooled)", transport.get, url, cert, args.calls)
+
+        transport.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
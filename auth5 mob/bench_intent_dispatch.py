@@ -0,0 +1,168 @@
+"""
+Micro-benchmark for /ask intent dispatch.
+
+Builds a corpus of synthetic prompts and measures per-prompt dispatch latency
+of the compiled IntentRouter (scan, match and the match_all that dispatch
+runs) against the old if/elif substring chain. The
+router comes from intents.build_router(), so the app and its background
+services are not started. Prompts the two route differently are listed by
+(legacy, router) pair: those are the old chain's substring and ordering bugs.
+Latency is reported for the whole corpus and for the prompts that match no
+intent, which go on to the LLM: the old chain answers intent prompts from its
+first few checks, but has to run every check on those.
+
+Usage: python bench_intent_dispatch.py [--prompts 10000] [--seed 42]
+"""
+import argparse
+import random
+import statistics
+import time
+from collections import Counter
+
+from intents import build_router
+
+CITIES = ["London", "Paris", "New York", "Tokyo", "Delhi", "San Francisco", "Berlin"]
+COINS = ["bitcoin", "ethereum", "solana", "dogecoin", "cardano", "xrp"]
+TICKERS = ["aapl", "tsla", "msft", "nvda", "goog"]
+TOPICS = ["lofi beats", "python tutorial", "cooking pasta", "football highlights", "jazz piano"]
+SUBJECTS = ["a cat in space", "a sunset over mountains", "a robot reading a book", "an old lighthouse"]
+CHAT = [
+    "tell me a joke",
+    "what can you do",
+    "explain quantum computing in simple terms",
+    "I opened the drawer and found an old letter, what should I do with it",
+    "write a haiku about the ocean",
+    "how do I reverse a list in python",
+    "summarize the plot of hamlet",
+]
+
+TEMPLATES = [
+    lambda r: f"what's the weather in {r.choice(CITIES)}?",
+    lambda r: f"weather for {r.choice(CITIES)}",
+    lambda r: "show me the latest news",
+    lambda r: f"what is the price of {r.choice(COINS)}?",
+    lambda r: "top crypto right now",
+    lambda r: f"stock price of {r.choice(TICKERS)}",
+    lambda r: "how is the stock market doing",
+    lambda r: f"search youtube for {r.choice(TOPICS)}",
+    lambda r: "what's trending on youtube",
+    lambda r: f"generate an image of {r.choice(SUBJECTS)}",
+    lambda r: f"draw me {r.choice(SUBJECTS)}",
+    lambda r: f"create a video of {r.choice(SUBJECTS)}",
+    lambda r: "open notepad",
+    lambda r: "take a screenshot",
+    lambda r: r.choice(CHAT),
+    lambda r: r.choice(CHAT),
+    lambda r: r.choice(CHAT),
+]
+
+
+def build_corpus(size, seed):
+    rnd = random.Random(seed)
+    return [rnd.choice(TEMPLATES)(rnd) for _ in range(size)]
+
+
+def legacy_dispatch(user_input):
+    """The matching half of the old if/elif chain in ask(), kept for comparison."""
+    if "screenshot" in user_input.lower():
+        return "screenshot"
+    elif "camera" in user_input.lower() or "photo" in user_input.lower():
+        return "camera"
+    elif "open" in user_input.lower():
+        user_input.lower().split("open")[-1].strip()
+        return "open_app"
+    elif "weather" in user_input.lower():
+        words = user_input.lower().split()
+        if "in" in words:
+            user_input.lower().split("in")[-1].strip().strip('?').strip('.')
+        elif "for" in words:
+            user_input.lower().split("for")[-1].strip().strip('?').strip('.')
+        return "weather"
+    elif "news" in user_input.lower():
+        return "news"
+    elif "price of" in user_input.lower() or "price for" in user_input.lower():
+        words = user_input.lower().split()
+        if "of" in words:
+            words[words.index("of") + 1].strip("?").strip(".")
+        elif "for" in words:
+            words[words.index("for") + 1].strip("?").strip(".")
+        return "crypto_price"
+    elif "crypto" in user_input.lower() or "cryptocurrency" in user_input.lower():
+        return "crypto_top"
+    elif "stock" in user_input.lower() or "share price" in user_input.lower():
+        words = user_input.lower().split()
+        if "of" in words:
+            words[words.index("of") + 1].strip("?").strip(".")
+        elif "for" in words:
+            words[words.index("for") + 1].strip("?").strip(".")
+        return "stock"
+    elif "youtube" in user_input.lower():
+        if "trending" in user_input.lower() or "popular" in user_input.lower():
+            return "youtube"
+        user_input.lower().replace("youtube", "").replace("search", "").replace("find", "").strip()
+        return "youtube"
+    elif "generate" in user_input.lower() and "image" in user_input.lower():
+        return "image"
+    elif any(word in user_input.lower() for word in ["generate image", "create image", "make image", "draw", "paint"]):
+        return "image"
+    elif any(word in user_input.lower() for word in ["generate video", "create video", "make video", "animate"]):
+        return "video"
+    return None
+
+
+def measure(name, func, corpus, rounds):
+    samples = []
+    for _ in range(rounds):
+        for prompt in corpus:
+            start = time.perf_counter_ns()
+            func(prompt)
+            samples.append(time.perf_counter_ns() - start)
+    samples.sort()
+    count = len(samples)
+    print(f"{name:<16} mean {statistics.fmean(samples) / 1000:7.2f} us | "
+          f"p50 {samples[count // 2] / 1000:7.2f} us | "
+          f"p95 {samples[int(count * 0.95)] / 1000:7.2f} us | "
+          f"p99 {samples[int(count * 0.99)] / 1000:7.2f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--prompts", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.prompts, args.seed)
+    router = build_router()
+    # Warm up the compiled pattern and the interpreter caches
+    for prompt in corpus[:500]:
+        router.match(prompt)
+        legacy_dispatch(prompt)
+
+    disagreements = Counter()
+    examples = {}
+    for prompt in corpus:
+        found = router.match(prompt)
+        pair = (legacy_dispatch(prompt), found.name if found else None)
+        if pair[0] != pair[1]:
+            disagreements[pair] += 1
+            examples.setdefault(pair, prompt)
+    print(f"Corpus: {len(corpus)} prompts, {len(router.intents)} intents, "
+          f"{sum(disagreements.values())} prompts routed differently from the legacy chain")
+    for (legacy, routed), count in disagreements.most_common():
+        print(f"  {count:6} legacy {legacy} -> router {routed}, e.g. {examples[legacy, routed]!r}")
+    measure("legacy if/elif", legacy_dispatch, corpus, args.rounds)
+    measure("router scan", router.scan, corpus, args.rounds)
+    measure("router + slots", router.match, corpus, args.rounds)
+    # What dispatch() runs with fan-out on: whole prompt and clauses in one scan
+    measure("router match_all", router.match_all, corpus, args.rounds)
+
+    chat = [prompt for prompt in corpus if not router.scan(prompt)]
+    print(f"\n{len(chat)} prompts with no intent")
+    measure("legacy if/elif", legacy_dispatch, chat, args.rounds)
+    measure("router scan", router.scan, chat, args.rounds)
+    measure("router match_all", router.match_all, chat, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,541 @@
+"""
+Offline load test for /ask against local stand-ins for the paid APIs.
+
+Starts a small HTTP server per upstream (OpenRouter, CoinMarketCap,
+OpenWeather, NewsAPI, Alpha Vantage, Stability, A4F Imagen, Runway), each with
+a log-normal latency and an error rate, points the app at them through the
+*_BASE_URL variables and drives /ask from `--concurrency` virtual users with
+a weighted intent mix. Reports throughput, p50/p95/p99 per intent, how many
+calls reached each fake, and how busy the app's request threads were.
+
+Usage:
+  python bench_load.py [--concurrency 16] [--duration 30] [--seed 42]
+                       [--latency openrouter=900:0.4,cmc=150] [--errors openrouter=0.05]
+                       [--mix chat=50,weather=12,crypto_price=10]
+  python bench_load.py --fakes-only [--port-base 18000]   # serve the fakes for an app started elsewhere
+  python bench_load.py --url http://127.0.0.1:5000       # drive an app already pointed at the fakes
+  python bench_load.py --asgi                            # serve through asgi.py under uvicorn instead
+  python bench_load.py --threads 8                       # cap request threads, like gunicorn gthread
+
+To compare the serving modes on a chat-heavy mix:
+  for c in 16 64 256; do
+    python bench_load.py --mix chat=80,weather=10,news=10 --concurrency $c --threads 32
+    python bench_load.py --mix chat=80,weather=10,news=10 --concurrency $c --asgi
+  done
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+try:
+    import uvicorn
+    HAS_UVICORN = True
+except ImportError:
+    HAS_UVICORN = False
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (base URL variable, path prefix of that URL, API key variable, median ms, sigma)
+UPSTREAMS = {
+    "openrouter": ("OPENROUTER_BASE_URL", "/api/v1", "OPENROUTER_API_KEY", 900, 0.4),
+    "cmc": ("CMC_BASE_URL", "", "CMC_API_KEY", 150, 0.3),
+    "openweather": ("OPENWEATHER_BASE_URL", "", "OPENWEATHER_API_KEY", 80, 0.3),
+    "newsapi": ("NEWS_API_BASE_URL", "", "NEWS_API_KEY", 200, 0.3),
+    "alphavantage": ("ALPHA_VANTAGE_BASE_URL", "", "ALPHA_VANTAGE_API_KEY", 250, 0.4),
+    "stability": ("STABILITY_BASE_URL", "", "STABILITY_API_KEY", 3000, 0.3),
+    "a4f": ("A4F_BASE_URL", "/v1", "IMAGEN_API_KEY", 2500, 0.3),
+    "runway": ("RUNWAYML_BASE_URL", "", "RUNWAYML_API_KEY", 200, 0.3),
+}
+
+# Live services the harness must never reach; empty values also win over .env
+DISABLED = ["GEMINI_API_KEY", "YOUTUBE_API_KEY", "SUPABASE_URL", "SUPABASE_KEY"]
+
+# Token counts the OpenRouter stand-in reports, as if the system prompt came from the provider's cache
+USAGE = {"prompt_tokens": 180, "completion_tokens": 60, "prompt_tokens_details": {"cached_tokens": 128}}
+
+# How long a fake Runway task takes to finish (--video-seconds)
+VIDEO_SECONDS = 20.0
+
+DEFAULT_MIX = "chat=50,weather=12,crypto_price=10,news=6,stock=6,market=4,crypto_top=4,image=2,video=1"
+
+CITIES = ["London", "Paris", "New York", "Tokyo", "Delhi", "San Francisco", "Berlin"]
+COINS = ["bitcoin", "ethereum", "solana", "dogecoin", "cardano"]
+TICKERS = ["aapl", "tsla", "msft", "nvda", "goog"]
+SUBJECTS = ["a cat in space", "a sunset over mountains", "a robot reading a book", "an old lighthouse"]
+CHAT = [
+    "tell me a joke",
+    "what can you do",
+    "explain quantum computing in simple terms",
+    "write a haiku about the ocean",
+    "how do I reverse a list in python",
+    "summarize the plot of hamlet",
+]
+PROMPTS = {
+    "chat": lambda r: r.choice(CHAT),
+    "weather": lambda r: f"what's the weather in {r.choice(CITIES)}?",
+    "crypto_price": lambda r: f"what is the price of {r.choice(COINS)}?",
+    "crypto_top": lambda r: "top crypto right now",
+    "news": lambda r: "show me the latest news",
+    "stock": lambda r: f"stock price of {r.choice(TICKERS)}",
+    "market": lambda r: "how is the stock market doing",
+    "image": lambda r: f"generate an image of {r.choice(SUBJECTS)}",
+    "video": lambda r: f"create a video of {r.choice(SUBJECTS)}",
+    "multi": lambda r: f"weather in {r.choice(CITIES)}, price of {r.choice(COINS)} and the news",
+}
+
+
+def tiny_png():
+    """A valid 1x1 PNG for the Stability stand-in."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\x80\x80\x80")) + chunk(b"IEND", b"")
+
+
+PIXEL = base64.b64encode(tiny_png()).decode()
+
+
+def parse_pairs(text, cast=str):
+    pairs = {}
+    for item in filter(None, (text or "").split(",")):
+        key, _, value = item.partition("=")
+        pairs[key.strip()] = cast(value.strip())
+    return pairs
+
+
+class Profile:
+    """Latency and error behaviour of one fake upstream."""
+
+    def __init__(self, median_ms, sigma, error_rate, seed):
+        self.median = median_ms / 1000
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def next(self):
+        """Returns (delay seconds, fail?) for the next call."""
+        with self.lock:
+            self.calls += 1
+            failed = self.rnd.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return self.rnd.lognormvariate(math.log(self.median), self.sigma), failed
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    upstream = None
+    profile = None
+    prefix = ""
+    tasks = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        # Connection pre-warming
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        parts = urlsplit(self.path)
+        path = parts.path[len(self.prefix):] if parts.path.startswith(self.prefix) else parts.path
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+
+        delay, failed = self.profile.next()
+        if failed:
+            time.sleep(delay / 4)
+            return self._send(503, {"error": {"message": "injected failure"}})
+        if self.upstream == "openrouter" and b'"stream": true' in body:
+            return self._stream_completion(delay)
+        time.sleep(delay)
+        handler = getattr(self, f"_{self.upstream}", None)
+        response = handler(path, query) if handler else None
+        if response is None:
+            return self._send(404, {"error": f"no fake for {self.command} {parts.path}"})
+        self._send(200, response)
+
+    def _openrouter(self, path, query):
+        content = json.dumps({"response": "This is a canned answer from the load-test stand-in. " * 4, "emotion": "Neutral"})
+        return {"choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": USAGE}
+
+    def _stream_completion(self, delay):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        content = json.dumps({"response": "This is a canned streamed answer. " * 4, "emotion": "Neutral"})
+        chunks = [content[i:i + 16] for i in range(0, len(content), 16)]
+        time.sleep(delay / 3)  # time to first token
+        for chunk in chunks:
+            event = {"choices": [{"delta": {"content": chunk}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(delay * 2 / 3 / len(chunks))
+        self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': USAGE})}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    @staticmethod
+    def _usd(price):
+        return {"USD": {"price": price, "percent_change_24h": 1.23}}
+
+    def _cmc(self, path, query):
+        if path.endswith("/quotes/latest"):
+            symbols = query.get("symbol", "").split(",")
+            return {"data": {s: {"name": s.title(), "symbol": s, "quote": self._usd(100.0 + len(s))} for s in symbols if s}}
+        if path.endswith("/listings/latest"):
+            return {"data": [{"name": f"Coin {i}", "symbol": f"C{i}", "quote": self._usd(1000.0 / i)}
+                             for i in range(1, int(query.get("limit", 5)) + 1)]}
+        return None
+
+    def _openweather(self, path, query):
+        return {"cod": 200, "name": query.get("q", "Somewhere"), "weather": [{"description": "scattered clouds"}],
+                "main": {"temp": 18.5, "humidity": 60}, "wind": {"speed": 3.2}}
+
+    def _newsapi(self, path, query):
+        return {"status": "ok", "articles": [
+            {"title": f"Headline {i}", "source": {"name": "Stand-in Wire"}, "description": "Something happened."}
+            for i in range(1, int(query.get("pageSize", 5)) + 1)
+        ]}
+
+    def _alphavantage(self, path, query):
+        if query.get("function") == "GLOBAL_QUOTE":
+            return {"Global Quote": {"01. symbol": query.get("symbol", "AAPL"), "05. price": "187.2500",
+                                     "09. change": "1.2500", "10. change percent": "0.6720%"}}
+        if query.get("function") == "NEWS_SENTIMENT":
+            return {"feed": [{"title": f"Market story {i}", "source": "Stand-in Markets"} for i in range(1, 6)]}
+        return None
+
+    def _stability(self, path, query):
+        return {"image": PIXEL, "finish_reason": "SUCCESS"}
+
+    def _a4f(self, path, query):
+        return {"data": [{"url": "https://example.invalid/generated.png"}]}
+
+    def _runway(self, path, query):
+        if self.command == "POST" and path.endswith("_to_video"):
+            task_id = str(uuid.uuid4())
+            self.tasks[task_id] = time.time()
+            return {"id": task_id}
+        if path.startswith("/v1/tasks/"):
+            created = self.tasks.get(path.rsplit("/", 1)[-1])
+            if created is None:
+                return None
+            progress = min(1.0, (time.time() - created) / VIDEO_SECONDS)
+            task = {"id": path.rsplit("/", 1)[-1], "createdAt": "2024-01-01T00:00:00Z",
+                    "status": "SUCCEEDED" if progress >= 1 else "RUNNING", "progress": progress}
+            if progress >= 1:
+                task["output"] = ["https://example.invalid/video.mp4"]
+            return task
+        return None
+
+
+def start_fakes(latency, errors, seed, port_base=0):
+    """Starts one server per upstream. Returns ({name: (server, profile)}, env for the app)."""
+    fakes, env = {}, {}
+    for number, (name, (url_var, prefix, key_var, median, sigma)) in enumerate(UPSTREAMS.items()):
+        median_ms, _, custom_sigma = str(latency.get(name, median)).partition(":")
+        profile = Profile(float(median_ms), float(custom_sigma or sigma), errors.get(name, 0.0), seed + number)
+        handler = type(f"Fake_{name}", (FakeHandler,), {"upstream": name, "profile": profile, "prefix": prefix, "tasks": {}})
+        server = ThreadingHTTPServer(("127.0.0.1", port_base + number if port_base else 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        fakes[name] = (server, profile)
+        env[url_var] = f"http://127.0.0.1:{server.server_address[1]}{prefix}"
+        env[key_var] = "load-test-key"
+    return fakes, env
+
+
+class UtilizationMeter:
+    """
+    WSGI middleware measuring how busy the app's request threads are: the
+    average and peak number of requests in flight, and the CPU time those
+    threads spent (as opposed to waiting on upstream I/O).
+    """
+
+    def __init__(self, wsgi_app, threads=None):
+        self.wsgi_app = wsgi_app
+        # A fixed pool of request threads; requests beyond it queue, as with gunicorn's gthread worker
+        self.slots = threading.BoundedSemaphore(threads) if threads else None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.area = 0.0
+        self.cpu = 0.0
+        self.busy = 0.0
+        self.last = self.since = time.perf_counter()
+
+    def _tick(self, change):
+        now = time.perf_counter()
+        with self.lock:
+            self.area += self.in_flight * (now - self.last)
+            self.last = now
+            self.in_flight += change
+            self.peak = max(self.peak, self.in_flight)
+
+    def reset(self):
+        self._tick(0)
+        with self.lock:
+            self.area = self.cpu = self.busy = 0.0
+            self.peak = self.in_flight
+            self.since = self.last
+
+    def __call__(self, environ, start_response):
+        if self.slots:
+            self.slots.acquire()
+        self._tick(1)
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            return list(self.wsgi_app(environ, start_response))
+        finally:
+            with self.lock:
+                self.cpu += time.thread_time() - cpu_started
+                self.busy += time.perf_counter() - started
+            self._tick(-1)
+            if self.slots:
+                self.slots.release()
+
+    def report(self):
+        self._tick(0)
+        with self.lock:
+            wall = self.last - self.since
+            return {
+                "mean_in_flight": self.area / wall,
+                "peak_in_flight": self.peak,
+                "cpu_cores": self.cpu / wall,
+                "cpu_share": self.cpu / self.busy if self.busy else 0.0,
+            }
+
+
+class AsgiUtilizationMeter(UtilizationMeter):
+    """
+    The same figures for asgi.py: requests in flight on the event loop, and the
+    CPU time of the event-loop thread (work handed to its thread pool is not counted).
+    """
+
+    def __init__(self, asgi_app):
+        super().__init__(asgi_app)
+        self.loop_cpu = None
+
+    def _loop_cpu(self):
+        # Called on the event-loop thread, so thread_time() is the loop's CPU time
+        now = time.thread_time()
+        with self.lock:
+            if self.loop_cpu is not None:
+                self.cpu += now - self.loop_cpu
+            self.loop_cpu = now
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.wsgi_app(scope, receive, send)
+        self._loop_cpu()
+        self._tick(1)
+        started = time.perf_counter()
+        try:
+            await self.wsgi_app(scope, receive, send)
+        finally:
+            with self.lock:
+                self.busy += time.perf_counter() - started
+            self._loop_cpu()
+            self._tick(-1)
+
+
+def start_app(env, asgi=False, threads=None):
+    """Imports the app with the fakes configured and serves it on a free port. Returns (url, meter)."""
+    from werkzeug.serving import make_server
+
+    for name in DISABLED:
+        os.environ[name] = ""
+    os.environ.update(env)
+    # The free tier's 5 calls/minute would turn the stock intent into a queueing test
+    os.environ.setdefault("ALPHA_VANTAGE_CALLS_PER_MINUTE", "100000")
+    os.environ.setdefault("ALPHA_VANTAGE_CALLS_PER_DAY", "1000000")
+    # Databases, caches and logs go to a scratch directory instead of the checkout
+    os.chdir(tempfile.mkdtemp(prefix="globlexgpt-load-"))
+    sys.path.insert(0, APP_DIR)
+    import app as application
+
+    if asgi:
+        return start_asgi_app()
+    meter = UtilizationMeter(application.app.wsgi_app, threads)
+    application.app.wsgi_app = meter
+    server = make_server("127.0.0.1", 0, application.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", meter
+
+
+def start_asgi_app():
+    """Serves asgi.py under uvicorn on a background thread's event loop."""
+    import socket
+    import asgi
+
+    meter = AsgiUtilizationMeter(asgi.app)
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    config = uvicorn.Config(meter, log_level="warning", lifespan="on", backlog=4096)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{sock.getsockname()[1]}", meter
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+def run_load(url, mix, concurrency, duration, warmup, seed, meter=None):
+    intents, weights = list(mix), list(mix.values())
+    samples = []  # (intent, seconds, ok, degraded)
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def user(number):
+        rnd = random.Random(seed * 1000 + number)
+        session = requests.Session()
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                return
+            intent = rnd.choices(intents, weights)[0]
+            payload = {"prompt": PROMPTS[intent](rnd), "chat_id": f"load-{number}", "user_id": f"load-user-{number}"}
+            ok, degraded = False, False
+            try:
+                response = session.post(f"{url}/ask", json=payload, timeout=120)
+                ok = response.status_code == 200
+                text = response.json().get("response", "") if ok else ""
+                degraded = text.startswith(("⚠️", "Error", "Sorry", "I'm sorry", "I couldn't", "I'm having trouble", "API Error"))
+            except Exception:
+                pass
+            if now >= measure_from:
+                with lock:
+                    samples.append((intent, time.perf_counter() - now, ok, degraded))
+
+    threads = [threading.Thread(target=user, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    if meter:
+        time.sleep(warmup)
+        meter.reset()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def report(samples, duration, concurrency, fakes, meter):
+    print(f"\n{len(samples)} requests in {duration:.0f} s at concurrency {concurrency}: "
+          f"{len(samples) / duration:.1f} req/s")
+    print(f"{'intent':<14}{'count':>7}{'errors':>8}{'degraded':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    by_intent = {}
+    for intent, seconds, ok, degraded in samples:
+        by_intent.setdefault(intent, []).append((seconds, ok, degraded))
+    for intent in sorted(by_intent, key=lambda name: -len(by_intent[name])) + ["all"]:
+        rows = [(s, o, d) for i, s, o, d in samples] if intent == "all" else by_intent[intent]
+        ordered = sorted(s for s, _, _ in rows)
+        print(f"{intent:<14}{len(rows):>7}{sum(1 for _, o, _ in rows if not o):>8}{sum(1 for _, _, d in rows if d):>10}"
+              f"{percentile(ordered, 0.5) * 1000:>10.0f}{percentile(ordered, 0.95) * 1000:>10.0f}"
+              f"{percentile(ordered, 0.99) * 1000:>10.0f}")
+
+    if fakes:
+        print("\nUpstream calls (after caching/batching): " + ", ".join(
+            f"{name} {profile.calls}" + (f" ({profile.errors} failed)" if profile.errors else "")
+            for name, (_, profile) in fakes.items()))
+    if meter:
+        usage = meter.report()
+        label = "Event loop" if isinstance(meter, AsgiUtilizationMeter) else "Request threads"
+        print(f"{label}: mean {usage['mean_in_flight']:.1f} / peak {usage['peak_in_flight']} in flight, "
+              f"{usage['cpu_cores']:.2f} CPU cores busy, {usage['cpu_share'] * 100:.1f}% of request time on CPU "
+              f"(the rest waiting on upstreams)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds of load before measuring")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="intent=weight pairs")
+    parser.add_argument("--latency", default="", help="upstream=median_ms[:sigma] pairs")
+    parser.add_argument("--errors", default="", help="upstream=error_rate pairs")
+    parser.add_argument("--video-seconds", type=float, default=20.0, help="how long a fake Runway task takes")
+    parser.add_argument("--fakes-only", action="store_true", help="only serve the fakes and print their env")
+    parser.add_argument("--port-base", type=int, default=18000, help="first port for --fakes-only")
+    parser.add_argument("--url", help="drive an app that is already running (and pointed at the fakes)")
+    parser.add_argument("--asgi", action="store_true", help="serve asgi.py under uvicorn instead of the threaded WSGI server")
+    parser.add_argument("--threads", type=int, help="cap the WSGI server's request threads")
+    args = parser.parse_args()
+    if args.asgi and not HAS_UVICORN:
+        parser.error("--asgi needs uvicorn (pip install uvicorn)")
+
+    global VIDEO_SECONDS
+    VIDEO_SECONDS = args.video_seconds
+    mix = parse_pairs(args.mix, float)
+    unknown = set(mix) - set(PROMPTS)
+    if unknown:
+        parser.error(f"unknown intents in --mix: {', '.join(sorted(unknown))}")
+    latency = parse_pairs(args.latency)
+    errors = parse_pairs(args.errors, float)
+
+    if args.fakes_only:
+        fakes, env = start_fakes(latency, errors, args.seed, args.port_base)
+        for name in DISABLED:
+            print(f"export {name}=")
+        for key, value in env.items():
+            print(f"export {key}={value}")
+        print("# Serving fakes; Ctrl-C to stop", flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            return
+
+    fakes, meter = None, None
+    if args.url:
+        url = args.url.rstrip("/")
+    else:
+        fakes, env = start_fakes(latency, errors, args.seed)
+        url, meter = start_app(env, asgi=args.asgi, threads=args.threads)
+    print(f"Driving {url}/ask with {args.concurrency} users for {args.duration:.0f} s (+{args.warmup:.0f} s warm-up)")
+    samples = run_load(url, mix, args.concurrency, args.duration, args.warmup, args.seed, meter)
+    report(samples, args.duration, args.concurrency, fakes, meter)
+
+
+if __name__ == "__main__":
+    main()
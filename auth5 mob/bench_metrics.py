@@ -0,0 +1,79 @@
+"""
+Overhead benchmark for the /metrics instrumentation.
+
+Measures a bare no-op call against the same call wrapped by metrics.timed(),
+the cost of a single histogram observation, and a full Flask request to a
+cheap route with and without the request hooks, so the added latency per
+request can be compared with the milliseconds an upstream call takes.
+
+Usage: python bench_metrics.py [--calls 200000] [--requests 5000]
+"""
+import argparse
+import statistics
+import time
+
+import metrics
+
+
+def per_call_ns(func, calls):
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter_ns() - start) / calls
+
+
+def noop():
+    return "ok"
+
+
+def measure_requests(client, path, requests, rounds=5):
+    # Best of several rounds, so scheduler noise doesn't decide the comparison
+    results = []
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        for _ in range(requests):
+            client.get(path).close()
+        results.append((time.perf_counter_ns() - start) / requests)
+    return min(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    wrapped = metrics.timed(noop, "bench", "noop", metrics.text_outcome)
+    histogram = metrics.Histogram("bench_seconds", "bench", labels=("a", "b"))
+    for func in (noop, wrapped):
+        per_call_ns(func, 1000)
+
+    bare = statistics.median(per_call_ns(noop, args.calls) for _ in range(3))
+    timed = statistics.median(per_call_ns(wrapped, args.calls) for _ in range(3))
+    observe = statistics.median(
+        per_call_ns(lambda: histogram.observe(0.042, "x", "y"), args.calls) for _ in range(3)
+    )
+    print(f"bare call        {bare:8.0f} ns")
+    print(f"timed() call     {timed:8.0f} ns  (+{timed - bare:.0f} ns per upstream call)")
+    print(f"observe()        {observe:8.0f} ns")
+
+    from app import app, start_request_timer, record_request_metrics
+    client = app.test_client()
+    path = "/upstream_stats"
+    measure_requests(client, path, 200)
+    with_hooks = measure_requests(client, path, args.requests)
+    app.before_request_funcs[None].remove(start_request_timer)
+    app.after_request_funcs[None].remove(record_request_metrics)
+    without_hooks = measure_requests(client, path, args.requests)
+    overhead = with_hooks - without_hooks
+    print(f"request, no hooks   {without_hooks / 1000:8.1f} us")
+    print(f"request, metrics    {with_hooks / 1000:8.1f} us  (+{overhead / 1000:.1f} us, "
+          f"{overhead / without_hooks * 100:.1f}% of an in-process request)")
+
+    started = time.perf_counter()
+    text = metrics.REGISTRY.render()
+    print(f"/metrics render     {(time.perf_counter() - started) * 1000:8.2f} ms for {len(text.splitlines())} lines")
+
+
+if __name__ == "__main__":
+    main()
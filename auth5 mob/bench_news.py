@@ -0,0 +1,184 @@
+"""
+Benchmark for the news aggregator.
+
+Generates a synthetic news cycle: stories break over time and several
+outlets report each one with a slightly different title (outlet suffix,
+reordered or pluralised words, an extra clause, a dropped or swapped word),
+split across a headlines feed and a market-news feed that overlap. Stand-in
+NewsAPI / Alpha Vantage clients serve a sliding window of the newest
+articles with --latency seconds of simulated round trip.
+
+Reports answer latency for the live path (a fetch per request, as
+get_top_news() did) against the aggregator's store, how much of each
+incremental refresh was actually ingested, how many stories were stored
+against the real number, how many title comparisons the MinHash index
+needed compared with checking every pair, and how the duplicate rule
+scores on every pair of titles against the ground truth.
+
+Usage: python bench_news.py [--events 400] [--outlets 4] [--rounds 24] [--latency 0.3] [--overlap 0.7]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from news_aggregator import NewsAggregator, NewsStore, same_story, title_words
+
+OUTLETS = ["Reuters", "AP", "Bloomberg", "CNBC", "BBC", "The Verge", "MarketWatch", "FT"]
+
+
+def make_vocabulary(rnd, size=3000):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rnd.choice("bcdfgklmnprstvz") + rnd.choice("aeiou") for _ in range(rnd.randint(2, 4))))
+    return sorted(words)
+
+
+def variant(rnd, words, vocabulary):
+    """One outlet's title for a story."""
+    words = list(words)
+    kind = rnd.choice(["same", "reorder", "plural", "clause", "drop", "swap"])
+    if kind == "reorder":
+        i = rnd.randrange(len(words) - 1)
+        words[i], words[i + 1] = words[i + 1], words[i]
+    elif kind == "plural":
+        i = rnd.randrange(len(words))
+        words[i] += "s"
+    elif kind == "clause":
+        words += ["as"] + rnd.sample(vocabulary, rnd.randint(2, 4))
+    elif kind == "drop":
+        del words[rnd.randrange(len(words))]
+    elif kind == "swap":
+        words[rnd.randrange(len(words))] = rnd.choice(vocabulary)
+    return " ".join(words).capitalize()
+
+
+def make_cycle(events, outlets, seed):
+    """[(published_at, feed, article, event id)] oldest first, over one simulated day."""
+    rnd = random.Random(seed)
+    vocabulary = make_vocabulary(rnd)
+    start = time.time() - 86400
+    articles = []
+    for event in range(events):
+        words = rnd.sample(vocabulary, rnd.randint(6, 10))
+        broke = start + 86400 * event / events
+        # A third of the stories are market news; some of those also make the general headlines
+        feeds = rnd.choice([["headlines"], ["headlines"], ["market"], ["headlines", "market"]])
+        for number, outlet in enumerate(rnd.sample(OUTLETS, outlets)):
+            feed = feeds[number % len(feeds)]
+            title = variant(rnd, words, vocabulary)
+            if feed == "headlines":
+                title += f" - {outlet}"
+            published = broke + rnd.uniform(0, 1800)
+            articles.append((published, feed, {"title": title, "url": f"https://news.invalid/{event}/{number}",
+                                               "source": outlet, "description": None, "published_at": published}, event))
+    articles.sort(key=lambda item: item[0])
+    return articles
+
+
+class StandIn:
+    """NewsService / StockService look-alike serving the newest articles published before `now`."""
+
+    def __init__(self, cycle, latency, window=20):
+        self.cycle = cycle
+        self.latency = latency
+        self.window = window
+        self.now = 0.0
+        self.calls = 0
+        self.returned = 0
+
+    def _latest(self, feed, since=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        latest = [article for published, name, article, _ in self.cycle if name == feed and published <= self.now]
+        if since:
+            latest = [article for article in latest if article["published_at"] >= since]
+        latest = [dict(article) for article in reversed(latest[-self.window:])]
+        self.returned += len(latest)
+        return latest
+
+    def fetch_headlines(self, category="general", country="us", page_size=20):
+        return self._latest("headlines")
+
+    def fetch_market_news(self, symbol=None, since=None, limit=50, deadline=None, reserve=0):
+        return self._latest("market", since)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=400, help="distinct stories over the day")
+    parser.add_argument("--outlets", type=int, default=4, help="outlets reporting each story")
+    parser.add_argument("--rounds", type=int, default=24, help="refreshes spread over the day")
+    parser.add_argument("--latency", type=float, default=0.3, help="simulated upstream round trip (s)")
+    parser.add_argument("--overlap", type=float, default=0.7, help="NEWS_DUPLICATE_OVERLAP")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    cycle = make_cycle(args.events, args.outlets, args.seed)
+    # Every article published between two refreshes fits in one response
+    service = StandIn(cycle, 0.0, window=max(20, 2 * len(cycle) // args.rounds))
+    # Keep every story so the whole day can be checked against the ground truth
+    store = NewsStore(max_items=len(cycle), overlap=args.overlap)
+    aggregator = NewsAggregator(service, service, store=store, prefetch=[])
+    keys = [("headlines", "general", "us"), ("market", "")]
+
+    refresh_seconds = []
+    first = cycle[0][0]
+    for round_number in range(1, args.rounds + 1):
+        service.now = first + 86400 * round_number / args.rounds
+        for key in keys:
+            start = time.perf_counter()
+            aggregator.refresh(key, background=True)
+            refresh_seconds.append(time.perf_counter() - start)
+
+    stats = store.stats()
+    print(f"{len(cycle)} articles about {args.events} stories from {args.outlets} outlets, "
+          f"{args.rounds} refreshes of 2 feeds")
+    print(f"  fetched {service.returned}, ingested as new stories {stats['ingested']}, merged as duplicates "
+          f"{stats['duplicates']}, repeats {stats['repeats']}, skipped as older than the watermark {stats['skipped_old']}")
+    print(f"  refresh (dedupe, ingest, format): median {statistics.median(refresh_seconds) * 1000:.2f} ms, "
+          f"max {max(refresh_seconds) * 1000:.2f} ms")
+    print(f"  stories stored {stats['stories']} for {args.events} real stories")
+    brute = sum(range(stats["ingested"] + stats["duplicates"] + stats["repeats"]))
+    print(f"  title comparisons with the MinHash index {stats['comparisons']:,} vs every pair {brute:,}")
+
+    # The duplicate rule itself, on every pair of titles
+    words = [(title_words(article["title"]), event) for _, _, article, event in cycle]
+    found = missed = false = 0
+    for i, (a, event_a) in enumerate(words):
+        for b, event_b in words[i + 1:]:
+            match = same_story(a, b, args.overlap)
+            if event_a == event_b:
+                found += match
+                missed += not match
+            else:
+                false += match
+    print(f"  duplicate rule: {found / (found + missed):.1%} of same-story pairs matched, "
+          f"{false} of {sum(range(len(words))) - found - missed:,} different-story pairs matched")
+
+    # Answer latency: live fetch per request vs the store
+    service.latency = args.latency
+    live = []
+    for _ in range(5):
+        start = time.perf_counter()
+        articles = service.fetch_headlines()
+        "".join(article["title"] for article in articles[:5])
+        live.append(time.perf_counter() - start)
+    lookups = []
+    for _ in range(10000):
+        start = time.perf_counter()
+        aggregator.top_news()
+        lookups.append(time.perf_counter() - start)
+    print(f"\nanswer latency, live fetch: p50 {statistics.median(live) * 1000:.1f} ms")
+    print(f"answer latency, store:      p50 {percentile(lookups, 0.5) * 1e6:.1f} µs, "
+          f"p99 {percentile(lookups, 0.99) * 1e6:.1f} µs")
+    print(f"upstream calls during the 10,000 store lookups: {service.calls - args.rounds * len(keys) - len(live)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark for the hedging provider router, using local fake providers.
+
+FakeProvider stands in for OpenRouterClient/GeminiClient: it answers after a
+lognormal delay, with an optional slow tail and a failure rate, and can be
+made to return 429s for a stretch of time. The same request stream is
+run against the primary alone and through ProviderRouter, and latency
+percentiles, error rates, hedges and ejections are reported.
+
+Usage: python bench_provider_router.py [--requests 400] [--concurrency 8] [--stream]
+"""
+import argparse
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from provider_router import ProviderRouter
+
+
+class FakeProvider:
+    def __init__(self, name, median, tail_rate=0.0, tail=0.0, error_rate=0.0, rate_limited=(0, 0), seed=0):
+        self.name = name
+        self.median = median
+        self.tail_rate = tail_rate
+        self.tail = tail
+        self.error_rate = error_rate
+        self.rate_limited = rate_limited  # (from, to) seconds after the first call answered with 429s
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.started = None
+
+    def _next(self):
+        with self.lock:
+            self.calls += 1
+            self.started = self.started or time.perf_counter()
+            elapsed = time.perf_counter() - self.started
+            delay = self.median * math.exp(self.random.gauss(0, 0.25))
+            if self.random.random() < self.tail_rate:
+                delay += self.tail
+            failed = self.rate_limited[0] <= elapsed < self.rate_limited[1] or self.random.random() < self.error_rate
+        return delay, failed
+
+    def fetch_full_response(self, prompt, file_data=None, history=None):
+        delay, failed = self._next()
+        if failed:
+            time.sleep(0.02)
+            return {"response": f"API Error 429 from {self.name}", "emotion": "Neutral", "failure": {"status": 429}}, False
+        time.sleep(delay)
+        return {"response": f"{self.name} answer", "emotion": "Neutral"}, True
+
+    def stream_full_response(self, prompt, file_data=None, history=None):
+        delay, failed = self._next()
+        if failed:
+            time.sleep(0.02)
+            yield "error", {"response": f"API Error 429 from {self.name}", "emotion": "Neutral", "failure": {"status": 429}}
+            return
+        time.sleep(delay / 2)
+        for word in ("streamed", "answer", "from", self.name):
+            yield "delta", word + " "
+            time.sleep(delay / 8)
+        yield "done", {"response": f"streamed answer from {self.name}", "emotion": "Neutral"}
+
+
+def call(target, stream):
+    start = time.perf_counter()
+    if stream:
+        kind = None
+        for kind, payload in target.stream_full_response("hello"):
+            pass
+        ok = kind == "done"
+    else:
+        _, ok = target.fetch_full_response("hello")
+    return time.perf_counter() - start, ok
+
+
+def run(name, target, requests, concurrency, stream):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: call(target, stream), range(requests)))
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    print(f"{name:<20} p50 {pick(0.5):6.0f} ms | p95 {pick(0.95):6.0f} ms | p99 {pick(0.99):6.0f} ms | "
+          f"errors {errors / len(results):6.1%}")
+
+
+def providers(seed):
+    # Primary: usually fast with a slow tail and a burst of 429s; secondary: steadier but slower
+    return (FakeProvider("primary", 0.15, tail_rate=0.04, tail=1.5, rate_limited=(3, 5), seed=seed),
+            FakeProvider("secondary", 0.25, tail_rate=0.01, tail=0.5, error_rate=0.01, seed=seed + 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--stream", action="store_true", help="measure stream_full_response instead")
+    args = parser.parse_args()
+
+    print(f"{args.requests} {'streamed ' if args.stream else ''}requests, concurrency {args.concurrency}")
+    primary, _ = providers(1)
+    run("primary only", primary, args.requests, args.concurrency, args.stream)
+
+    router = ProviderRouter(providers(1), hedge_default=0.5, hedge_min=0.1, eject_seconds=2)
+    run("router (hedged)", router, args.requests, args.concurrency, args.stream)
+    stats = router.stats()
+    print(f"hedged {stats['hedged']}, failovers {stats['failovers']}, "
+          + ", ".join(f"{name}: ejections {p['ejections']}, hedges won {p['hedges_won']}"
+                      for name, p in stats["providers"].items()))
+
+
+if __name__ == "__main__":
+    main()
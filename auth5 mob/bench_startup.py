@@ -0,0 +1,83 @@
+"""
+Startup benchmark for app.py.
+
+Imports the app in fresh interpreters under `python -X importtime`, once with
+lazy clients (the default) and once with LAZY_SERVICES=0, which builds every
+client at import time the way startup used to. Every service is given a
+dummy API key so each client is configured, and HTTP prewarming is off, so
+nothing here needs the network. Reports the median import time, which of
+the heavy SDKs were imported before the app was ready and what each cost
+(from -X importtime), and how long the background warm-up then took per
+client.
+
+Usage: python bench_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY = ["google.generativeai", "googleapiclient.discovery", "supabase", "runwayml", "pyautogui", "cv2"]
+KEYS = ["GEMINI_API_KEY", "OPENROUTER_API_KEY", "YOUTUBE_API_KEY", "RUNWAYML_API_KEY", "OPENWEATHER_API_KEY",
+        "NEWS_API_KEY", "CMC_API_KEY", "ALPHA_VANTAGE_API_KEY", "STABILITY_API_KEY"]
+
+CHILD = f"""
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter() - started
+heavy = [name for name in {HEAVY!r} if name in sys.modules]
+app.services.warm_up().join()
+print(json.dumps({{"import": imported, "heavy": heavy, "services": app.services.stats()}}))
+"""
+
+
+def run(lazy):
+    """One fresh interpreter. Returns (child report, {module: cumulative µs})."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [APP_DIR, os.environ.get("PYTHONPATH")])),
+               LAZY_SERVICES="1" if lazy else "0", SERVICE_WARM_UP="0", HTTP_PREWARM="0",
+               SUPABASE_URL="https://bench.supabase.co", SUPABASE_KEY="bench-key", OPENROUTER_MODEL="bench/model")
+    env.update({key: "bench-key" for key in KEYS})
+    # Databases, caches and logs go to a scratch directory instead of the checkout
+    with tempfile.TemporaryDirectory(prefix="globlexgpt-startup-") as directory:
+        env["GEMINI_MODEL_CACHE"] = os.path.join(directory, "gemini_models.json")
+        done = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD], cwd=directory, env=env,
+                              capture_output=True, text=True, check=True)
+    imports = {}
+    for line in done.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imports[name.strip()] = max(int(cumulative), imports.get(name.strip(), 0))
+    return json.loads(done.stdout.strip().splitlines()[-1]), imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for label, lazy in (("eager (LAZY_SERVICES=0)", False), ("lazy (default)", True)):
+        runs = [run(lazy) for _ in range(args.runs)]
+        report, imports = runs[-1]
+        print(f"{label}: import app {statistics.median(r['import'] for r, _ in runs) * 1000:.0f} ms "
+              f"(median of {args.runs})")
+        print(f"  heavy SDKs imported before ready: {', '.join(report['heavy']) or 'none'}")
+        for name in HEAVY:
+            if name in imports:
+                when = "before ready" if name in report["heavy"] else "during warm-up"
+                print(f"  {imports[name] / 1000:8.1f} ms  import {name} ({when})")
+        if lazy:
+            print("  background warm-up after the first request:")
+            for name, stats in report["services"].items():
+                detail = f"{stats['seconds'] * 1000:.0f} ms" if stats["state"] == "built" else stats.get("error", "")
+                print(f"  {name:>16}: {stats['state']} {detail}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
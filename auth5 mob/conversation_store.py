@@ -0,0 +1,190 @@
+import queue
+import sqlite3
+import threading
+import time
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token) used for budgeting."""
+    return len(text or "") // 4 + 4
+
+
+def truncate_summary(previous, turns, max_tokens):
+    """Fallback summarizer: keeps the start of every turn when no LLM summarizer is configured."""
+    lines = [previous] if previous else []
+    for turn in turns:
+        first_line = turn["content"].strip().split("\n")[0][:200]
+        lines.append(f"{turn['role']}: {first_line}")
+    text = "\n".join(lines)
+    # Keep the newest part if it's still too long
+    return text[-max_tokens * 4:]
+
+
+class ConversationStore:
+    """
+    Append-only SQLite log of chat turns and rolling summaries, keyed by (user_id, chat_id).
+
+    Turns and summaries are only ever inserted. The newest summary row covers
+    every turn up to its `upto` turn id, so reading a conversation means one
+    summary plus the turns after it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS turns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_by_chat ON turns (user_id, chat_id, id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS summaries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    upto INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS summaries_by_chat ON summaries (user_id, chat_id, id)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def append(self, user_id, chat_id, role, content):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO turns (user_id, chat_id, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, chat_id, role, content, estimate_tokens(content), time.time())
+            )
+        finally:
+            conn.close()
+
+    def summary(self, user_id, chat_id):
+        """Returns the newest summary row as a dict, or None."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT upto, content, tokens FROM summaries WHERE user_id = ? AND chat_id = ? ORDER BY id DESC LIMIT 1",
+                (user_id, chat_id)
+            ).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def turns_after(self, user_id, chat_id, after_id=0):
+        """Returns the turns not yet covered by a summary, oldest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT id, role, content, tokens FROM turns WHERE user_id = ? AND chat_id = ? AND id > ? ORDER BY id",
+                (user_id, chat_id, after_id)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def add_summary(self, user_id, chat_id, upto, content):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO summaries (user_id, chat_id, upto, content, tokens, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, chat_id, upto, content, estimate_tokens(content), time.time())
+            )
+        finally:
+            conn.close()
+
+
+class ContextAssembler:
+    """
+    Builds the history messages sent with each prompt within a token budget.
+
+    The context is the rolling summary (capped at `summary_tokens`) followed by
+    as many recent turns as fit in the rest of `budget_tokens`. Once the
+    unsummarized turns outgrow half the budget, everything but the last
+    `keep_turns` is folded into a new summary by a background worker, so the
+    request path never waits on summarization and the per-turn prompt stays
+    bounded however long the conversation gets.
+
+    `summarize(previous_summary, turns, max_tokens)` returns the new summary text.
+    """
+
+    def __init__(self, store, budget_tokens=2000, summary_tokens=400, keep_turns=6, summarize=None):
+        self.store = store
+        self.budget_tokens = budget_tokens
+        self.summary_tokens = summary_tokens
+        self.keep_turns = keep_turns
+        self.summarize = summarize or truncate_summary
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.jobs = queue.Queue()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def build(self, user_id, chat_id):
+        """Returns [{"role", "content"}] for the earlier conversation, oldest first."""
+        summary = self.store.summary(user_id, chat_id)
+        turns = self.store.turns_after(user_id, chat_id, summary["upto"] if summary else 0)
+
+        messages = []
+        remaining = self.budget_tokens
+        if summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary['content']}"})
+            remaining -= summary["tokens"]
+
+        recent = []
+        for turn in reversed(turns):
+            if turn["tokens"] > remaining:
+                break
+            recent.append({"role": turn["role"], "content": turn["content"]})
+            remaining -= turn["tokens"]
+        messages.extend(reversed(recent))
+
+        if sum(turn["tokens"] for turn in turns) > self.budget_tokens // 2 and len(turns) > self.keep_turns:
+            self._schedule(user_id, chat_id)
+        return messages
+
+    def record(self, user_id, chat_id, prompt, response):
+        self.store.append(user_id, chat_id, "user", prompt)
+        self.store.append(user_id, chat_id, "assistant", response)
+
+    def _schedule(self, user_id, chat_id):
+        with self.lock:
+            if (user_id, chat_id) in self.pending:
+                return
+            self.pending.add((user_id, chat_id))
+        self.jobs.put((user_id, chat_id))
+
+    def _worker(self):
+        while True:
+            user_id, chat_id = self.jobs.get()
+            try:
+                self._fold(user_id, chat_id)
+            except Exception as e:
+                print(f"Error summarizing conversation {chat_id}: {e}")
+            finally:
+                with self.lock:
+                    self.pending.discard((user_id, chat_id))
+
+    def _fold(self, user_id, chat_id):
+        summary = self.store.summary(user_id, chat_id)
+        turns = self.store.turns_after(user_id, chat_id, summary["upto"] if summary else 0)
+        old = turns[:-self.keep_turns]
+        if not old:
+            return
+        content = self.summarize(summary["content"] if summary else "", old, self.summary_tokens)
+        self.store.add_summary(user_id, chat_id, old[-1]["id"], content[-self.summary_tokens * 4:])
@@ -1,45 +1,74 @@
-import requests
+from http_transport import get_transport
+from quote_broker import QuoteBroker
+from resilience import GuardedTransport, UpstreamUnavailable, get_guard
 import os
+import time
 
 class CryptoService:
-    def __init__(self, api_key):
+    def __init__(self, api_key, transport=None, guard=None):
         self.api_key = api_key
-        self.base_url = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest"
-
-    def get_price(self, symbol):
-        """Fetches the latest price for a given cryptocurrency symbol (e.g., BTC, ETH)."""
-        if not self.api_key:
-            return "CoinMarketCap API key not configured."
+        self.api_root = os.getenv("CMC_BASE_URL", "https://pro-api.coinmarketcap.com").rstrip("/")
+        self.base_url = self.api_root + "/v1/cryptocurrency/quotes/latest"
+        self.guard = guard or get_guard("coinmarketcap")
+        self.http = GuardedTransport(transport or get_transport(), self.guard)
+        # Bursts of questions about BTC/ETH/SOL share one multi-symbol quotes/latest call
+        self.broker = QuoteBroker(
+            self.get_quotes,
+            window=float(os.getenv("CRYPTO_BATCH_WINDOW_MS", 50)) / 1000,
+            freshness=float(os.getenv("CRYPTO_QUOTE_TTL", 30))
+        )
 
+    def get_quotes(self, symbols):
+        """Fetches latest quotes for several symbols in one call. Returns {SYMBOL: quote data}."""
         headers = {
             'Accepts': 'application/json',
             'X-CMC_PRO_API_KEY': self.api_key,
         }
-        
+
         parameters = {
-            'symbol': symbol.upper(),
-            'convert': 'USD'
+            'symbol': ",".join(symbol.upper() for symbol in symbols),
+            'convert': 'USD',
+            # Unknown symbols are left out of the result instead of failing the whole batch
+            'skip_invalid': 'true'
         }
 
+        response = self.http.get(self.base_url, headers=headers, params=parameters)
+        response.raise_for_status()
+        return response.json().get('data') or {}
+
+    def get_price(self, symbol):
+        """Fetches the latest price for a given cryptocurrency symbol (e.g., BTC, ETH)."""
+        if not self.api_key:
+            return "CoinMarketCap API key not configured."
+
         try:
-            response = requests.get(self.base_url, headers=headers, params=parameters)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Navigate the response structure
-            crypto_data = data['data'][symbol.upper()]
-            name = crypto_data['name']
-            price = crypto_data['quote']['USD']['price']
-            percent_change_24h = crypto_data['quote']['USD']['percent_change_24h']
-            
-            return f"The current price of {name} ({symbol.upper()}) is ${price:,.2f}. (24h change: {percent_change_24h:+.2f}%)"
+            crypto_data = self.broker.get(symbol)
+            if not crypto_data:
+                return f"Sorry, I couldn't fetch the price for {symbol}. Make sure the symbol is correct."
+
+            return self._format_price(symbol, crypto_data)
+        except UpstreamUnavailable:
+            last = self.broker.last(symbol)
+            if last:
+                quote, fetched_at = last
+                return (f"{self._format_price(symbol, quote)}\n_(Price from {time.strftime('%H:%M', time.localtime(fetched_at))}"
+                        f" — live prices are temporarily unavailable.)_")
+            return "⚠️ Crypto prices are temporarily unavailable. Please try again in a minute."
         except Exception as e:
             print(f"Error fetching crypto price: {e}")
             return f"Sorry, I couldn't fetch the price for {symbol}. Make sure the symbol is correct."
 
+    def _format_price(self, symbol, crypto_data):
+        # Navigate the response structure
+        name = crypto_data['name']
+        price = crypto_data['quote']['USD']['price']
+        percent_change_24h = crypto_data['quote']['USD']['percent_change_24h']
+
+        return f"The current price of {name} ({symbol.upper()}) is ${price:,.2f}. (24h change: {percent_change_24h:+.2f}%)"
+
     def get_top_cryptos(self, limit=5):
         """Fetches top N cryptocurrencies by market cap."""
-        url = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest"
+        url = self.api_root + "/v1/cryptocurrency/listings/latest"
         headers = {
             'Accepts': 'application/json',
             'X-CMC_PRO_API_KEY': self.api_key,
@@ -51,7 +80,7 @@ class CryptoService:
         }
 
         try:
-            response = requests.get(url, headers=headers, params=parameters)
+            response = self.http.get(url, headers=headers, params=parameters)
             response.raise_for_status()
             data = response.json()
             
@@ -63,6 +92,8 @@ class CryptoService:
                 top_list.append(f"{name} ({symbol}): ${price:,.2f}")
             
             return "Top Cryptocurrencies:\n" + "\n".join(top_list)
+        except UpstreamUnavailable:
+            return "⚠️ Crypto prices are temporarily unavailable. Please try again in a minute."
         except Exception as e:
             print(f"Error fetching top cryptos: {e}")
             return "Sorry, I couldn't fetch the top cryptocurrencies right now."
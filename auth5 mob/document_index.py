@@ -0,0 +1,372 @@
+import hashlib
+import heapq
+import itertools
+import math
+import queue
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+
+from conversation_store import estimate_tokens
+
+WORD = re.compile(r"\w+")
+
+
+def chunk_text(text, chunk_chars=800):
+    """Splits text into chunks of at most `chunk_chars`, cutting at line breaks where possible."""
+    chunks = []
+    start, length = 0, len(text)
+    while start < length:
+        end = start + chunk_chars
+        if end < length:
+            newline = text.rfind("\n", start, end)
+            if newline > start:
+                end = newline + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the chunks of one document, held in memory: an inverted
+    index of term -> (chunk numbers, term frequencies) as compact arrays.
+    """
+
+    def __init__(self, digest, name, chunks, k1=1.2, b=0.75):
+        self.digest = digest
+        self.name = name
+        self.k1 = k1
+        self.b = b
+        self.chunks = chunks
+        self.lengths = array("I")
+        self.postings = {}
+        for number, chunk in enumerate(chunks):
+            counts = Counter(WORD.findall(chunk.lower()))
+            self.lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                entry = self.postings.get(term)
+                if entry is None:
+                    entry = self.postings[term] = (array("I"), array("I"))
+                entry[0].append(number)
+                entry[1].append(frequency)
+        self.tokens = sum(estimate_tokens(chunk) for chunk in chunks)
+
+    def _postings(self, terms):
+        return {term: self.postings[term] for term in terms if term in self.postings}
+
+    def chunk(self, number):
+        return self.chunks[number]
+
+    def search(self, query, k):
+        """Returns up to k (score, chunk number) pairs, best first."""
+        terms = set(WORD.findall((query or "").lower()))
+        count = len(self.lengths)
+        if not terms or not count:
+            return []
+        average = sum(self.lengths) / count or 1
+        scores = {}
+        for term, (numbers, frequencies) in self._postings(terms).items():
+            idf = math.log(1 + (count - len(numbers) + 0.5) / (len(numbers) + 0.5))
+            for number, frequency in zip(numbers, frequencies):
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[number] / average)
+                scores[number] = scores.get(number, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(k, ((score, number) for number, score in scores.items()))
+
+
+class StoredIndex(BM25Index):
+    """A BM25Index persisted by DocumentStore. Only the postings of query terms and the chosen chunks are read."""
+
+    def __init__(self, store, digest, name, lengths, tokens, k1=1.2, b=0.75):
+        self.store = store
+        self.digest = digest
+        self.name = name
+        self.k1 = k1
+        self.b = b
+        self.lengths = lengths
+        self.tokens = tokens
+
+    def _postings(self, terms):
+        return self.store.postings(self.digest, terms)
+
+    def chunk(self, number):
+        return self.store.chunk(self.digest, number)
+
+
+class DocumentStore:
+    """SQLite persistence for document indexes and the conversations they were attached to."""
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    digest TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    lengths BLOB NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_chunks (
+                    digest TEXT NOT NULL,
+                    number INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    PRIMARY KEY (digest, number)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_postings (
+                    digest TEXT NOT NULL,
+                    term TEXT NOT NULL,
+                    numbers BLOB NOT NULL,
+                    frequencies BLOB NOT NULL,
+                    PRIMARY KEY (digest, term)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_documents (
+                    user_id TEXT NOT NULL,
+                    chat_id TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    added_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, chat_id, digest)
+                )
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def save(self, index, batch=2000):
+        """
+        Writes a BM25Index. Rows are committed in batches so other requests'
+        writes never wait long on a big document; the documents row goes last,
+        so load() only ever sees complete indexes.
+        """
+        chunks = ((index.digest, number, chunk) for number, chunk in enumerate(index.chunks))
+        postings = ((index.digest, term, numbers.tobytes(), frequencies.tobytes())
+                    for term, (numbers, frequencies) in index.postings.items())
+        conn = self._connect()
+        try:
+            for sql, rows in (("INSERT OR REPLACE INTO document_chunks VALUES (?, ?, ?)", chunks),
+                              ("INSERT OR REPLACE INTO document_postings VALUES (?, ?, ?, ?)", postings)):
+                while True:
+                    rows_batch = list(itertools.islice(rows, batch))
+                    if not rows_batch:
+                        break
+                    conn.execute("BEGIN")
+                    try:
+                        conn.executemany(sql, rows_batch)
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+            conn.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                (index.digest, index.name, index.lengths.tobytes(), index.tokens, time.time())
+            )
+        finally:
+            conn.close()
+
+    def load(self, digest):
+        """Returns a StoredIndex, or None if the document was never saved."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT name, lengths, tokens FROM documents WHERE digest = ?", (digest,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        lengths = array("I")
+        lengths.frombytes(row[1])
+        return StoredIndex(self, digest, row[0], lengths, row[2])
+
+    def postings(self, digest, terms):
+        terms = list(terms)
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT term, numbers, frequencies FROM document_postings WHERE digest = ? AND term IN ({','.join('?' * len(terms))})",
+                (digest, *terms)
+            ).fetchall()
+        finally:
+            conn.close()
+        result = {}
+        for term, numbers_blob, frequencies_blob in rows:
+            numbers, frequencies = array("I"), array("I")
+            numbers.frombytes(numbers_blob)
+            frequencies.frombytes(frequencies_blob)
+            result[term] = (numbers, frequencies)
+        return result
+
+    def chunk(self, digest, number):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT content FROM document_chunks WHERE digest = ? AND number = ?", (digest, number)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else ""
+
+    def link(self, user_id, chat_id, digest):
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR IGNORE INTO chat_documents VALUES (?, ?, ?, ?)", (user_id, chat_id, digest, time.time()))
+        finally:
+            conn.close()
+
+    def linked(self, user_id, chat_id):
+        """Digests of the documents attached to a conversation, oldest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT digest FROM chat_documents WHERE user_id = ? AND chat_id = ? ORDER BY added_at",
+                (user_id, chat_id)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+
+
+class DocumentRetriever:
+    """
+    Retrieval over text attachments, so large files are not pasted into the prompt.
+
+    An attached text file is split into line-aligned chunks and indexed with
+    BM25 under the hash of its content. Each turn then sends only the chunks
+    that best match the prompt, at most `top_k` and within `budget_tokens`.
+    A document that fits the budget is sent whole.
+
+    Indexes are written to `store` by a background worker and linked to the
+    conversation, so follow-up questions in the same chat search the document
+    again without it being re-sent or re-indexed. The most recent indexes stay
+    in memory.
+    """
+
+    def __init__(self, store, budget_tokens=1500, top_k=8, chunk_chars=800, memory_documents=4):
+        self.store = store
+        self.budget_tokens = budget_tokens
+        self.top_k = top_k
+        self.chunk_chars = chunk_chars
+        self.memory_documents = memory_documents
+        self.memory = OrderedDict()  # digest -> BM25Index or StoredIndex
+        self.unsaved = {}  # digest -> BM25Index waiting for the worker
+        self.lock = threading.Lock()
+        self.counters = {"indexed": 0, "reused": 0, "queries": 0, "chunks_sent": 0, "tokens_sent": 0, "index_seconds": 0.0}
+        self.jobs = queue.Queue()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def add(self, file_data, owner=None):
+        """Indexes an isText attachment (or reuses its index). Returns the document's digest."""
+        text = file_data.get('data') or ""
+        digest = hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+        fresh = not self._index(digest)
+        if not fresh:
+            self._count("reused")
+        else:
+            start = time.perf_counter()
+            index = BM25Index(digest, file_data.get('name') or "attachment", chunk_text(text, self.chunk_chars))
+            with self.lock:
+                self.counters["indexed"] += 1
+                self.counters["index_seconds"] += time.perf_counter() - start
+                self.unsaved[digest] = index
+            self._remember(index)
+        # Linked before the save starts, so this never waits on the save's writes
+        if owner:
+            self.store.link(*owner, digest)
+        if fresh:
+            self.jobs.put(digest)
+        return digest
+
+    def context(self, prompt, owner=None, digests=()):
+        """
+        Returns the excerpts of this turn's and the conversation's documents
+        that match `prompt`, formatted for the model, or None when there are none.
+        """
+        digests = list(dict.fromkeys([*digests, *(self.store.linked(*owner) if owner else [])]))
+        indexes = [index for index in map(self._index, digests) if index]
+        if not indexes:
+            return None
+        self._count("queries")
+
+        if len(indexes) == 1 and indexes[0].tokens <= self.budget_tokens:
+            selected = [(indexes[0], number) for number in range(len(indexes[0].lengths))]
+        else:
+            candidates = []
+            for index in indexes:
+                candidates += [(score, position, index, number)
+                               for position, (score, number) in enumerate(index.search(prompt, self.top_k))]
+            candidates.sort(key=lambda item: (-item[0], item[1]))
+            if not candidates:
+                # Nothing matched (or no question yet): start from the beginning of each document
+                candidates = [(0.0, number, index, number) for index in indexes for number in range(min(self.top_k, len(index.lengths)))]
+            selected = [(index, number) for _, _, index, number in candidates[:self.top_k]]
+
+        sections, remaining = {}, self.budget_tokens
+        for index, number in selected:
+            text = index.chunk(number)
+            tokens = estimate_tokens(text)
+            if tokens > remaining:
+                continue
+            remaining -= tokens
+            sections.setdefault(index, []).append((number, text))
+
+        with self.lock:
+            self.counters["chunks_sent"] += sum(len(chunks) for chunks in sections.values())
+            self.counters["tokens_sent"] += self.budget_tokens - remaining
+
+        parts = []
+        for index, chunks in sections.items():
+            whole = len(chunks) == len(index.lengths)
+            header = f"[Context from attached file '{index.name}'" + ("]" if whole else f", {len(chunks)} of {len(index.lengths)} sections]")
+            parts.append(header + ":\n" + "\n...\n".join(text.strip("\n") for _, text in sorted(chunks, key=lambda chunk: chunk[0])))
+        return "\n\n".join(parts) or None
+
+    def _index(self, digest):
+        with self.lock:
+            index = self.memory.get(digest) or self.unsaved.get(digest)
+            if index:
+                self.memory[digest] = index
+                self.memory.move_to_end(digest)
+                return index
+        index = self.store.load(digest)
+        if index:
+            self._remember(index)
+        return index
+
+    def _remember(self, index):
+        with self.lock:
+            self.memory[index.digest] = index
+            self.memory.move_to_end(index.digest)
+            while len(self.memory) > self.memory_documents:
+                self.memory.popitem(last=False)
+
+    def _worker(self):
+        while True:
+            digest = self.jobs.get()
+            with self.lock:
+                index = self.unsaved.get(digest)
+            try:
+                if index:
+                    self.store.save(index)
+            except Exception as e:
+                print(f"Error saving document index {digest[:12]}: {e}")
+            finally:
+                with self.lock:
+                    self.unsaved.pop(digest, None)
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, memory_documents=len(self.memory), unsaved=len(self.unsaved))
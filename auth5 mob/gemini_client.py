@@ -1,128 +1,215 @@
-import google.generativeai as genai
+import asyncio
 import os
+import time
+from model_discovery import get_discovery
+from resilience import describe_failure
+from response_stream import ResponseExtractor
+from system_prompt import SYSTEM_INSTRUCTION, PromptUsage
+
+# Gemma models served through the Gemini API reject system instructions
+NO_SYSTEM_INSTRUCTION = ("gemma",)
+
+def _genai():
+    # google.generativeai (with grpc and protobuf) takes about a second to import, so it waits for the first call
+    import google.generativeai as genai
+    return genai
 
 class GeminiClient:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None):
         if api_key:
             api_key = api_key.strip()
-        genai.configure(api_key=api_key)
-        
-        self.model = None
-        self._configure_model()
+        self.api_key = api_key
+        self.discovery = get_discovery(api_key)
+        self.cache = cache  # optional ResponseCache
+        self.usage = PromptUsage()
+        self.model = None  # built by the first call
 
     def _configure_model(self):
-        """Dynamically find a working model availability."""
-        try:
-            print("Searching for available Gemini models...")
-            # List all models available to this API key
-            available_models = []
-            for m in genai.list_models():
-                if 'generateContent' in m.supported_generation_methods:
-                    available_models.append(m.name)
-            
-            print(f"Found models: {available_models}")
-
-            # clear model names (remove 'models/' prefix if present)
-            clean_models = [m.replace('models/', '') for m in available_models]
-
-            # Priority list
-            priorities = ['gemini-1.5-flash', 'gemini-1.5-pro', 'gemini-pro', 'gemini-1.0-pro']
-            
-            selected_model_name = None
-            
-            # Check for priority match
-            for p in priorities:
-                if p in clean_models:
-                    selected_model_name = p
-                    break
-            
-            # Fallback to first available if no priority match
-            if not selected_model_name and clean_models:
-                selected_model_name = clean_models[0]
-
-            if selected_model_name:
-                print(f"Selected model: {selected_model_name}")
-                self.model = genai.GenerativeModel(selected_model_name)
+        """Uses the model picked by the shared discovery cache; waits on list_models() only before the first discovery."""
+        name = self.discovery.current()
+        if self.model is None or self.model.model_name.replace('models/', '') != name:
+            genai = _genai()
+            genai.configure(api_key=self.api_key)
+            # As system_instruction the prompt is a stable prefix ahead of the conversation,
+            # which Gemini's implicit context caching can reuse between calls
+            if self._system_in_content(name):
+                self.model = genai.GenerativeModel(name)
             else:
-                print("CRITICAL: No text generation models found for this API Key.")
-                
-        except Exception as e:
-            print(f"Error configuring models: {e}")
+                self.model = genai.GenerativeModel(name, system_instruction=SYSTEM_INSTRUCTION)
+        return self.model
 
-    def get_full_response(self, prompt, file_data=None):
-        """Generates response and emotion in a single call, supporting optional file attachments."""
-        if not self.model:
-            self._configure_model()
-            if not self.model:
-                return {"response": "Error: No AI model available.", "emotion": "Neutral"}
-
-        system_instruction = (
-            "You are GlobleXGPT, a powerful AI assistant with advanced multimodal capabilities. "
-            "You CAN generate images, videos, and search YouTube. "
-            "If a user asks for an image, tell them you are generating it. "
-            "If a user asks for a video, tell them you are generating it. "
-            "If a user asks to find a YouTube video or trending videos, tell them you are looking for them. "
-            "You should also mention that you can animate images if they attach one. "
-            "Return your response in JSON format with exactly two keys: "
-            "'response' (your helpful text) and 'emotion' (one word describing user's mood, e.g., Happy, Neutral, Sad)."
+    @staticmethod
+    def _system_in_content(name):
+        return name.replace('models/', '').startswith(NO_SYSTEM_INSTRUCTION)
+
+    def _record_usage(self, response, first_token):
+        """Adds the call's usage_metadata (token counts) to self.usage."""
+        usage = getattr(response, "usage_metadata", None)
+        if not usage:
+            return
+        self.usage.record(
+            prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            cached_tokens=getattr(usage, "cached_content_token_count", 0) or 0,
+            completion_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+            first_token=first_token
         )
-        
-        try:
-            content_parts = [f"{system_instruction}\n\nUser: {prompt}"]
-            
-            if file_data and file_data.get('data'):
-                file_type = file_data.get('type', '')
-                
-                if file_data.get('isText'):
-                    # It's a text file, append content as context
-                    content_parts[0] += f"\n\n[Context from attached file '{file_data.get('name')}']:\n{file_data.get('data')}"
-                elif file_type.startswith('image/'):
-                    # It's an image, decode base64
-                    base64_data = file_data.get('data').split(',')[-1]
+
+    def _build_content(self, prompt, file_data=None, history=None):
+        """
+        Builds the content parts shared by the blocking and streaming calls.
+        `history` is the earlier conversation as [{"role", "content"}] messages.
+        """
+        transcript = ""
+        for message in history or []:
+            speaker = {"user": "User", "assistant": "Assistant"}.get(message["role"], "Context")
+            transcript += f"{speaker}: {message['content']}\n\n"
+        content_parts = [f"{transcript}User: {prompt}"]
+        if self._system_in_content(self.model.model_name):
+            content_parts[0] = f"{SYSTEM_INSTRUCTION}\n\n{content_parts[0]}"
+
+        if file_data and file_data.get('data'):
+            file_type = file_data.get('type', '')
+
+            if file_data.get('isText'):
+                # It's a text file, append content as context
+                content_parts[0] += f"\n\n[Context from attached file '{file_data.get('name')}']:\n{file_data.get('data')}"
+            elif file_type.startswith('image/'):
+                # It's an image; the attachment pipeline has usually decoded it already
+                image_bytes = file_data.get('bytes')
+                if image_bytes is None:
                     import base64
-                    image_bytes = base64.b64decode(base64_data)
-                    content_parts.append({
-                        "mime_type": file_type,
-                        "data": image_bytes
-                    })
-                else:
-                    # Generic fallback
-                    content_parts[0] += f"\n[Attached File: {file_data.get('name')}]"
-
-            response = self.model.generate_content(content_parts)
-            
-            # Simple parsing if AI follows instructions
-            text = response.text
-            import json
-            try:
-                # Use regex or simple split to find JSON if AI adds extra text
-                if "{" in text and "}" in text:
-                    start = text.find("{")
-                    end = text.rfind("}") + 1
-                    data = json.loads(text[start:end])
-                    return {
-                        "response": data.get("response", "I'm here to help."),
-                        "emotion": data.get("emotion", "Neutral")
-                    }
-            except:
-                pass
-            
-            return {"response": text, "emotion": "Neutral"}
+                    image_bytes = base64.b64decode(file_data.get('data').split(',')[-1])
+                content_parts.append({
+                    "mime_type": file_type,
+                    "data": image_bytes
+                })
+            else:
+                # Generic fallback
+                content_parts[0] += f"\n[Attached File: {file_data.get('name')}]"
+
+        return content_parts
 
+    def _cache_key(self, model, prompt, file_data, history):
+        if self.cache is None:
+            return None
+        return self.cache.key(prompt, model.model_name, SYSTEM_INSTRUCTION, file_data, history)
+
+    def get_full_response(self, prompt, file_data=None, history=None):
+        """Generates response and emotion in a single call, supporting optional file attachments."""
+        return self.respond(prompt, file_data, history)[0]
+
+    def respond(self, prompt, file_data=None, history=None):
+        """get_full_response() plus whether the result is an answer rather than an error message."""
+        try:
+            model = self._configure_model()
         except Exception as e:
-            error_str = str(e)
-            print(f"Error in Gemini response: {error_str}")
-            
-            if "429" in error_str:
+            print(f"Error configuring Gemini: {e}")
+            return self._error_result(e), False
+        key = self._cache_key(model, prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                return cached, True
+
+        start = time.perf_counter()
+        result, ok = self.fetch_full_response(prompt, file_data, history)
+        if key and ok:
+            self.cache.put(key, result, time.perf_counter() - start)
+        return result, ok
+
+    def fetch_full_response(self, prompt, file_data=None, history=None):
+        """Uncached API call. Returns (result, ok); ok is False when result carries an error message."""
+        try:
+            model = self._configure_model()
+            content_parts = self._build_content(prompt, file_data, history)
+            start = time.perf_counter()
+            response = model.generate_content(content_parts)
+            self._record_usage(response, time.perf_counter() - start)
+            return self._parse_text(response.text), True
+
+        except Exception as e:
+            print(f"Error in Gemini response: {e}")
+            return self._error_result(e), False
+
+    @staticmethod
+    def _parse_text(text):
+        """Turns the model's reply into {"response", "emotion"}; shared by the sync and async clients."""
+        # Simple parsing if AI follows instructions
+        import json
+        try:
+            # Use regex or simple split to find JSON if AI adds extra text
+            if "{" in text and "}" in text:
+                start = text.find("{")
+                end = text.rfind("}") + 1
+                data = json.loads(text[start:end])
                 return {
-                    "response": "⚠️ **Rate Limit Reached**: The free version of Gemini allows only a few requests per minute. Please wait 30 seconds and try again.",
-                    "emotion": "Neutral"
+                    "response": data.get("response", "I'm here to help."),
+                    "emotion": data.get("emotion", "Neutral")
                 }
-            
+        except:
+            pass
+        
+        return {"response": text, "emotion": "Neutral"}
+
+    def _error_result(self, e):
+        error_str = str(e)
+        if "404" in error_str:
+            # The cached model may have been retired; rediscover in the background
+            self.discovery.invalidate()
+        
+        if "429" in error_str:
             return {
-                "response": f"I'm having trouble connecting to my brain. Error: {error_str}",
-                "emotion": "Neutral"
+                "response": "⚠️ **Rate Limit Reached**: The free version of Gemini allows only a few requests per minute. Please wait 30 seconds and try again.",
+                "emotion": "Neutral",
+                "failure": describe_failure(e)
             }
+        
+        return {
+            "response": f"I'm having trouble connecting to my brain. Error: {error_str}",
+            "emotion": "Neutral",
+            "failure": describe_failure(e)
+        }
+
+    def stream_full_response(self, prompt, file_data=None, history=None):
+        """
+        Streaming variant of get_full_response. Yields ("delta", text) while the completion
+        arrives and finally ("done", {"response", "emotion"}), or ("error", {...}) with a
+        message for the user when the call failed.
+        """
+        try:
+            model = self._configure_model()
+        except Exception as e:
+            print(f"Error configuring Gemini: {e}")
+            yield "error", self._error_result(e)
+            return
+        key = self._cache_key(model, prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                yield "done", cached
+                return
+
+        extractor = ResponseExtractor()
+        start = time.perf_counter()
+        try:
+            content_parts = self._build_content(prompt, file_data, history)
+            chunk, first_token = None, None
+            for chunk in model.generate_content(content_parts, stream=True):
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                delta = extractor.feed(chunk.text)
+                if delta:
+                    yield "delta", delta
+            # Token counts arrive with the last chunk
+            self._record_usage(chunk, first_token)
+            result = extractor.result()
+            if key and result.get("response"):
+                self.cache.put(key, result, time.perf_counter() - start)
+            yield "done", result
+
+        except Exception as e:
+            print(f"Error in Gemini stream: {e}")
+            yield "error", self._error_result(e)
 
     def get_response(self, prompt):
         # Kept for compatibility but recommended to use get_full_response
@@ -132,3 +219,82 @@ class GeminiClient:
     def analyze_emotion(self, text):
         # Kept for compatibility but recommended to use get_full_response
         return "Neutral"
+
+
+class AsyncGeminiClient(GeminiClient):
+    """asyncio variant for the ASGI entry point, using the SDK's generate_content_async."""
+
+    async def _configure_model_async(self):
+        # The first build imports the SDK and may wait on the first model discovery: not on the event loop
+        if self.model is None:
+            return await asyncio.to_thread(self._configure_model)
+        return self._configure_model()
+
+    async def get_full_response(self, prompt, file_data=None, history=None):
+        return (await self.respond(prompt, file_data, history))[0]
+
+    async def respond(self, prompt, file_data=None, history=None):
+        try:
+            model = await self._configure_model_async()
+        except Exception as e:
+            print(f"Error configuring Gemini: {e}")
+            return self._error_result(e), False
+        key = self._cache_key(model, prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                return cached, True
+
+        start = time.perf_counter()
+        result, ok = await self.fetch_full_response(prompt, file_data, history)
+        if key and ok:
+            self.cache.put(key, result, time.perf_counter() - start)
+        return result, ok
+
+    async def fetch_full_response(self, prompt, file_data=None, history=None):
+        try:
+            model = await self._configure_model_async()
+            start = time.perf_counter()
+            response = await model.generate_content_async(self._build_content(prompt, file_data, history))
+            self._record_usage(response, time.perf_counter() - start)
+            return self._parse_text(response.text), True
+        except Exception as e:
+            print(f"Error in Gemini response: {e}")
+            return self._error_result(e), False
+
+    async def stream_full_response(self, prompt, file_data=None, history=None):
+        try:
+            model = await self._configure_model_async()
+        except Exception as e:
+            print(f"Error configuring Gemini: {e}")
+            yield "error", self._error_result(e)
+            return
+        key = self._cache_key(model, prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                yield "done", cached
+                return
+
+        extractor = ResponseExtractor()
+        start = time.perf_counter()
+        try:
+            response = await model.generate_content_async(self._build_content(prompt, file_data, history), stream=True)
+            chunk, first_token = None, None
+            async for chunk in response:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                delta = extractor.feed(chunk.text)
+                if delta:
+                    yield "delta", delta
+            self._record_usage(chunk, first_token)
+            result = extractor.result()
+            if key and result.get("response"):
+                self.cache.put(key, result, time.perf_counter() - start)
+            yield "done", result
+        except Exception as e:
+            print(f"Error in Gemini stream: {e}")
+            yield "error", self._error_result(e)
+
+    async def get_response(self, prompt):
+        return (await self.get_full_response(prompt))["response"]
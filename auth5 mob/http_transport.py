@@ -0,0 +1,89 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HttpTransport:
+    """
+    Shared HTTP layer for the upstream API clients.
+
+    One requests.Session holds a keep-alive connection pool per host, so a chat
+    turn reuses the TCP+TLS connection from the previous one instead of paying a
+    fresh handshake. Idempotent GETs are retried on connection errors and
+    502/503/504; POSTs are never retried since they may cost credits.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, retries=None, backoff_factor=0.3, timeout=None):
+        # pool_connections: number of hosts to keep pools for
+        # pool_maxsize: connections kept per host, should match the request threads per worker
+        self.pool_connections = pool_connections or int(os.getenv("HTTP_POOL_CONNECTIONS", 16))
+        self.pool_maxsize = pool_maxsize or int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+        retries = int(os.getenv("HTTP_RETRIES", 2)) if retries is None else retries
+        self.timeout = timeout or (float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)), float(os.getenv("HTTP_READ_TIMEOUT", 120)))
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def prewarm(self, urls, background=True):
+        """Opens a pooled connection to each host up front so the first user request skips the handshake."""
+        origins = []
+        for url in urls:
+            parts = urlsplit(url)
+            origin = f"{parts.scheme}://{parts.netloc}/"
+            if parts.netloc and origin not in origins:
+                origins.append(origin)
+
+        def warm(origin):
+            try:
+                # The status doesn't matter, only the connection left behind in the pool
+                self.session.head(origin, timeout=self.timeout, allow_redirects=False).close()
+            except Exception as e:
+                print(f"Could not pre-warm connection to {origin}: {e}")
+
+        threads = [threading.Thread(target=warm, args=(origin,), daemon=True) for origin in origins]
+        for thread in threads:
+            thread.start()
+        if not background:
+            for thread in threads:
+                thread.join()
+        return origins
+
+    def close(self):
+        self.session.close()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_transport():
+    """Returns the process-wide transport that all service clients share by default."""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = HttpTransport()
+    return _shared
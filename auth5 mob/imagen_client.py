@@ -1,16 +1,17 @@
-import requests
+from http_transport import get_transport
+from async_transport import get_async_transport
 import json
 import os
 import base64
 
 class ImagenClient:
-    def __init__(self, api_key, model=None):
+    def __init__(self, api_key, model=None, transport=None):
         self.api_key = api_key
         self.model = model or "provider-4/imagen-4"
-        self.base_url = "https://api.a4f.co/v1/images/generations"
+        self.base_url = os.getenv("A4F_BASE_URL", "https://api.a4f.co/v1").rstrip("/") + "/images/generations"
+        self.http = transport or get_transport()
 
-    def generate_image(self, prompt):
-        """Generates an image from a prompt and returns the URL or base64 data."""
+    def _request(self, prompt):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -23,14 +24,39 @@ class ImagenClient:
             "size": "1024x1024",
             "response_format": "url" # Or "b64_json"
         }
+        return headers, payload
+
+    @staticmethod
+    def _parse_image(response):
+        response.raise_for_status()
+        data = response.json()
+        
+        # A4F/OpenAI format usually returns a list of data objects with urls
+        return data['data'][0]['url']
+
+    def generate_image(self, prompt):
+        """Generates an image from a prompt and returns the URL or base64 data."""
+        headers, payload = self._request(prompt)
+        try:
+            response = self.http.post(self.base_url, headers=headers, json=payload)
+            return self._parse_image(response)
+        except Exception as e:
+            print(f"Error in Imagen response: {e}")
+            return None
+
+
+class AsyncImagenClient(ImagenClient):
+    """asyncio variant for the ASGI entry point."""
+
+    def __init__(self, api_key, model=None, transport=None):
+        super().__init__(api_key, model)
+        self.http = transport or get_async_transport()
 
+    async def generate_image(self, prompt):
+        headers, payload = self._request(prompt)
         try:
-            response = requests.post(self.base_url, headers=headers, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            
-            # A4F/OpenAI format usually returns a list of data objects with urls
-            return data['data'][0]['url']
+            response = await self.http.post(self.base_url, headers=headers, json=payload)
+            return self._parse_image(response)
         except Exception as e:
             print(f"Error in Imagen response: {e}")
             return None
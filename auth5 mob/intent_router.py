@@ -0,0 +1,294 @@
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor, wait
+
+TOKEN = re.compile(r"[a-z0-9']+")
+# Where a prompt may change subject: "weather in Paris, bitcoin price and today's news"
+BREAK_WORDS = ("and", "also", "plus", "then")
+CLAUSE_BREAK = re.compile(r"(\s*(?:[,;]|\b(?:" + "|".join(BREAK_WORDS) + r")\b)\s*)", re.IGNORECASE)
+
+
+class Intent:
+    def __init__(self, name, triggers, handler, slots=None, parallel=False, label=None):
+        self.name = name
+        self.triggers = triggers
+        self.handler = handler
+        # Read-only lookups that may run alongside other intents of the same prompt
+        self.parallel = parallel
+        self.label = label or name.replace("_", " ")
+        # slot name -> callable(text) returning the extracted value or None
+        self.slots = {key: _compile_slot(spec) for key, spec in (slots or {}).items()}
+
+    def extract(self, text):
+        return {key: extractor(text) for key, extractor in self.slots.items()}
+
+
+class IntentMatch:
+    def __init__(self, intent, slots):
+        self.intent = intent
+        self.slots = slots
+
+    @property
+    def name(self):
+        return self.intent.name
+
+
+def _compile_slot(spec):
+    """Turns a slot spec into an extractor. Strings are regexes whose first group is the value."""
+    if callable(spec):
+        return spec
+    pattern = re.compile(spec, re.IGNORECASE)
+
+    def extract(text):
+        found = pattern.search(text)
+        if not found:
+            return None
+        value = found.group(1) if pattern.groups else found.group(0)
+        return value.strip().strip("?.!,").strip() or None
+
+    return extract
+
+
+class IntentRouter:
+    """
+    Single-pass intent dispatcher.
+
+    Triggers are word phrases ("weather", "share price"). A "..." inside a
+    trigger allows a gap, so "generate ... image" fires on "generate an image
+    of a cat". All triggers are compiled into one index keyed on their first
+    word, and a prompt is tokenized once and walked once, so dispatch cost does
+    not grow with the number of intents. Matching whole words keeps "opened"
+    from firing "open" and "drawer" from firing "draw".
+
+    When several intents fire, the earliest registered one wins, and only its
+    slot extractors run. `on_match`, if given, is called with the intent name
+    before its handler runs.
+
+    With a `fan_out`, a prompt whose clauses ask for two or more `parallel`
+    intents ("weather in Paris, price of bitcoin and the news") runs all of
+    them at once and answers with the merged result (intent name "multi").
+    """
+
+    def __init__(self, on_match=None, fan_out=None):
+        self.intents = []
+        self.on_match = on_match
+        self.fan_out = fan_out
+        self._index = None
+
+    def register(self, name, triggers, handler, slots=None, parallel=False, label=None):
+        if any(existing.name == name for existing in self.intents):
+            raise ValueError(f"Intent already registered: {name}")
+        for trigger in triggers:
+            if not TOKEN.findall(trigger.lower()):
+                raise ValueError(f"Empty trigger for intent {name}: {trigger!r}")
+        self.intents.append(Intent(name, list(triggers), handler, slots, parallel, label))
+        self._index = None
+
+    def handles(self, name):
+        """Decorator attaching the handler of an intent registered without one."""
+        def decorator(handler):
+            intent = next((intent for intent in self.intents if intent.name == name), None)
+            if intent is None:
+                raise ValueError(f"Unknown intent: {name}")
+            intent.handler = handler
+            return handler
+        return decorator
+
+    def _compile(self):
+        # first word -> [(remaining words, intent priority, trigger id, segment number, segment count)]
+        index = {}
+        trigger_id = 0
+        for priority, intent in enumerate(self.intents):
+            for trigger in intent.triggers:
+                segments = [TOKEN.findall(part.lower()) for part in trigger.split("...")]
+                segments = [words for words in segments if words]
+                for number, words in enumerate(segments):
+                    entry = (words[1:], priority, trigger_id, number, len(segments))
+                    index.setdefault(words[0], []).append(entry)
+                trigger_id += 1
+        self._index = index
+        return index
+
+    def _walk(self, tokens, clauses=None):
+        """
+        Walks the tokens once. Returns the priorities of every intent whose
+        trigger fired in the whole prompt, in prompt order, and, when
+        `clauses` gives each token's clause number (None for the words that
+        separate clauses), {clause number: priorities fired inside that clause}.
+        """
+        index = self._index or self._compile()
+        progress = {}
+        fired = []
+        clause_progress = {}
+        clause_fired = {}
+        for position, token in enumerate(tokens):
+            entries = index.get(token)
+            if not entries:
+                continue
+            clause = clauses[position] if clauses else None
+            for rest, priority, trigger_id, number, count in entries:
+                if rest and tokens[position + 1:position + 1 + len(rest)] != rest:
+                    continue
+                if progress.get(trigger_id, 0) == number:
+                    if number + 1 == count:
+                        fired.append(priority)
+                        progress[trigger_id] = 0
+                    else:
+                        progress[trigger_id] = number + 1
+                # The same trigger again, with its progress kept per clause
+                if clause is None or clauses[position + len(rest)] != clause:
+                    continue
+                key = (clause, trigger_id)
+                if clause_progress.get(key, 0) == number:
+                    if number + 1 == count:
+                        clause_fired.setdefault(clause, []).append(priority)
+                        clause_progress[key] = 0
+                    else:
+                        clause_progress[key] = number + 1
+        return fired, clause_fired
+
+    def scan(self, text):
+        """Returns the priorities of every intent whose trigger fired, in prompt order."""
+        return self._walk(TOKEN.findall((text or "").lower()))[0]
+
+    def _best(self, text, fired):
+        intent = self.intents[min(fired)]
+        return IntentMatch(intent, intent.extract(text))
+
+    def match(self, text):
+        """Returns the highest-priority IntentMatch for the prompt, or None."""
+        fired = self.scan(text)
+        return self._best(text, fired) if fired else None
+
+    def match_all(self, text):
+        """
+        Matches the whole prompt and each of its clauses in one scan. Returns
+        one IntentMatch per distinct request when there are at least two and
+        all of them are parallel intents, otherwise [match(text)], or [] when
+        nothing fired. A clause that fires nothing belongs to the one before
+        it, so "weather in Trinidad and Tobago" stays one request.
+        """
+        text = text or ""
+        lowered = text.lower()
+        # Substring checks are much cheaper than the split and rule out most prompts
+        if "," not in text and ";" not in text and not any(word in lowered for word in BREAK_WORDS):
+            fired = self._walk(TOKEN.findall(lowered))[0]
+            return [self._best(text, fired)] if fired else []
+
+        pieces = CLAUSE_BREAK.split(text)
+        tokens, token_clauses = [], []
+        for position, piece in enumerate(pieces):
+            words = TOKEN.findall(piece.lower())
+            tokens += words
+            token_clauses += [None if position % 2 else position // 2] * len(words)
+        fired, clause_fired = self._walk(tokens, token_clauses)
+        if not fired:
+            return []
+        if len(clause_fired) < 2:
+            return [self._best(text, fired)]
+
+        clauses = []  # [clause text, intent priority]
+        prefix = ""
+        for position in range(0, len(pieces), 2):
+            clause = pieces[position]
+            joiner = pieces[position - 1] if position else ""
+            priorities = clause_fired.get(position // 2)
+            if priorities:
+                clauses.append([prefix + clause, min(priorities)])
+                prefix = ""
+            elif clauses:
+                clauses[-1][0] += joiner + clause
+            else:
+                prefix += clause + (pieces[position + 1] if position + 1 < len(pieces) else "")
+
+        matches, seen = [], set()
+        for clause, priority in clauses:
+            intent = self.intents[priority]
+            if not intent.parallel:
+                return [self._best(text, fired)]
+            slots = intent.extract(clause)
+            key = (intent.name, tuple(sorted(slots.items(), key=lambda item: item[0])))
+            if key not in seen:
+                seen.add(key)
+                matches.append(IntentMatch(intent, slots))
+        return matches if len(matches) > 1 else [self._best(text, fired)]
+
+    def dispatch(self, text, data=None):
+        """
+        Runs the matched intent's handler. Returns its result, or None when no
+        intent matched or the handler declined (so the caller can fall back to the LLM).
+        """
+        if self.fan_out:
+            matches = self.match_all(text)
+        else:
+            found = self.match(text)
+            matches = [found] if found else []
+        if len(matches) > 1:
+            if self.on_match:
+                self.on_match("multi")
+            return self.fan_out.run(matches, data or {})
+
+        if not matches:
+            return None
+        found = matches[0]
+        if self.on_match:
+            self.on_match(found.name)
+        return found.intent.handler(found.slots, data or {})
+
+
+class FanOut:
+    """
+    Runs the parts of a multi-intent prompt on a bounded thread pool and
+    merges their answers in prompt order. Every part gets the same deadline
+    from submission; a part still running then is reported as pending rather
+    than holding up the others. It keeps running, so its answer usually lands
+    in the service's cache in time for the user to ask again.
+    """
+
+    def __init__(self, max_workers=8, deadline=4.0, max_parts=5):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fan-out")
+        self.deadline = deadline
+        self.max_parts = max_parts
+
+    def run(self, matches, data):
+        matches = matches[:self.max_parts]
+        # Each part runs in a copy of the caller's context, so metrics keep the request's labels
+        futures = [
+            self.pool.submit(contextvars.copy_context().run, match.intent.handler, match.slots, data)
+            for match in matches
+        ]
+        done, _ = wait(futures, timeout=self.deadline)
+        outcomes = []
+        for future in futures:
+            if future not in done:
+                outcomes.append(("pending", None))
+            elif future.exception():
+                outcomes.append(("error", future.exception()))
+            else:
+                outcomes.append(("done", future.result()))
+        return self.merge(matches, outcomes)
+
+    @staticmethod
+    def merge(matches, outcomes):
+        """
+        Builds the /ask reply from (status, value) per match, status being
+        "done", "pending" or "error". Returns None if no part had an answer.
+        """
+        sections, emotions, pending = [], [], []
+        for match, (status, value) in zip(matches, outcomes):
+            if status == "pending":
+                pending.append(match.name)
+                sections.append(f"⏳ The {match.intent.label} is taking longer than usual. Ask again in a moment and it should be ready.")
+            elif status == "error":
+                print(f"Fan-out error in {match.name}: {value}")
+                sections.append(f"⚠️ I couldn't get the {match.intent.label} right now.")
+            elif value:
+                emotions.append(value.get("emotion", "Neutral"))
+                sections.append(value["response"])
+        if not emotions and not pending:
+            return None
+        return {
+            "response": "\n\n".join(sections),
+            "emotion": emotions[0] if emotions else "Neutral",
+            "pending": pending
+        }
@@ -0,0 +1,52 @@
+import re
+
+from intent_router import IntentRouter
+
+CRYPTO_NAMES = {"bitcoin": "BTC", "ethereum": "ETH", "solana": "SOL", "dogecoin": "DOGE", "cardano": "ADA"}
+CRYPTO_PRICE = re.compile(r"\bprice\s+(?:of|for)\s+([\w-]+)", re.IGNORECASE)
+CRYPTO_NAME = re.compile(r"\b(" + "|".join(CRYPTO_NAMES) + r")\s+price\b", re.IGNORECASE)
+IMAGE_TRIGGERS = [f"{verb} ... {noun}" for verb in ("generate", "create", "make") for noun in ("image", "images", "picture")] + ["draw", "paint"]
+VIDEO_TRIGGERS = [f"{verb} ... {noun}" for verb in ("generate", "create", "make") for noun in ("video", "videos")] + ["animate"]
+IMAGE_FILLER = re.compile(r"\b(?:generate|create|make|an?|image|picture|of|draw|paint|me)\b", re.IGNORECASE)
+VIDEO_FILLER = re.compile(r"\b(?:generate|create|make|an?|video|of|animate|me)\b", re.IGNORECASE)
+YOUTUBE_FILLER = re.compile(r"\b(?:youtube|search|find)\b", re.IGNORECASE)
+
+
+def _strip_words(pattern):
+    def extract(text):
+        return " ".join(pattern.sub(" ", text).split()).strip("?.!,") or None
+    return extract
+
+
+def _crypto_symbol(text):
+    # "price of bitcoin", or "bitcoin price" for the coins we know by name
+    found = CRYPTO_PRICE.search(text) or CRYPTO_NAME.search(text)
+    return found.group(1) if found else None
+
+
+def build_router(on_match=None, fan_out=None):
+    """
+    The /ask intents in priority order, with their triggers and slots but no
+    handlers: app.py attaches those with @router.handles(name). Kept apart
+    from the app so bench_intent_dispatch.py can load the table on its own.
+    """
+    router = IntentRouter(on_match=on_match, fan_out=fan_out)
+    router.register("screenshot", ["screenshot"], None)
+    router.register("camera", ["camera", "photo"], None)
+    router.register("open_app", ["open"], None, slots={"app": r"\bopen\s+(.+)"})
+    router.register("weather", ["weather"], None, slots={"city": r".*\b(?:in|for)\s+(.+)"},
+                    parallel=True, label="weather report")
+    router.register("news", ["news"], None, parallel=True)
+    router.register("stock", ["stock", "stocks", "share price"], None, slots={"symbol": r"\b(?:of|for)\s+([\w.-]+)"},
+                    parallel=True, label="stock update")
+    router.register("crypto_price", ["price of", "price for"] + [f"{name} price" for name in CRYPTO_NAMES], None,
+                    slots={"symbol": _crypto_symbol}, parallel=True)
+    router.register("crypto_top", ["crypto", "cryptos", "cryptocurrency", "cryptocurrencies"], None,
+                    parallel=True, label="crypto market overview")
+    router.register("youtube", ["youtube"], None, slots={
+        "trending": r"\b(trending|popular)\b",
+        "query": _strip_words(YOUTUBE_FILLER),
+    }, parallel=True, label="YouTube search")
+    router.register("image", IMAGE_TRIGGERS, None, slots={"prompt": _strip_words(IMAGE_FILLER)})
+    router.register("video", VIDEO_TRIGGERS, None, slots={"prompt": _strip_words(VIDEO_FILLER)})
+    return router
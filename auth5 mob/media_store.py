@@ -0,0 +1,130 @@
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import threading
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+NAME = re.compile(r"^([0-9a-f]{32})(-preview)?\.([a-z0-9]+)$")
+EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp", "image/gif": "gif", "video/mp4": "mp4"}
+
+
+class MediaStore:
+    """
+    Content-addressed store for generated media, served from /media/<name>.
+
+    Files are named after the hash of their bytes, so a URL never changes
+    meaning and can be cached forever by the browser. Images also get a small
+    JPEG preview (`preview_edge` pixels on the longest side) for fast first
+    paint. Once the directory grows past `max_bytes`, the least recently
+    served files are deleted.
+    """
+
+    def __init__(self, directory="media", max_bytes=500 * 1024 * 1024, preview_edge=256, url_prefix="/media/"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.preview_edge = preview_edge
+        self.url_prefix = url_prefix
+        self.lock = threading.Lock()
+        self.counters = {"stored": 0, "deduplicated": 0, "evicted": 0}
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def put(self, data, mime):
+        """Stores `data` and returns {"url", "preview_url"} (preview_url is None for non-images)."""
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        ext = EXTENSIONS.get(mime) or (mimetypes.guess_extension(mime) or ".bin").lstrip(".")
+        name = f"{digest}.{ext}"
+        preview_name = f"{digest}-preview.jpg"
+
+        if os.path.exists(self._path(name)):
+            with self.lock:
+                self.counters["deduplicated"] += 1
+        else:
+            self._write(name, data)
+            if HAS_PIL and mime.startswith("image/"):
+                preview = self._preview(data)
+                if preview:
+                    self._write(preview_name, preview)
+            with self.lock:
+                self.counters["stored"] += 1
+            self._evict(keep=(name, preview_name))
+
+        has_preview = os.path.exists(self._path(preview_name))
+        return {
+            "url": self.url_prefix + name,
+            "preview_url": self.url_prefix + preview_name if has_preview else None
+        }
+
+    def put_data_url(self, data_url):
+        header, _, encoded = data_url.partition(",")
+        mime = header[len("data:"):].split(";")[0] or "application/octet-stream"
+        return self.put(base64.b64decode(encoded), mime)
+
+    def _preview(self, data):
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.thumbnail((self.preview_edge, self.preview_edge))
+            out = io.BytesIO()
+            image.convert("RGB").save(out, "JPEG", quality=70, optimize=True)
+            return out.getvalue()
+        except Exception as e:
+            print(f"Could not create media preview: {e}")
+            return None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, name, data):
+        path = self._path(name)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.size += len(data)
+
+    def lookup(self, name):
+        """Returns (path, etag) for a stored file, or None. Marks the file as recently used."""
+        match = NAME.match(name)
+        if not match:
+            return None
+        path = self._path(name)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path, match.group(1) + (match.group(2) or "")
+
+    def _evict(self, keep=()):
+        with self.lock:
+            if self.size <= self.max_bytes:
+                return
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory)
+             if entry.is_file() and NAME.match(entry.name) and entry.name not in keep),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in entries:
+            with self.lock:
+                if self.size <= self.max_bytes:
+                    return
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            with self.lock:
+                self.size -= size
+                self.counters["evicted"] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, bytes=self.size, max_bytes=self.max_bytes)
@@ -0,0 +1,279 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds in seconds; +Inf is implied
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_intent = contextvars.ContextVar("metrics_intent", default="none")
+
+
+def set_intent(name):
+    """Labels everything measured from here on in this request/thread with `name`."""
+    _intent.set(name)
+
+
+def current_intent():
+    return _intent.get()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter. inc() takes the label values positionally, in the order of `labels`."""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. observe() is a bisect and two additions under a
+    lock; buckets are only made cumulative when /metrics is scraped.
+    """
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = _format_labels(self.labels, label_values, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {round(values[-1], 6)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    Process-local metrics in the Prometheus text format.
+
+    Counters and histograms are updated as requests run. Collectors are
+    callables run at scrape time that turn existing stats() dicts into samples,
+    so caches don't need to know about metrics. Each one returns
+    [(name, type, help, [(labels dict, value), ...]), ...].
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Decorator that registers a scrape-time collector."""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Metrics collector {collector.__name__} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    label_text = _format_labels(list(labels), list(labels.values()))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to serve a request, until the response is closed (includes streaming).",
+    labels=("route", "method", "status", "intent", "outcome")
+)
+REQUEST_EXCEPTIONS = REGISTRY.counter(
+    "http_request_exceptions_total", "Requests that ended in an unhandled exception.", labels=("route",)
+)
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "upstream_call_duration_seconds", "Time spent in an upstream client method.",
+    labels=("upstream", "method", "intent", "outcome")
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "upstream_errors_total", "Upstream client calls that raised or returned an error.",
+    labels=("upstream", "method", "intent")
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+ERROR_PREFIXES = ("⚠️", "Error", "Could not", "Sorry", "I couldn't", "I'm sorry")
+
+
+def text_outcome(result):
+    """Outcome of the service methods that report errors as a chat message instead of raising."""
+    if result is None:
+        return "error"
+    if isinstance(result, str) and (result.startswith(ERROR_PREFIXES) or "not configured" in result):
+        return "error"
+    return "ok"
+
+
+def pair_outcome(result):
+    """Outcome of fetch_full_response(), which returns (result, ok)."""
+    return "ok" if result[1] else "error"
+
+
+def stream_outcome(event):
+    """Outcome of stream_full_response(), judged by its last (kind, payload) event."""
+    return "error" if event is None or event[0] == "error" else "ok"
+
+
+def _record(upstream, method, intent, outcome, seconds):
+    UPSTREAM_SECONDS.observe(seconds, upstream, method, intent, outcome)
+    if outcome == "error":
+        UPSTREAM_ERRORS.inc(upstream, method, intent)
+
+
+def timed(fn, upstream, method, outcome=None):
+    """Wraps `fn` to record its duration and outcome. Exceptions count as errors and are re-raised."""
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def coroutine(*args, **kwargs):
+            intent = _intent.get()
+            start = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except BaseException:
+                _record(upstream, method, intent, "error", time.perf_counter() - start)
+                raise
+            _record(upstream, method, intent, outcome(result) if outcome else "ok", time.perf_counter() - start)
+            return result
+        return coroutine
+
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def async_generator(*args, **kwargs):
+            intent = _intent.get()
+            start = time.perf_counter()
+            last = None
+            result = "error"
+            try:
+                async for last in fn(*args, **kwargs):
+                    yield last
+                result = outcome(last) if outcome else "ok"
+            except GeneratorExit:
+                result = "cancelled"
+                raise
+            finally:
+                _record(upstream, method, intent, result, time.perf_counter() - start)
+        return async_generator
+
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator(*args, **kwargs):
+            intent = _intent.get()
+            start = time.perf_counter()
+            last = None
+            result = "error"
+            try:
+                for last in fn(*args, **kwargs):
+                    yield last
+                result = outcome(last) if outcome else "ok"
+            except GeneratorExit:
+                # The consumer stopped early, e.g. the losing side of a hedged stream
+                result = "cancelled"
+                raise
+            finally:
+                _record(upstream, method, intent, result, time.perf_counter() - start)
+        return generator
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        intent = _intent.get()
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            _record(upstream, method, intent, "error", time.perf_counter() - start)
+            raise
+        _record(upstream, method, intent, outcome(result) if outcome else "ok", time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+def instrument(obj, upstream, methods, outcome=None):
+    """
+    Replaces `obj`'s methods with timed() versions on the instance, so the
+    client classes stay unaware of metrics. `methods` is a list of names or a
+    {name: outcome function} dict. Missing objects and methods are skipped.
+    """
+    if obj is None:
+        return obj
+    if not isinstance(methods, dict):
+        methods = {name: outcome for name in methods}
+    for name, method_outcome in methods.items():
+        fn = getattr(obj, name, None)
+        if fn is not None:
+            setattr(obj, name, timed(fn, upstream, name, method_outcome))
+    return obj
@@ -0,0 +1,76 @@
+"""
+One-shot migration of inline (base64 data URL) avatars to stored thumbnails.
+
+For every Supabase user whose user_metadata.avatar_url is still a data URL,
+the image is saved through AvatarStore (the same one the app serves from) and
+the metadata and the public.profiles row are rewritten to the short
+/avatars/<hash> URL. Needs the service-role key in SUPABASE_KEY. Safe to run
+again: users that already have a short URL are skipped. --dry-run only
+decodes each avatar to report its short URL; it writes no files.
+
+Usage: python migrate_avatars.py [--dry-run] [--per-page 100]
+"""
+import argparse
+import os
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+from avatars import AvatarStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    parser.add_argument("--per-page", type=int, default=100)
+    args = parser.parse_args()
+
+    load_dotenv()
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_KEY")
+    if not url or not key:
+        print("Missing SUPABASE_URL or SUPABASE_KEY in .env")
+        exit(1)
+
+    client = create_client(url, key)
+    avatars = AvatarStore(directory=os.getenv("AVATAR_DIR", "avatars"))
+    migrated = skipped = failed = 0
+    bytes_before = bytes_after = 0
+
+    page = 1
+    while True:
+        users = client.auth.admin.list_users(page=page, per_page=args.per_page)
+        if not users:
+            break
+        for user in users:
+            metadata = user.user_metadata or {}
+            avatar_url = metadata.get("avatar_url") or ""
+            if not avatars.is_inline(avatar_url):
+                skipped += 1
+                continue
+            try:
+                if args.dry_run:
+                    short_url = avatars.url_for(avatar_url)
+                else:
+                    short_url = avatars.save(avatar_url)
+                    client.auth.admin.update_user_by_id(user.id, {"user_metadata": dict(metadata, avatar_url=short_url)})
+                    client.table("profiles").update({"avatar_url": short_url}).eq("id", user.id).execute()
+            except Exception as e:
+                print(f"Could not migrate avatar of {user.email}: {e}")
+                failed += 1
+                continue
+            migrated += 1
+            bytes_before += len(avatar_url)
+            bytes_after += len(short_url)
+            print(f"{user.email}: {len(avatar_url) / 1024:.0f} KB -> {short_url}")
+        if len(users) < args.per_page:
+            break
+        page += 1
+
+    action = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{action} {migrated} avatars ({bytes_before / 1024:.0f} KB -> {bytes_after / 1024:.1f} KB of metadata), "
+          f"skipped {skipped}, failed {failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Preferred models, best first. The first one is also used when discovery has never succeeded.
+PRIORITIES = ['gemini-1.5-flash', 'gemini-1.5-pro', 'gemini-pro', 'gemini-1.0-pro']
+
+
+def select_model(models):
+    """Picks the preferred model out of a discovered list, or the first available one."""
+    for name in PRIORITIES:
+        if name in models:
+            return name
+    return models[0] if models else None
+
+
+class ModelDiscovery:
+    """
+    Cached result of genai.list_models() for one API key.
+
+    The model list and the selected model are kept in memory and in a JSON file
+    on disk with a TTL, so restarts and every GeminiClient in the process reuse
+    the last discovery instead of making their own round trip. A stale entry is
+    refreshed on a background thread while the cached model keeps serving. Only
+    with nothing cached at all does current() wait for the first discovery
+    rather than guess a model that may be retired, and callers share one
+    `first_wait` seconds for that.
+    """
+
+    def __init__(self, api_key, path=None, ttl=None, retry_after=60, first_wait=None):
+        self.key_id = hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+        self.path = path or os.getenv("GEMINI_MODEL_CACHE", "gemini_models.json")
+        self.ttl = ttl or float(os.getenv("GEMINI_MODEL_CACHE_TTL", 86400))
+        self.retry_after = retry_after
+        self.first_wait = float(os.getenv("GEMINI_DISCOVERY_WAIT", 10)) if first_wait is None else first_wait
+        self.attempted = threading.Event()  # set once a discovery has finished, successfully or not
+        self.wait_until = None  # end of the first_wait allowance, from the first current() call
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.last_attempt = 0.0
+        self.entry = self._load()  # {"models": [...], "selected": name, "discovered_at": ts}
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f).get(self.key_id)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, entry):
+        # Other keys may share the file, so merge instead of overwriting
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data[self.key_id] = entry
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Could not write model cache {self.path}: {e}")
+
+    def current(self):
+        """Returns the model name to use right now, scheduling a refresh if the cache is stale."""
+        with self.lock:
+            entry = self.entry
+            stale = entry is None or time.time() - entry["discovered_at"] > self.ttl
+            if entry is None and self.wait_until is None:
+                self.wait_until = time.time() + self.first_wait
+        if stale:
+            self.refresh()
+        if entry is None and self.attempted.wait(max(0.0, self.wait_until - time.time())):
+            with self.lock:
+                entry = self.entry
+        if entry and entry.get("selected"):
+            return entry["selected"]
+        return PRIORITIES[0]
+
+    def refresh(self, background=True, force=False):
+        """Re-runs discovery, at most one at a time and not more often than retry_after after a failure."""
+        with self.lock:
+            if self.refreshing or (not force and time.time() - self.last_attempt < self.retry_after):
+                return
+            self.refreshing = True
+            self.last_attempt = time.time()
+        if background:
+            threading.Thread(target=self._discover, daemon=True).start()
+        else:
+            self._discover()
+
+    def invalidate(self):
+        """Called when the selected model stops working, e.g. it was retired."""
+        with self.lock:
+            if self.entry:
+                self.entry = dict(self.entry, discovered_at=0)
+        self.refresh()
+
+    def _discover(self):
+        try:
+            import google.generativeai as genai
+            print("Searching for available Gemini models...")
+            models = [
+                m.name.replace('models/', '') for m in genai.list_models()
+                if 'generateContent' in m.supported_generation_methods
+            ]
+            print(f"Found models: {models}")
+            selected = select_model(models)
+            if selected:
+                print(f"Selected model: {selected}")
+            else:
+                print("CRITICAL: No text generation models found for this API Key.")
+            entry = {"models": models, "selected": selected, "discovered_at": time.time()}
+            with self.lock:
+                self.entry = entry
+            self._save(entry)
+        except Exception as e:
+            print(f"Error configuring models: {e}")
+        finally:
+            with self.lock:
+                self.refreshing = False
+            self.attempted.set()
+
+
+_discoveries = {}
+_discoveries_lock = threading.Lock()
+
+
+def get_discovery(api_key):
+    """Returns the process-wide ModelDiscovery for an API key."""
+    with _discoveries_lock:
+        discovery = _discoveries.get(api_key)
+        if discovery is None:
+            discovery = _discoveries[api_key] = ModelDiscovery(api_key)
+        return discovery
@@ -0,0 +1,355 @@
+import hashlib
+import itertools
+import random
+import re
+import threading
+import time
+
+from resilience import UpstreamUnavailable
+from stock_service import AlphaVantageLimitError
+
+WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset((
+    "a about after amid an and are as at be by for from has have in into is it its new of on or over "
+    "says than that the this to up was were will with"
+).split())
+PRIME = (1 << 61) - 1
+
+
+def title_words(title):
+    """The words that identify a story: lower-cased, no stopwords, plurals folded, and no " - Source" suffix."""
+    if " - " in title:
+        # NewsAPI appends the outlet's name to every title
+        title = title.rsplit(" - ", 1)[0]
+    words = set()
+    for word in WORD.findall(title.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return frozenset(words)
+
+
+def same_story(a, b, overlap=0.7):
+    """Near-duplicate titles: at least 3 shared words, covering `overlap` of the shorter title."""
+    shared = len(a & b)
+    return shared >= 3 and shared >= overlap * min(len(a), len(b))
+
+
+class MinHashIndex:
+    """
+    Locality-sensitive index of word sets. Each set's MinHash signature is cut
+    into `bands` of `rows` values and sets sharing a band become candidates,
+    so a new story is only compared with the few stored stories that are
+    likely to be similar instead of all of them.
+    """
+
+    def __init__(self, bands=16, rows=2, seed=1):
+        rnd = random.Random(seed)
+        self.rows = rows
+        self.permutations = [(rnd.randrange(1, PRIME), rnd.randrange(PRIME)) for _ in range(bands * rows)]
+        self.buckets = [{} for _ in range(bands)]  # band value -> ids
+        self.bands_of = {}  # id -> its band values
+
+    def _bands(self, words):
+        hashes = [int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "big") for word in words]
+        minima = [min((a * h + b) % PRIME for h in hashes) for a, b in self.permutations]
+        return [tuple(minima[i:i + self.rows]) for i in range(0, len(minima), self.rows)]
+
+    def candidates(self, words):
+        found = set()
+        if words:
+            for bucket, band in zip(self.buckets, self._bands(words)):
+                found.update(bucket.get(band, ()))
+        return found
+
+    def add(self, key, words):
+        if not words:
+            return
+        bands = self._bands(words)
+        self.bands_of[key] = bands
+        for bucket, band in zip(self.buckets, bands):
+            bucket.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        for bucket, band in zip(self.buckets, self.bands_of.pop(key, ())):
+            ids = bucket.get(band)
+            if ids:
+                ids.discard(key)
+                if not ids:
+                    del bucket[band]
+
+
+class NewsStore:
+    """
+    In-memory stories from every news feed, with near-duplicates collapsed.
+
+    A story seen in several feeds or from several outlets is stored once and
+    lists every source. Each feed keeps its newest `max_items` story ids and
+    a watermark, the newest publication time it has ingested; ingest() skips
+    anything not newer, so a refresh only does work for new articles.
+    """
+
+    def __init__(self, max_items=50, overlap=0.7, index=None):
+        self.max_items = max_items
+        self.overlap = overlap
+        self.index = index or MinHashIndex()
+        self.lock = threading.Lock()
+        self.stories = {}  # id -> story
+        self.feeds = {}  # key -> {"ids", "watermark"}
+        self.ids = itertools.count(1)
+        self.counters = {"ingested": 0, "duplicates": 0, "repeats": 0, "skipped_old": 0, "comparisons": 0}
+
+    def watermark(self, key):
+        with self.lock:
+            feed = self.feeds.get(key)
+            return feed["watermark"] if feed else None
+
+    def ingest(self, key, articles, now=None):
+        """
+        Adds a feed's articles (see NewsService.fetch_headlines). Returns how
+        many changed what the store shows: new stories, new sources for a
+        story, and stories newly in this feed.
+        """
+        now = now or time.time()
+        changed = 0
+        with self.lock:
+            feed = self.feeds.setdefault(key, {"ids": [], "watermark": 0.0})
+            watermark = feed["watermark"]
+            for article in articles:
+                # Articles without a date count as new, and are caught as repeats below
+                published = article.get("published_at") or now
+                if published <= watermark:
+                    self.counters["skipped_old"] += 1
+                    continue
+                feed["watermark"] = max(feed["watermark"], published)
+                words = title_words(article["title"])
+                story = self._duplicate_of(words)
+                if story is None:
+                    story = dict(article, id=next(self.ids), published_at=published, sources=[article["source"]], words=words)
+                    self.stories[story["id"]] = story
+                    self.index.add(story["id"], words)
+                    self.counters["ingested"] += 1
+                elif article["source"] in story["sources"]:
+                    self.counters["repeats"] += 1
+                else:
+                    story["sources"].append(article["source"])
+                    self.counters["duplicates"] += 1
+                    changed += 1
+                if story["id"] not in feed["ids"]:
+                    feed["ids"].append(story["id"])
+                    changed += 1
+            feed["ids"].sort(key=lambda story_id: -self.stories[story_id]["published_at"])
+            del feed["ids"][self.max_items:]
+            self._forget_unused()
+        return changed
+
+    def _duplicate_of(self, words):
+        for story_id in self.index.candidates(words):
+            self.counters["comparisons"] += 1
+            story = self.stories[story_id]
+            if same_story(words, story["words"], self.overlap):
+                return story
+        return None
+
+    def _forget_unused(self):
+        used = set().union(*(feed["ids"] for feed in self.feeds.values()))
+        for story_id in [story_id for story_id in self.stories if story_id not in used]:
+            del self.stories[story_id]
+            self.index.remove(story_id)
+
+    def top(self, key, limit):
+        """The feed's newest stories, as copies."""
+        with self.lock:
+            feed = self.feeds.get(key)
+            return [dict(self.stories[story_id]) for story_id in (feed["ids"][:limit] if feed else [])]
+
+    def drop(self, key):
+        with self.lock:
+            self.feeds.pop(key, None)
+            self._forget_unused()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, stories=len(self.stories), collapsed=sum(len(s["sources"]) > 1 for s in self.stories.values()))
+
+
+class NewsAggregator:
+    """
+    NewsAPI headlines and Alpha Vantage market news, prefetched into a NewsStore.
+
+    Feeds are keyed ("headlines", category, country) or ("market", symbol).
+    A background thread refreshes each feed asked for within `idle` seconds
+    (plus the `prefetch` ones) every `refresh` / `market_refresh` seconds, and
+    the formatted answer is rebuilt only when a refresh brought something new,
+    so the news intents are a dictionary lookup. Only a feed's very first
+    request waits for the upstream. Background market refreshes never queue
+    for the Alpha Vantage budget and leave `market_reserve` daily calls to
+    users' stock quotes.
+    """
+
+    def __init__(self, news, stock, store=None, refresh=1800, market_refresh=3600, idle=86400,
+                 prefetch=(("headlines", "general", "us"), ("market", "")), page_size=20, market_reserve=10):
+        self.news = news
+        self.stock = stock
+        self.store = store or NewsStore()
+        self.refresh_interval = refresh
+        self.market_refresh = market_refresh
+        self.idle = idle
+        self.prefetch = [tuple(key) for key in prefetch]
+        self.page_size = page_size
+        self.market_reserve = market_reserve
+        self.lock = threading.Lock()
+        self.feeds = {}  # key -> {"text", "asked_at", "attempted_at", "refreshed_at", "lock", "refreshes", "errors"}
+        self.scheduler = None
+        self.counters = {"hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+    def top_news(self, category="general", country="us", wait=True):
+        return self._answer(("headlines", category, country), wait)
+
+    def market_news(self, symbol=None, wait=True):
+        return self._answer(("market", symbol.upper() if symbol else ""), wait)
+
+    def _feed(self, key):
+        with self.lock:
+            feed = self.feeds.get(key)
+            if feed is None:
+                feed = self.feeds[key] = {"text": None, "asked_at": time.time(), "attempted_at": 0.0, "refreshed_at": 0.0,
+                                          "lock": threading.Lock(), "refreshes": 0, "errors": 0}
+            return feed
+
+    def _answer(self, key, wait):
+        """The feed's formatted answer; None when it was never fetched and `wait` is False."""
+        feed = self._feed(key)
+        feed["asked_at"] = time.time()
+        self.start()
+        text = feed["text"]
+        if text is None and not wait:
+            return None
+        with self.lock:
+            self.counters["hits" if text is not None else "misses"] += 1
+        return text if text is not None else self.refresh(key)
+
+    def refresh(self, key, background=False):
+        """Fetches what is new for one feed. Returns the answer, or an error message if there is none yet."""
+        feed = self._feed(key)
+        with feed["lock"]:
+            if not background and feed["text"] is not None:
+                # Fetched by a concurrent request while this one waited
+                return feed["text"]
+            # A failed refresh waits for the next interval too, rather than hammering the quota
+            feed["attempted_at"] = time.time()
+            try:
+                articles = self._fetch(key, self.store.watermark(key), background)
+            except Exception as e:
+                with self.lock:
+                    self.counters["refresh_errors"] += 1
+                    feed["errors"] += 1
+                return feed["text"] or self._error_text(key, e)
+            if self.store.ingest(key, articles) or feed["text"] is None:
+                feed["text"] = self._format(key)
+                # A story this feed shares with others may have gained a source
+                for other_key, other in list(self.feeds.items()):
+                    if other_key != key and other["text"] is not None:
+                        other["text"] = self._format(other_key)
+            with self.lock:
+                self.counters["refreshes"] += 1
+                feed["refreshes"] += 1
+                feed["refreshed_at"] = time.time()
+            return feed["text"]
+
+    def _fetch(self, key, since, background):
+        if key[0] == "headlines":
+            # top-headlines has no date filter; the store drops what it has already seen
+            return self.news.fetch_headlines(key[1], key[2], page_size=self.page_size)
+        return self.stock.fetch_market_news(
+            key[1] or None, since=since, deadline=0 if background else None,
+            reserve=self.market_reserve if background else 0
+        )
+
+    @staticmethod
+    def _error_text(key, error):
+        if isinstance(error, ValueError):
+            return str(error)
+        if key[0] == "headlines":
+            if isinstance(error, UpstreamUnavailable):
+                return "⚠️ The news service is temporarily unavailable. Please try again in a minute."
+            return f"Error fetching news: {error}"
+        if isinstance(error, AlphaVantageLimitError):
+            return "⚠️ The market news quota is used up for now. Please try again in a minute."
+        if isinstance(error, UpstreamUnavailable):
+            return "⚠️ Market news is temporarily unavailable. Please try again in a minute."
+        print(f"Error fetching market news: {error}")
+        return "Error fetching market news."
+
+    @staticmethod
+    def _sources(story):
+        also = story["sources"][1:]
+        return f"{story['sources'][0]}" + (f" (also reported by {', '.join(also)})" if also else "")
+
+    def _format(self, key):
+        if key[0] == "headlines":
+            stories = self.store.top(key, 5)
+            if not stories:
+                return "I couldn't find any news articles at the moment."
+            news_text = "Here are the top headlines:\n\n"
+            for i, story in enumerate(stories, 1):
+                news_text += f"{i}. **{story['title']}**\n"
+                news_text += f"   Source: {self._sources(story)}\n"
+                if story.get('description'):
+                    news_text += f"   _{story['description']}_\n"
+                news_text += "\n"
+            return news_text
+
+        stories = self.store.top(key, 3)
+        if not stories:
+            return "No recent market news found."
+        news_text = "Latest Stock Market News:\n"
+        for story in stories:
+            news_text += f"- {story['title']} ({self._sources(story)})\n"
+        return news_text
+
+    def start(self):
+        """Starts the refresh thread, which first prefetches the `prefetch` feeds. Returns self."""
+        with self.lock:
+            if self.scheduler:
+                return self
+            self.scheduler = threading.Thread(target=self._run, daemon=True, name="news-refresh")
+        self.scheduler.start()
+        return self
+
+    def _interval(self, key):
+        return self.refresh_interval if key[0] == "headlines" else self.market_refresh
+
+    def _run(self):
+        for key in self.prefetch:
+            self._feed(key)
+        while True:
+            now = time.time()
+            with self.lock:
+                for key, feed in list(self.feeds.items()):
+                    if key not in self.prefetch and now - feed["asked_at"] > self.idle:
+                        del self.feeds[key]
+                        self.store.drop(key)
+                due = [key for key, feed in self.feeds.items() if now - feed["attempted_at"] >= self._interval(key)]
+            for key in due:
+                try:
+                    self.refresh(key, background=True)
+                except Exception as e:
+                    print(f"Error refreshing news feed {key}: {e}")
+            time.sleep(min(60.0, self.refresh_interval, self.market_refresh))
+
+    def stats(self):
+        """Lookup hit ratio, store size and duplicates collapsed, and per feed: stories, age, refreshes and errors."""
+        now = time.time()
+        with self.lock:
+            stats = dict(self.counters)
+            feeds = {":".join(key): {"age_seconds": int(now - feed["refreshed_at"]) if feed["refreshed_at"] else None,
+                                     "refreshes": feed["refreshes"], "errors": feed["errors"]}
+                     for key, feed in self.feeds.items()}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats.update(self.store.stats())
+        stats["feeds"] = feeds
+        return stats
@@ -1,40 +1,116 @@
-import requests
+from http_transport import get_transport
+from async_transport import get_async_transport
+from resilience import AsyncGuardedTransport, GuardedTransport, UpstreamUnavailable, get_guard
+from datetime import datetime
 import os
 
 class NewsService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, transport=None, guard=None):
         self.api_key = (api_key or os.getenv("NEWS_API_KEY", "")).strip()
-        self.base_url = "https://newsapi.org/v2/top-headlines"
+        self.base_url = os.getenv("NEWS_API_BASE_URL", "https://newsapi.org").rstrip("/") + "/v2/top-headlines"
+        self.guard = guard or get_guard("newsapi")
+        self.http = GuardedTransport(transport or get_transport(), self.guard)
+        self.last_headlines = {}  # (category, country) -> text, served while NewsAPI is down
+
+    def _configured(self):
+        return self.api_key and self.api_key != "YOUR_NEWS_API_KEY"
+
+    def _params(self, category, country):
+        return {
+            "apiKey": self.api_key,
+            "category": category,
+            "country": country,
+            "pageSize": 5
+        }
 
     def get_top_news(self, category="general", country="us"):
-        if not self.api_key or self.api_key == "YOUR_NEWS_API_KEY":
+        if not self._configured():
             return "News API key is not configured. Please add your News API key to the .env file."
-        
+
         try:
-            params = {
-                "apiKey": self.api_key,
-                "category": category,
-                "country": country,
-                "pageSize": 5
+            response = self.http.get(self.base_url, params=self._params(category, country))
+            return self._format_headlines(category, country, response)
+        except UpstreamUnavailable:
+            return self._unavailable(category, country)
+        except Exception as e:
+            return f"Error fetching news: {str(e)}"
+
+    def fetch_headlines(self, category="general", country="us", page_size=20):
+        """
+        Raw top headlines for news_aggregator.NewsAggregator, as
+        {"title", "url", "source", "description", "published_at"} dicts.
+        Raises ValueError with a message for the user when NewsAPI refuses.
+        """
+        if not self._configured():
+            raise ValueError("News API key is not configured. Please add your News API key to the .env file.")
+        params = dict(self._params(category, country), pageSize=page_size)
+        response = self.http.get(self.base_url, params=params)
+        data = response.json()
+        if response.status_code != 200:
+            raise ValueError(f"Could not fetch news. Error: {data.get('message', 'Unknown error')}")
+        return [
+            {
+                "title": article["title"],
+                "url": article.get("url"),
+                "source": (article.get("source") or {}).get("name") or "Unknown",
+                "description": article.get("description"),
+                "published_at": self._timestamp(article.get("publishedAt"))
             }
-            response = requests.get(self.base_url, params=params)
-            data = response.json()
-            
-            if response.status_code == 200:
-                articles = data.get("articles", [])
-                if not articles:
-                    return "I couldn't find any news articles at the moment."
-                
-                news_text = "Here are the top headlines:\n\n"
-                for i, article in enumerate(articles, 1):
-                    news_text += f"{i}. **{article['title']}**\n"
-                    news_text += f"   Source: {article.get('source', {}).get('name', 'Unknown')}\n"
-                    if article.get('description'):
-                        news_text += f"   _{article['description']}_\n"
-                    news_text += "\n"
-                
-                return news_text
-            else:
-                return f"Could not fetch news. Error: {data.get('message', 'Unknown error')}"
+            for article in data.get("articles", [])
+            if article.get("title") and article["title"] != "[Removed]"
+        ]
+
+    @staticmethod
+    def _timestamp(published_at):
+        # "2024-05-01T12:30:00Z"; None when missing or malformed
+        try:
+            return datetime.fromisoformat(published_at.replace("Z", "+00:00")).timestamp()
+        except (AttributeError, ValueError):
+            return None
+
+    def _format_headlines(self, category, country, response):
+        data = response.json()
+
+        if response.status_code == 200:
+            articles = data.get("articles", [])
+            if not articles:
+                return "I couldn't find any news articles at the moment."
+
+            news_text = "Here are the top headlines:\n\n"
+            for i, article in enumerate(articles, 1):
+                news_text += f"{i}. **{article['title']}**\n"
+                news_text += f"   Source: {article.get('source', {}).get('name', 'Unknown')}\n"
+                if article.get('description'):
+                    news_text += f"   _{article['description']}_\n"
+                news_text += "\n"
+
+            self.last_headlines[(category, country)] = news_text
+            return news_text
+        else:
+            return f"Could not fetch news. Error: {data.get('message', 'Unknown error')}"
+
+    def _unavailable(self, category, country):
+        cached = self.last_headlines.get((category, country))
+        if cached:
+            return f"{cached}_(News updates are temporarily unavailable; these may be out of date.)_"
+        return "⚠️ The news service is temporarily unavailable. Please try again in a minute."
+
+
+class AsyncNewsService(NewsService):
+    """asyncio variant for the ASGI entry point."""
+
+    def __init__(self, api_key=None, transport=None, guard=None):
+        super().__init__(api_key, guard=guard)
+        self.http = AsyncGuardedTransport(transport or get_async_transport(), self.guard)
+
+    async def get_top_news(self, category="general", country="us"):
+        if not self._configured():
+            return "News API key is not configured. Please add your News API key to the .env file."
+
+        try:
+            response = await self.http.get(self.base_url, params=self._params(category, country))
+            return self._format_headlines(category, country, response)
+        except UpstreamUnavailable:
+            return self._unavailable(category, country)
         except Exception as e:
             return f"Error fetching news: {str(e)}"
@@ -1,26 +1,39 @@
-import requests
+from http_transport import get_transport
+from async_transport import get_async_transport
 import json
 import os
+import time
+from resilience import describe_failure
+from response_stream import ResponseExtractor
+from system_prompt import SYSTEM_INSTRUCTION, PromptUsage
+
+# Models whose providers only cache a prompt prefix at an explicit cache_control breakpoint.
+# OpenAI, DeepSeek and others cache matching prefixes on their own, and get the plain request.
+CACHE_CONTROL_MODELS = ("anthropic/", "google/gemini")
+
+# Marks the end of a streamed completion
+DONE = object()
 
 class OpenRouterClient:
-    def __init__(self, api_key, model=None):
+    def __init__(self, api_key, model=None, transport=None, cache=None):
         self.api_key = api_key
         self.model = model or "deepseek/deepseek-chat"
-        self.base_url = "https://openrouter.ai/api/v1/chat/completions"
-
-    def get_full_response(self, prompt, file_data=None):
-        """Generates response and emotion in a single call, supporting files."""
-        system_instruction = (
-            "You are GlobleXGPT, a powerful AI assistant with advanced multimodal capabilities. "
-            "You CAN generate images, videos, and search YouTube. "
-            "If a user asks for an image, tell them you are generating it. "
-            "If a user asks for a video, tell them you are generating it. "
-            "If a user asks to find a YouTube video or trending videos, tell them you are looking for them. "
-            "You should also mention that you can animate images if they attach one. "
-            "Return your response in JSON format with exactly two keys: "
-            "'response' (your helpful text) and 'emotion' (one word describing user's mood, e.g., Happy, Neutral, Sad)."
-        )
+        # *_BASE_URL overrides let bench_load.py point the clients at local stand-ins
+        self.base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/") + "/chat/completions"
+        self.http = transport or get_transport()
+        self.cache = cache  # optional ResponseCache
+        self.usage = PromptUsage()
+        cache_control = os.getenv("OPENROUTER_CACHE_CONTROL", "auto")
+        if cache_control == "auto":
+            self.cache_control = self.model.startswith(CACHE_CONTROL_MODELS)
+        else:
+            self.cache_control = cache_control == "1"
 
+    def _build_request(self, prompt, file_data=None, history=None):
+        """
+        Builds the headers and chat payload shared by the blocking and streaming calls.
+        `history` is the earlier conversation as [{"role", "content"}] messages.
+        """
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
@@ -42,64 +55,302 @@ class OpenRouterClient:
                         }
                     }
                 ]
+            elif file_data.get('isText'):
+                user_content = f"{prompt}\n\n[Context from attached file '{file_data.get('name')}']:\n{file_data.get('data')}"
             else:
                 user_content = f"{prompt}\n[Attached File: {file_data.get('name')}]"
 
         payload = {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": system_instruction},
+                self._system_message(),
+                *(history or []),
                 {"role": "user", "content": user_content}
             ],
-            "response_format": {"type": "json_object"}
+            "response_format": {"type": "json_object"},
+            # Token counts, including cached prompt tokens, in the response (the last chunk when streaming)
+            "usage": {"include": True}
         }
+        return headers, payload
+
+    def _system_message(self):
+        # The system prompt leads every request, so it is the prefix providers can reuse
+        if not self.cache_control:
+            return {"role": "system", "content": SYSTEM_INSTRUCTION}
+        return {"role": "system", "content": [
+            {"type": "text", "text": SYSTEM_INSTRUCTION, "cache_control": {"type": "ephemeral"}}
+        ]}
+
+    def _record_usage(self, usage, first_token):
+        """Adds one call's `usage` block to self.usage."""
+        if not usage:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        self.usage.record(
+            prompt_tokens=usage.get("prompt_tokens") or 0,
+            cached_tokens=details.get("cached_tokens") or 0,
+            cache_write_tokens=details.get("cache_write_tokens") or 0,
+            completion_tokens=usage.get("completion_tokens") or 0,
+            first_token=first_token
+        )
 
+    @staticmethod
+    def _usage_of(response):
         try:
-            response = requests.post(self.base_url, headers=headers, data=json.dumps(payload))
-            
-            # log raw response if status not 200
-            if response.status_code != 200:
-                print(f"OpenRouter Error {response.status_code}: {response.text}")
-                return {
-                    "response": f"API Error {response.status_code}: {response.text}",
-                    "emotion": "Neutral"
-                }
+            return response.json().get("usage") if response.status_code == 200 else None
+        except ValueError:
+            return None
 
-            data = response.json()
-            
-            if 'choices' not in data or not data['choices']:
-                return {"response": "I couldn't get a response. Please try again.", "emotion": "Neutral"}
+    def _cache_key(self, prompt, file_data, history):
+        if self.cache is None:
+            return None
+        return self.cache.key(prompt, self.model, SYSTEM_INSTRUCTION, file_data, history)
 
-            content = data['choices'][0]['message']['content']
-            
-            # Robust JSON parsing
-            try:
-                # Clean up markdown if present
-                clean_content = content.strip()
-                if clean_content.startswith("```json"):
-                    clean_content = clean_content[7:-3].strip()
-                elif clean_content.startswith("```"):
-                    clean_content = clean_content[3:-3].strip()
-                
-                parsed_data = json.loads(clean_content)
-                return {
-                    "response": parsed_data.get("response", content),
-                    "emotion": parsed_data.get("emotion", "Neutral")
-                }
-            except json.JSONDecodeError:
-                # Fallback if AI didn't return valid JSON
-                return {
-                    "response": content,
-                    "emotion": "Neutral"
-                }
-                
+    def get_full_response(self, prompt, file_data=None, history=None):
+        """Generates response and emotion in a single call, supporting files."""
+        return self.respond(prompt, file_data, history)[0]
+
+    def respond(self, prompt, file_data=None, history=None):
+        """get_full_response() as (result, ok): ok is False when result is an error message, True for a cache hit."""
+        key = self._cache_key(prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                return cached, True
+
+        start = time.perf_counter()
+        result, ok = self.fetch_full_response(prompt, file_data, history)
+        if key and ok:
+            self.cache.put(key, result, time.perf_counter() - start)
+        return result, ok
+
+    def fetch_full_response(self, prompt, file_data=None, history=None):
+        """Uncached API call. Returns (result, ok); ok is False when result carries an error message."""
+        headers, payload = self._build_request(prompt, file_data, history)
+        start = time.perf_counter()
+
+        try:
+            response = self.http.post(self.base_url, headers=headers, data=json.dumps(payload))
+            self._record_usage(self._usage_of(response), time.perf_counter() - start)
+            return self._parse_completion(response)
         except Exception as e:
             print(f"Error in OpenRouter response: {e}")
+            return self._connection_error(e), False
+
+    @staticmethod
+    def _connection_error(e):
+        return {
+            "response": f"I'm having trouble connecting to my brain. Error: {str(e)}",
+            "emotion": "Neutral",
+            "failure": describe_failure(e)
+        }
+
+    @staticmethod
+    def _status_error(response):
+        print(f"OpenRouter Error {response.status_code}: {response.text}")
+        return {
+            "response": f"API Error {response.status_code}: {response.text}",
+            "emotion": "Neutral",
+            "failure": describe_failure(status=response.status_code)
+        }
+
+    # A 200 without any content
+    NO_ANSWER = {"response": "I couldn't get a response. Please try again.", "emotion": "Neutral",
+                 "failure": {"error": "empty_response"}}
+
+    @staticmethod
+    def _parse_completion(response):
+        """(result, ok) for a chat completion response; shared by the sync and async clients."""
+        # log raw response if status not 200
+        if response.status_code != 200:
+            return OpenRouterClient._status_error(response), False
+
+        data = response.json()
+        
+        if 'choices' not in data or not data['choices']:
+            return dict(OpenRouterClient.NO_ANSWER), False
+
+        content = data['choices'][0]['message']['content']
+        
+        # Robust JSON parsing
+        try:
+            # Clean up markdown if present
+            clean_content = content.strip()
+            if clean_content.startswith("```json"):
+                clean_content = clean_content[7:-3].strip()
+            elif clean_content.startswith("```"):
+                clean_content = clean_content[3:-3].strip()
+            
+            parsed_data = json.loads(clean_content)
+            return {
+                "response": parsed_data.get("response", content),
+                "emotion": parsed_data.get("emotion", "Neutral")
+            }, True
+        except json.JSONDecodeError:
+            # Fallback if AI didn't return valid JSON
             return {
-                "response": f"I'm having trouble connecting to my brain. Error: {str(e)}",
+                "response": content,
                 "emotion": "Neutral"
-            }
+            }, True
+
+    def stream_full_response(self, prompt, file_data=None, history=None):
+        """
+        Streaming variant of get_full_response. Yields ("delta", text) while the completion
+        arrives and finally ("done", {"response", "emotion"}), or ("error", {...}) with a
+        message for the user when the call failed.
+        """
+        key = self._cache_key(prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                yield "done", cached
+                return
+
+        headers, payload = self._build_request(prompt, file_data, history)
+        payload["stream"] = True
+        extractor = ResponseExtractor()
+        start = time.perf_counter()
+
+        try:
+            response = self.http.post(self.base_url, headers=headers, data=json.dumps(payload), stream=True)
+            if response.status_code != 200:
+                yield "error", self._status_error(response)
+                return
+
+            usage, first_token = None, None
+            with response:
+                for raw_line in response.iter_lines():
+                    chunk = self._stream_chunk(raw_line.decode("utf-8"))
+                    if chunk is DONE:
+                        break
+                    if chunk:
+                        usage = chunk.get("usage") or usage
+                        content = self._chunk_content(chunk)
+                        if content:
+                            if first_token is None:
+                                first_token = time.perf_counter() - start
+                            delta = extractor.feed(content)
+                            if delta:
+                                yield "delta", delta
+            self._record_usage(usage, first_token)
+
+            if not extractor.buffer:
+                yield "error", dict(self.NO_ANSWER)
+                return
+            result = extractor.result()
+            if key:
+                self.cache.put(key, result, time.perf_counter() - start)
+            yield "done", result
+
+        except Exception as e:
+            print(f"Error in OpenRouter stream: {e}")
+            yield "error", self._connection_error(e)
+
+    @staticmethod
+    def _stream_chunk(line):
+        """The JSON chunk carried by one SSE line of a streamed completion, None, or DONE at the end."""
+        # Skip keep-alive comments such as ": OPENROUTER PROCESSING"
+        if not line.startswith("data:"):
+            return None
+        chunk = line[5:].strip()
+        if chunk == "[DONE]":
+            return DONE
+        return json.loads(chunk)
+
+    @staticmethod
+    def _chunk_content(chunk):
+        choices = chunk.get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content")
 
     def get_response(self, prompt):
         res = self.get_full_response(prompt)
         return res["response"]
+
+
+class AsyncOpenRouterClient(OpenRouterClient):
+    """
+    asyncio variant for the ASGI entry point: the same requests and parsing,
+    sent through the shared AsyncHttpTransport so a slow completion holds a
+    coroutine instead of a worker thread.
+    """
+
+    def __init__(self, api_key, model=None, transport=None, cache=None):
+        super().__init__(api_key, model, cache=cache)
+        self.http = transport or get_async_transport()
+
+    async def get_full_response(self, prompt, file_data=None, history=None):
+        return (await self.respond(prompt, file_data, history))[0]
+
+    async def respond(self, prompt, file_data=None, history=None):
+        key = self._cache_key(prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                return cached, True
+
+        start = time.perf_counter()
+        result, ok = await self.fetch_full_response(prompt, file_data, history)
+        if key and ok:
+            self.cache.put(key, result, time.perf_counter() - start)
+        return result, ok
+
+    async def fetch_full_response(self, prompt, file_data=None, history=None):
+        headers, payload = self._build_request(prompt, file_data, history)
+        start = time.perf_counter()
+        try:
+            response = await self.http.post(self.base_url, headers=headers, data=json.dumps(payload))
+            self._record_usage(self._usage_of(response), time.perf_counter() - start)
+            return self._parse_completion(response)
+        except Exception as e:
+            print(f"Error in OpenRouter response: {e}")
+            return self._connection_error(e), False
+
+    async def stream_full_response(self, prompt, file_data=None, history=None):
+        key = self._cache_key(prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                yield "done", cached
+                return
+
+        headers, payload = self._build_request(prompt, file_data, history)
+        payload["stream"] = True
+        extractor = ResponseExtractor()
+        start = time.perf_counter()
+
+        try:
+            async with self.http.stream("POST", self.base_url, headers=headers, data=json.dumps(payload)) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    yield "error", self._status_error(response)
+                    return
+                usage, first_token = None, None
+                async for line in response.aiter_lines():
+                    chunk = self._stream_chunk(line)
+                    if chunk is DONE:
+                        break
+                    if chunk:
+                        usage = chunk.get("usage") or usage
+                        content = self._chunk_content(chunk)
+                        if content:
+                            if first_token is None:
+                                first_token = time.perf_counter() - start
+                            delta = extractor.feed(content)
+                            if delta:
+                                yield "delta", delta
+                self._record_usage(usage, first_token)
+
+            if not extractor.buffer:
+                yield "error", dict(self.NO_ANSWER)
+                return
+            result = extractor.result()
+            if key:
+                self.cache.put(key, result, time.perf_counter() - start)
+            yield "done", result
+
+        except Exception as e:
+            print(f"Error in OpenRouter stream: {e}")
+            yield "error", self._connection_error(e)
+
+    async def get_response(self, prompt):
+        return (await self.get_full_response(prompt))["response"]
@@ -0,0 +1,514 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from resilience import describe_failure, upstream_fault
+from system_prompt import SYSTEM_INSTRUCTION
+
+
+def call_error(e):
+    """Result for a provider call that raised instead of returning its own error result."""
+    return {"response": f"I'm having trouble connecting to my brain. Error: {e}", "emotion": "Neutral",
+            "failure": describe_failure(e)}
+
+
+class ProviderHealth:
+    """Rolling latency/error window for one provider, plus temporary ejection after repeated failures."""
+
+    def __init__(self, name, window=200, eject_after=3, eject_seconds=30):
+        self.name = name
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)        # seconds for complete answers
+        self.first_events = deque(maxlen=window)     # seconds to the first streamed event
+        self.outcomes = deque(maxlen=window)         # True for good answers
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.counters = {"requests": 0, "failures": 0, "hedges_won": 0, "ejections": 0}
+
+    def record(self, ok, latency=None, first_event=None, result=None):
+        """
+        `result` is a failed call's error result. If its "failure" (see
+        resilience.describe_failure) doesn't blame the provider, e.g. a 400 for
+        an attachment it can't read, it doesn't count toward ejection.
+        """
+        with self.lock:
+            self.counters["requests"] += 1
+            self.outcomes.append(ok)
+            if ok:
+                self.consecutive_failures = 0
+                if latency is not None:
+                    self.latencies.append(latency)
+                if first_event is not None:
+                    self.first_events.append(first_event)
+                return
+            self.counters["failures"] += 1
+            failure = (result or {}).get("failure")
+            if failure is not None and not upstream_fault(failure):
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.eject_after:
+                # After the ejection it gets live traffic again; one more failure ejects it again
+                self.ejected_until = time.time() + self.eject_seconds
+                self.consecutive_failures = self.eject_after - 1
+                self.counters["ejections"] += 1
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def available(self):
+        return time.time() >= self.ejected_until
+
+    @staticmethod
+    def _percentile(samples, q):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def hedge_delay(self, streaming, default, minimum, min_samples=20):
+        """The provider's p95 (latency or time to first event), once there are enough samples."""
+        with self.lock:
+            samples = list(self.first_events if streaming else self.latencies)
+        if len(samples) < min_samples:
+            return default
+        return max(minimum, self._percentile(samples, 0.95))
+
+    def stats(self):
+        with self.lock:
+            latencies, first_events, outcomes = list(self.latencies), list(self.first_events), list(self.outcomes)
+            stats = dict(self.counters, consecutive_failures=self.consecutive_failures)
+            stats["ejected_for"] = round(max(0.0, self.ejected_until - time.time()), 1)
+        stats["error_rate"] = round(outcomes.count(False) / len(outcomes), 4) if outcomes else 0.0
+        for label, samples in (("latency", latencies), ("first_event", first_events)):
+            for q in (0.5, 0.95, 0.99):
+                value = self._percentile(samples, q)
+                stats[f"{label}_p{int(q * 100)}_ms"] = round(value * 1000, 1) if value is not None else None
+        return stats
+
+
+class ProviderRouter:
+    """
+    Sends each chat request to the healthiest of several LLM clients, hedging slow calls.
+
+    The primary is the first provider in order that isn't ejected. If it hasn't
+    answered by its own p95 latency (or `hedge_default` until there is enough
+    history), the same request goes to the next provider and the first good
+    answer wins; the other is ignored, or for streams closed. A failure from the
+    primary starts the backup immediately. Calls run on a pool of `max_workers`
+    threads (a stream holds one for as long as it lasts), and the hedge clock and
+    latency samples start when a call leaves the pool queue, so a busy pool
+    doesn't look like a slow provider. A provider with `eject_after`
+    consecutive failures (429s, 5xx, timeouts) is skipped for `eject_seconds`.
+
+    Providers need fetch_full_response(prompt, file_data, history) -> (result, ok)
+    and stream_full_response(...) yielding ("delta", text), then ("done", result)
+    or ("error", result), so local fakes work as well as the real clients. A
+    failed result's "failure" says whose fault it was; one without counts
+    against the provider.
+    """
+
+    def __init__(self, providers, cache=None, hedge_default=4.0, hedge_min=0.5, max_workers=16,
+                 eject_after=3, eject_seconds=30):
+        self.providers = list(providers)
+        self.cache = cache
+        self.hedge_default = hedge_default
+        self.hedge_min = hedge_min
+        self.health = {
+            id(p): ProviderHealth(self._name(p), eject_after=eject_after, eject_seconds=eject_seconds)
+            for p in self.providers
+        }
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider")
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "hedged": 0, "failovers": 0}
+        self.model = "router:" + ",".join(self._name(p) for p in self.providers)
+
+    @staticmethod
+    def _name(provider):
+        return getattr(provider, "name", None) or type(provider).__name__
+
+    def _ordered(self):
+        available = [p for p in self.providers if self.health[id(p)].available()]
+        # If everything is ejected, trying anyway beats failing outright
+        return available or list(self.providers)
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _submit(self, fn, *args):
+        # Runs in the caller's context, so per-request labels (see metrics.set_intent) follow the call
+        return self.executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _cache_key(self, prompt, file_data, history):
+        if self.cache is None:
+            return None
+        return self.cache.key(prompt, self.model, SYSTEM_INSTRUCTION, file_data, history)
+
+    def get_full_response(self, prompt, file_data=None, history=None):
+        return self.respond(prompt, file_data, history)[0]
+
+    def respond(self, prompt, file_data=None, history=None):
+        """Cached hedged call. Returns (result, ok) like the clients' respond()."""
+        key = self._cache_key(prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                return cached, True
+
+        start = time.perf_counter()
+        result, ok = self.fetch_full_response(prompt, file_data, history)
+        if key and ok:
+            self.cache.put(key, result, time.perf_counter() - start)
+        return result, ok
+
+    def _call(self, provider, prompt, file_data, history):
+        start = time.perf_counter()
+        try:
+            result, ok = provider.fetch_full_response(prompt, file_data, history)
+        except Exception as e:
+            result, ok = call_error(e), False
+        self.health[id(provider)].record(ok, latency=time.perf_counter() - start, result=result)
+        return result, ok
+
+    def fetch_full_response(self, prompt, file_data=None, history=None):
+        """Hedged call across the providers. Returns (result, ok) like the clients."""
+        self._count("requests")
+        candidates = self._ordered()
+        events = queue.Queue()
+        failure = None
+
+        def call(provider):
+            events.put((provider, "start", time.perf_counter()))
+            events.put((provider, "result", self._call(provider, prompt, file_data, history)))
+
+        def launch():
+            provider = candidates.pop(0)
+            self._submit(call, provider)
+            return provider
+
+        primary = launch()
+        hedge_at = None  # set once the primary is out of the pool queue
+        live = 1
+
+        while live:
+            timeout = max(0.0, hedge_at - time.perf_counter()) if candidates and hedge_at is not None else None
+            try:
+                provider, kind, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                # The primary is slower than its p95: ask the next provider too
+                self._count("hedged")
+                launch()
+                live += 1
+                hedge_at = None
+                continue
+            if kind == "start":
+                if provider is primary:
+                    hedge_at = payload + self.health[id(primary)].hedge_delay(False, self.hedge_default, self.hedge_min)
+                continue
+            live -= 1
+            result, ok = payload
+            if ok:
+                if provider is not primary:
+                    self.health[id(provider)].count("hedges_won")
+                return result, True
+            failure = failure or result
+            if candidates and not live:
+                self._count("failovers")
+                launch()
+                live += 1
+        return failure, False
+
+    def stream_full_response(self, prompt, file_data=None, history=None):
+        key = self._cache_key(prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                yield "done", cached
+                return
+
+        self._count("requests")
+        candidates = self._ordered()
+        events = queue.Queue()
+        cancels = {}
+        started = {}
+        failure = None
+        start = time.perf_counter()
+
+        def pump(provider, cancel):
+            events.put((provider, "start", time.perf_counter()))
+            if cancel.is_set():
+                # Queued behind other calls until the stream was already won or abandoned
+                events.put((provider, "end", None))
+                return
+            try:
+                for kind, payload in provider.stream_full_response(prompt, file_data, history):
+                    if cancel.is_set():
+                        break
+                    events.put((provider, kind, payload))
+            except Exception as e:
+                events.put((provider, "error", call_error(e)))
+            finally:
+                events.put((provider, "end", None))
+
+        def launch():
+            provider = candidates.pop(0)
+            cancels[id(provider)] = threading.Event()
+            self._submit(pump, provider, cancels[id(provider)])
+            return provider
+
+        primary = launch()
+        hedge_at = None  # set once the primary's pump is out of the pool queue
+        live = 1
+        winner = None
+        first_event = None
+
+        try:
+            while live:
+                waiting = candidates and winner is None and hedge_at is not None
+                timeout = max(0.0, hedge_at - time.perf_counter()) if waiting else None
+                try:
+                    provider, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    self._count("hedged")
+                    launch()
+                    live += 1
+                    hedge_at = None
+                    continue
+
+                if kind == "start":
+                    started[id(provider)] = payload
+                    if provider is primary:
+                        hedge_at = payload + self.health[id(primary)].hedge_delay(True, self.hedge_default, self.hedge_min)
+                    continue
+                if kind == "end":
+                    live -= 1
+                    continue
+                health = self.health[id(provider)]
+                if winner is None:
+                    if kind == "error":
+                        health.record(False, result=payload)
+                        failure = failure or payload
+                        if candidates:
+                            self._count("failovers")
+                            launch()
+                            live += 1
+                        continue
+                    # First useful event: this provider wins, the others are told to stop
+                    winner = provider
+                    first_event = time.perf_counter() - started[id(provider)]
+                    if provider is not primary:
+                        health.count("hedges_won")
+                    for other, cancel in cancels.items():
+                        if other != id(provider):
+                            cancel.set()
+                if provider is not winner:
+                    continue
+
+                if kind == "delta":
+                    yield kind, payload
+                    continue
+                health.record(kind == "done", latency=time.perf_counter() - started[id(provider)], first_event=first_event,
+                              result=payload)
+                if kind == "done" and key:
+                    self.cache.put(key, payload, time.perf_counter() - start)
+                yield kind, payload
+                return
+
+            yield "error", failure or {"response": "I couldn't get a response. Please try again.", "emotion": "Neutral"}
+        finally:
+            # Also reached when the consumer goes away mid-stream (GeneratorExit at a yield)
+            for cancel in cancels.values():
+                cancel.set()
+
+    def get_response(self, prompt):
+        return self.get_full_response(prompt)["response"]
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["providers"] = {health.name: health.stats() for health in self.health.values()}
+        return stats
+
+
+class AsyncProviderRouter(ProviderRouter):
+    """
+    asyncio variant for the ASGI entry point, over Async* clients. Same
+    ordering, hedging and ejection rules, but calls are tasks on the event
+    loop and the losing call of a hedge is cancelled rather than left running.
+    """
+
+    @classmethod
+    def from_router(cls, router, providers):
+        """Async router over `providers` (in the same order as router.providers) sharing its cache, settings and health."""
+        first = next(iter(router.health.values()), None)
+        async_router = cls(
+            providers, cache=router.cache, hedge_default=router.hedge_default, hedge_min=router.hedge_min,
+            eject_after=first.eject_after if first else 3, eject_seconds=first.eject_seconds if first else 30
+        )
+        # One set of health windows and counters, so /provider_stats covers both serving modes
+        async_router.health = {id(p): router.health[id(s)] for p, s in zip(async_router.providers, router.providers)}
+        async_router.counters, async_router.lock = router.counters, router.lock
+        return async_router
+
+    async def get_full_response(self, prompt, file_data=None, history=None):
+        return (await self.respond(prompt, file_data, history))[0]
+
+    async def respond(self, prompt, file_data=None, history=None):
+        key = self._cache_key(prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                return cached, True
+
+        start = time.perf_counter()
+        result, ok = await self.fetch_full_response(prompt, file_data, history)
+        if key and ok:
+            self.cache.put(key, result, time.perf_counter() - start)
+        return result, ok
+
+    async def _call(self, provider, prompt, file_data, history):
+        start = time.perf_counter()
+        try:
+            result, ok = await provider.fetch_full_response(prompt, file_data, history)
+        except Exception as e:
+            result, ok = call_error(e), False
+        self.health[id(provider)].record(ok, latency=time.perf_counter() - start, result=result)
+        return result, ok
+
+    async def fetch_full_response(self, prompt, file_data=None, history=None):
+        self._count("requests")
+        candidates = self._ordered()
+        running = {}
+        failure = None
+
+        def launch():
+            provider = candidates.pop(0)
+            running[asyncio.ensure_future(self._call(provider, prompt, file_data, history))] = provider
+
+        launch()
+        primary = next(iter(running.values()))
+        hedge_at = time.perf_counter() + self.health[id(primary)].hedge_delay(False, self.hedge_default, self.hedge_min)
+
+        try:
+            while running:
+                timeout = max(0.0, hedge_at - time.perf_counter()) if candidates else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The primary is slower than its p95: ask the next provider too
+                    self._count("hedged")
+                    launch()
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    result, ok = task.result()
+                    if ok:
+                        if provider is not primary:
+                            self.health[id(provider)].count("hedges_won")
+                        return result, True
+                    failure = failure or result
+                    if candidates and not running:
+                        self._count("failovers")
+                        launch()
+            return failure, False
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def stream_full_response(self, prompt, file_data=None, history=None):
+        key = self._cache_key(prompt, file_data, history)
+        if key:
+            cached = self.cache.get(key)
+            if cached:
+                yield "done", cached
+                return
+
+        self._count("requests")
+        candidates = self._ordered()
+        events = asyncio.Queue()
+        pumps = {}
+        started = {}
+        failure = None
+        start = time.perf_counter()
+
+        async def pump(provider):
+            try:
+                async for kind, payload in provider.stream_full_response(prompt, file_data, history):
+                    events.put_nowait((provider, kind, payload))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                events.put_nowait((provider, "error", call_error(e)))
+            finally:
+                events.put_nowait((provider, "end", None))
+
+        def launch():
+            provider = candidates.pop(0)
+            started[id(provider)] = time.perf_counter()
+            pumps[id(provider)] = asyncio.ensure_future(pump(provider))
+            return provider
+
+        primary = launch()
+        hedge_at = time.perf_counter() + self.health[id(primary)].hedge_delay(True, self.hedge_default, self.hedge_min)
+        live = 1
+        winner = None
+        first_event = None
+
+        try:
+            while live:
+                timeout = max(0.0, hedge_at - time.perf_counter()) if candidates and winner is None else None
+                try:
+                    provider, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    self._count("hedged")
+                    launch()
+                    live += 1
+                    continue
+
+                if kind == "end":
+                    live -= 1
+                    continue
+                health = self.health[id(provider)]
+                if winner is None:
+                    if kind == "error":
+                        health.record(False, result=payload)
+                        failure = failure or payload
+                        if candidates:
+                            self._count("failovers")
+                            launch()
+                            live += 1
+                        continue
+                    # First useful event: this provider wins, the others are cancelled
+                    winner = provider
+                    first_event = time.perf_counter() - started[id(provider)]
+                    if provider is not primary:
+                        health.count("hedges_won")
+                    for other, task in pumps.items():
+                        if other != id(provider):
+                            task.cancel()
+                if provider is not winner:
+                    continue
+
+                if kind == "delta":
+                    yield kind, payload
+                    continue
+                health.record(kind == "done", latency=time.perf_counter() - started[id(provider)], first_event=first_event,
+                              result=payload)
+                if kind == "done" and key:
+                    self.cache.put(key, payload, time.perf_counter() - start)
+                yield kind, payload
+                return
+
+            yield "error", failure or {"response": "I couldn't get a response. Please try again.", "emotion": "Neutral"}
+        finally:
+            for task in pumps.values():
+                task.cancel()
+
+    async def get_response(self, prompt):
+        return (await self.get_full_response(prompt))["response"]
@@ -0,0 +1,366 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+    PACIFIC = ZoneInfo("America/Los_Angeles")
+except Exception:
+    # No tz database (e.g. Windows without tzdata): standard time is close enough for a daily reset
+    PACIFIC = timezone(timedelta(hours=-8))
+
+
+class TokenBucket:
+    """
+    Calls-per-minute / calls-per-day token bucket stored in SQLite.
+
+    The state lives in one row per bucket name, updated inside an IMMEDIATE
+    transaction, so every gunicorn worker on the machine draws from the same
+    budget instead of each one assuming it has the whole quota.
+    """
+
+    def __init__(self, path, name, per_minute, per_day=None):
+        self.path = path
+        self.name = name
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.per_day = per_day
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS token_buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    day TEXT NOT NULL,
+                    day_count INTEGER NOT NULL
+                )
+            """)
+            conn.execute(
+                "INSERT OR IGNORE INTO token_buckets VALUES (?, ?, ?, ?, 0)",
+                (name, self.capacity, time.time(), self._today())
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    @staticmethod
+    def _today():
+        return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+    def _seconds_until_tomorrow(self):
+        now = datetime.now(timezone.utc)
+        return 86400 - (now.hour * 3600 + now.minute * 60 + now.second)
+
+    def _read(self, conn, now):
+        """The bucket's row with the refill since its last update applied: (tokens, day, day_count)."""
+        tokens, updated_at, day, day_count = conn.execute(
+            "SELECT tokens, updated_at, day, day_count FROM token_buckets WHERE name = ?", (self.name,)
+        ).fetchone()
+        tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+        if day != self._today():
+            day, day_count = self._today(), 0
+        return tokens, day, day_count
+
+    def _update(self, consume):
+        """Refills the bucket and optionally takes a token. Returns (took_token, wait_seconds)."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            tokens, day, day_count = self._read(conn, now)
+
+            took, wait = False, 0.0
+            if self.per_day is not None and day_count >= self.per_day:
+                wait = self._seconds_until_tomorrow()
+            elif tokens < 1:
+                wait = (1 - tokens) / self.rate
+            elif consume:
+                tokens -= 1
+                day_count += 1
+                took = True
+
+            conn.execute(
+                "UPDATE token_buckets SET tokens = ?, updated_at = ?, day = ?, day_count = ? WHERE name = ?",
+                (tokens, now, day, day_count, self.name)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return took, wait
+
+    def try_acquire(self):
+        return self._update(consume=True)
+
+    def drain(self):
+        """Empties the bucket, e.g. after the API reports we were over its limit anyway."""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE token_buckets SET tokens = 0, updated_at = ? WHERE name = ?", (time.time(), self.name))
+        finally:
+            conn.close()
+
+    def remaining(self):
+        # A plain read: the refill is computed, not written, so stats() never queues behind writers
+        conn = self._connect()
+        try:
+            tokens, _, day_count = self._read(conn, time.time())
+        finally:
+            conn.close()
+        return {
+            "minute": int(tokens),
+            "day": None if self.per_day is None else max(0, self.per_day - day_count)
+        }
+
+
+class QuotaScheduler:
+    """
+    Queues calls against a TokenBucket. acquire() waits for a token until the
+    caller's deadline, so short bursts are smoothed out instead of failing, and
+    gives up early when the queue is full or the wait would outlast the deadline.
+    Background work passes a `reserve` of daily calls it must leave for users.
+    """
+
+    def __init__(self, bucket, deadline=10.0, max_queue=20):
+        self.bucket = bucket
+        self.deadline = deadline
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.turn = threading.Lock()  # waiters take turns polling the bucket
+        self.queue_depth = 0
+        self.counters = {"granted": 0, "queued": 0, "rejected": 0, "served_stale": 0}
+
+    def acquire(self, deadline=None, reserve=0):
+        if reserve and self.bucket.per_day is not None and self.bucket.remaining()["day"] <= reserve:
+            return self._reject()
+        give_up_at = time.time() + (self.deadline if deadline is None else deadline)
+        took, wait = self.bucket.try_acquire()
+        if took:
+            with self.lock:
+                self.counters["granted"] += 1
+            return True
+
+        with self.lock:
+            if self.queue_depth >= self.max_queue or time.time() + wait > give_up_at:
+                self.counters["rejected"] += 1
+                return False
+            self.queue_depth += 1
+            self.counters["queued"] += 1
+        try:
+            if not self.turn.acquire(timeout=max(0.0, give_up_at - time.time())):
+                return self._reject()
+            try:
+                while True:
+                    took, wait = self.bucket.try_acquire()
+                    if took:
+                        with self.lock:
+                            self.counters["granted"] += 1
+                        return True
+                    if time.time() + wait > give_up_at:
+                        return self._reject()
+                    time.sleep(wait)
+            finally:
+                self.turn.release()
+        finally:
+            with self.lock:
+                self.queue_depth -= 1
+
+    def _reject(self):
+        with self.lock:
+            self.counters["rejected"] += 1
+        return False
+
+    def record_stale(self):
+        with self.lock:
+            self.counters["served_stale"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, queue_depth=self.queue_depth)
+        stats["budget_remaining"] = self.bucket.remaining()
+        return stats
+
+
+class LastResults:
+    """
+    Last good answer per key, served when the budget is spent or the API is
+    down. Kept in SQLite next to the bucket so a worker can fall back on what
+    another one fetched; with no `path` it stays in this process.
+    """
+
+    def __init__(self, path=None, name="default"):
+        self.path = path
+        self.name = name
+        self.memory = {}
+        if path:
+            conn = self._connect()
+            try:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS last_results (
+                        name TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        text TEXT NOT NULL,
+                        fetched_at REAL NOT NULL,
+                        PRIMARY KEY (name, key)
+                    )
+                """)
+            finally:
+                conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def get(self, key):
+        """(text, fetched_at) for `key`, or None."""
+        if not self.path:
+            return self.memory.get(key)
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT text, fetched_at FROM last_results WHERE name = ? AND key = ?", (self.name, key)
+            ).fetchone()
+        finally:
+            conn.close()
+
+    def put(self, key, text):
+        if not self.path:
+            self.memory[key] = (text, time.time())
+            return
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO last_results VALUES (?, ?, ?, ?)", (self.name, key, text, time.time()))
+        finally:
+            conn.close()
+
+
+class QuotaLedger:
+    """
+    Daily ledger for APIs that price calls in quota units, such as the YouTube
+    Data API (search.list costs 100 units, videos.list 1, and a project gets
+    10,000 a day, reset at midnight Pacific time).
+
+    Units are recorded per method in SQLite, so every worker spends from the
+    same budget and stats() shows where it goes. spend() refuses a call that
+    would dip into `reserve`, which keeps cheap calls working after the
+    expensive ones have run out.
+    """
+
+    def __init__(self, path, name, daily_units, tz=PACIFIC):
+        self.path = path
+        self.name = name
+        self.daily_units = daily_units
+        self.tz = tz
+        self.lock = threading.Lock()
+        self.denied = {}  # method -> calls refused by this process
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS quota_ledger (
+                    name TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    units INTEGER NOT NULL,
+                    calls INTEGER NOT NULL,
+                    PRIMARY KEY (name, day, method)
+                )
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def _now(self):
+        return datetime.now(self.tz)
+
+    def _today(self):
+        return self._now().strftime("%Y-%m-%d")
+
+    def spend(self, method, units, reserve=0):
+        """Records `units` for `method` if they fit in today's budget minus `reserve`. Returns whether they did."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            day = self._today()
+            spent = conn.execute(
+                "SELECT COALESCE(SUM(units), 0) FROM quota_ledger WHERE name = ? AND day = ?", (self.name, day)
+            ).fetchone()[0]
+            if spent + units > self.daily_units - reserve:
+                conn.execute("COMMIT")
+                with self.lock:
+                    self.denied[method] = self.denied.get(method, 0) + 1
+                return False
+            self._add(conn, day, method, units)
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _add(self, conn, day, method, units):
+        conn.execute(
+            """INSERT INTO quota_ledger VALUES (?, ?, ?, ?, 1)
+               ON CONFLICT (name, day, method) DO UPDATE SET units = units + excluded.units, calls = calls + 1""",
+            (self.name, day, method, units)
+        )
+
+    def exhaust(self):
+        """Marks today's budget as spent, e.g. after the API reported quotaExceeded anyway."""
+        remaining = self.remaining()
+        if remaining > 0:
+            conn = self._connect()
+            try:
+                self._add(conn, self._today(), "quota_exceeded", remaining)
+            finally:
+                conn.close()
+
+    def _usage(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT method, units, calls FROM quota_ledger WHERE name = ? AND day = ?", (self.name, self._today())
+            ).fetchall()
+        finally:
+            conn.close()
+        return {method: {"units": units, "calls": calls} for method, units, calls in rows}
+
+    def remaining(self):
+        conn = self._connect()
+        try:
+            spent = conn.execute(
+                "SELECT COALESCE(SUM(units), 0) FROM quota_ledger WHERE name = ? AND day = ?", (self.name, self._today())
+            ).fetchone()[0]
+        finally:
+            conn.close()
+        return max(0, self.daily_units - spent)
+
+    def stats(self):
+        usage = self._usage()
+        spent = sum(entry["units"] for entry in usage.values())
+        now = self._now()
+        elapsed_hours = (now.hour * 3600 + now.minute * 60 + now.second) / 3600 or 1 / 3600
+        rate = spent / elapsed_hours
+        with self.lock:
+            denied = dict(self.denied)
+        return {
+            "daily_units": self.daily_units,
+            "spent": spent,
+            "remaining": max(0, self.daily_units - spent),
+            "by_method": usage,
+            "denied": denied,
+            "units_per_hour": round(rate, 1),
+            # At today's average burn rate; None when the budget outlasts the day
+            "hours_until_exhausted": round((self.daily_units - spent) / rate, 1)
+                if rate and (self.daily_units - spent) / rate < 24 - elapsed_hours else None,
+            "resets_in_seconds": int(86400 - elapsed_hours * 3600)
+        }
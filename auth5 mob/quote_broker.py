@@ -0,0 +1,102 @@
+import threading
+import time
+from concurrent.futures import Future
+
+
+class QuoteBroker:
+    """
+    Coalesces price lookups in front of a multi-symbol quote API.
+
+    - Quotes fetched within the last `freshness` seconds are served from memory.
+    - Concurrent requests for the same symbol share one in-flight call (single-flight).
+    - Requests for different symbols arriving within `window` seconds are merged
+      into one call to `fetch_quotes(symbols)`, which returns {symbol: quote}.
+    """
+
+    def __init__(self, fetch_quotes, window=0.05, freshness=30, max_batch=100, timeout=15):
+        self.fetch_quotes = fetch_quotes
+        self.window = window
+        self.freshness = freshness
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.quotes = {}      # symbol -> (quote, fetched_at)
+        self.in_flight = {}   # symbol -> Future shared by every waiting request
+        self.pending = []     # symbols waiting for the next batch
+        self.timer = None
+        self.counters = {"requests": 0, "cache_hits": 0, "coalesced": 0, "batches": 0, "symbols_fetched": 0, "errors": 0}
+
+    def get(self, symbol):
+        """Returns the quote for `symbol`, or None if the API doesn't know it. Raises on upstream errors."""
+        symbol = symbol.upper()
+        with self.lock:
+            self.counters["requests"] += 1
+            cached = self.quotes.get(symbol)
+            if cached and time.time() - cached[1] < self.freshness:
+                self.counters["cache_hits"] += 1
+                return cached[0]
+
+            future = self.in_flight.get(symbol)
+            if future:
+                self.counters["coalesced"] += 1
+            else:
+                future = Future()
+                self.in_flight[symbol] = future
+                self.pending.append(symbol)
+                if len(self.pending) >= self.max_batch:
+                    self._schedule(0)
+                elif self.timer is None:
+                    self._schedule(self.window)
+
+        return future.result(timeout=self.timeout)
+
+    def last(self, symbol):
+        """Returns (quote, fetched_at) for the last quote seen for `symbol`, however old, or None."""
+        with self.lock:
+            return self.quotes.get(symbol.upper())
+
+    def _schedule(self, delay):
+        # Called with the lock held
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(delay, self._flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _flush(self):
+        with self.lock:
+            symbols, self.pending = self.pending, []
+            self.timer = None
+            if symbols:
+                self.counters["batches"] += 1
+                self.counters["symbols_fetched"] += len(symbols)
+        if not symbols:
+            return
+
+        try:
+            quotes = self.fetch_quotes(symbols)
+        except Exception as e:
+            with self.lock:
+                self.counters["errors"] += 1
+                futures = [self.in_flight.pop(symbol) for symbol in symbols]
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        now = time.time()
+        with self.lock:
+            futures = []
+            for symbol in symbols:
+                quote = quotes.get(symbol)
+                if quote is not None:
+                    self.quotes[symbol] = (quote, now)
+                futures.append((self.in_flight.pop(symbol), quote))
+        for future, quote in futures:
+            future.set_result(quote)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, cached_symbols=len(self.quotes), in_flight=len(self.in_flight))
+        stats["calls_saved"] = stats["requests"] - stats["batches"]
+        stats["avg_batch_size"] = round(stats["symbols_fetched"] / stats["batches"], 2) if stats["batches"] else 0.0
+        return stats
@@ -0,0 +1,365 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+
+class UpstreamUnavailable(Exception):
+    """The call was not made because the upstream is failing or already saturated."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class BulkheadFullError(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Closed -> open -> half-open breaker over a rolling window of recent calls.
+
+    Opens when at least `min_calls` of the last `window` calls have completed and
+    the share of failures, or of calls slower than `slow_seconds`, reaches its
+    threshold. While open every call is rejected; after `open_seconds` up to
+    `probes` trial calls are let through (half-open). A good probe closes the
+    breaker, a bad one opens it again.
+    """
+
+    def __init__(self, name, failure_rate=0.5, slow_rate=0.8, slow_seconds=5.0, min_calls=5, window=20,
+                 open_seconds=30.0, probes=1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.lock = threading.Lock()
+        self.calls = deque(maxlen=window)  # (failed, slow)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.counters = {"opened": 0, "rejected": 0, "failures": 0, "slow": 0, "successes": 0}
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open":
+                if time.time() - self.opened_at < self.open_seconds:
+                    self.counters["rejected"] += 1
+                    return False
+                self._transition("half_open")
+            if self.state == "half_open":
+                if self.probes_in_flight >= self.probes:
+                    self.counters["rejected"] += 1
+                    return False
+                self.probes_in_flight += 1
+            return True
+
+    def cancel(self):
+        """Gives back a half-open probe slot taken by allow() for a call that never ran."""
+        with self.lock:
+            if self.state == "half_open":
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def record(self, failed, seconds):
+        slow = seconds >= self.slow_seconds
+        with self.lock:
+            self.counters["failures" if failed else "successes"] += 1
+            if slow:
+                self.counters["slow"] += 1
+            if self.state == "half_open":
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+                if failed or slow:
+                    self._transition("open")
+                else:
+                    self.calls.clear()
+                    self._transition("closed")
+                return
+            self.calls.append((failed, slow))
+            if self.state == "closed" and len(self.calls) >= self.min_calls:
+                failures = sum(1 for f, _ in self.calls if f) / len(self.calls)
+                slows = sum(1 for _, s in self.calls if s) / len(self.calls)
+                if failures >= self.failure_rate or slows >= self.slow_rate:
+                    self._transition("open")
+
+    def _transition(self, state):
+        # Called with the lock held
+        if state == "open":
+            self.opened_at = time.time()
+            self.counters["opened"] += 1
+        print(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+
+    def stats(self):
+        with self.lock:
+            calls = list(self.calls)
+            stats = dict(self.counters, state=self.state)
+            if self.state == "open":
+                stats["retry_in"] = round(max(0.0, self.open_seconds - (time.time() - self.opened_at)), 1)
+        stats["window_failure_rate"] = round(sum(1 for f, _ in calls if f) / len(calls), 4) if calls else 0.0
+        stats["window_slow_rate"] = round(sum(1 for _, s in calls if s) / len(calls), 4) if calls else 0.0
+        return stats
+
+
+def describe_failure(error=None, status=None):
+    """
+    Why an upstream call failed, as data rather than message text: {"status": 503}
+    for an HTTP error response (Google API errors carry theirs as .code), else
+    {"error": kind} with kind "timeout", "connection", "unavailable" (refused by
+    our own breaker or bulkhead) or the exception's class name.
+    """
+    if status is None:
+        code = getattr(error, "code", None)
+        if isinstance(code, int) and not isinstance(code, bool) and 100 <= code < 600:
+            status = int(code)  # an HTTPStatus for google.api_core errors
+    if status is not None:
+        return {"status": status}
+    if isinstance(error, UpstreamUnavailable):
+        return {"error": "unavailable"}
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if isinstance(error, TimeoutError) or any("Timeout" in name for name in names):
+        return {"error": "timeout"}
+    if isinstance(error, ConnectionError) or names & {"ConnectionError", "ConnectError", "NetworkError", "RemoteProtocolError"}:
+        return {"error": "connection"}
+    return {"error": type(error).__name__}
+
+
+def upstream_fault(failure):
+    """Whether a describe_failure() result blames the upstream: 429, 5xx, timeouts, lost connections, our refusals."""
+    status = failure.get("status")
+    if status is not None:
+        return status == 429 or status >= 500
+    return failure.get("error") in ("timeout", "connection", "unavailable")
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Bulkhead:
+    """
+    At most `max_concurrent` calls to one upstream; extra callers wait up to `max_wait` seconds, then are rejected.
+
+    Threads and coroutines share the slots. Coroutines waiting in acquire_async()
+    park on a future, and release() wakes the oldest one from whichever thread frees the slot.
+    """
+
+    def __init__(self, name, max_concurrent=4, max_wait=0.5):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+        self.async_waiters = deque()  # (loop, future) per acquire_async() caller waiting for a slot
+
+    def acquire(self):
+        if not self.slots.acquire(timeout=self.max_wait):
+            with self.lock:
+                self.rejected += 1
+            return False
+        with self.lock:
+            self.in_flight += 1
+        return True
+
+    async def acquire_async(self):
+        """acquire() for coroutines: waits for a slot without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while True:
+            waiter = (loop, loop.create_future())
+            with self.lock:
+                self.async_waiters.append(waiter)
+            # Registered before trying, so a slot freed in between still wakes us
+            if self.slots.acquire(blocking=False):
+                self._forget(waiter)
+                break
+            remaining = deadline - loop.time()
+            try:
+                if remaining > 0:
+                    await asyncio.wait_for(waiter[1], remaining)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # Pass on a wake-up we can no longer use
+                if not self._forget(waiter):
+                    self._wake_next()
+                raise
+            self._forget(waiter)
+            if remaining <= 0 or loop.time() >= deadline:
+                if self.slots.acquire(blocking=False):
+                    break
+                with self.lock:
+                    self.rejected += 1
+                return False
+        with self.lock:
+            self.in_flight += 1
+        return True
+
+    def _forget(self, waiter):
+        """Drops a waiter that no longer needs waking. Returns False if release() already took it."""
+        with self.lock:
+            try:
+                self.async_waiters.remove(waiter)
+                return True
+            except ValueError:
+                return False
+
+    def _wake_next(self):
+        with self.lock:
+            waiter = self.async_waiters.popleft() if self.async_waiters else None
+        if waiter:
+            loop, future = waiter
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # its event loop has closed
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+        self._wake_next()
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": self.in_flight, "max_concurrent": self.max_concurrent, "rejected": self.rejected}
+
+
+class UpstreamGuard:
+    """Bulkhead plus circuit breaker for one upstream API."""
+
+    def __init__(self, name, bulkhead=None, breaker=None):
+        self.name = name
+        self.bulkhead = bulkhead or Bulkhead(
+            name,
+            max_concurrent=int(os.getenv("UPSTREAM_MAX_CONCURRENT", 4)),
+            max_wait=float(os.getenv("UPSTREAM_QUEUE_WAIT", 0.5))
+        )
+        self.breaker = breaker or CircuitBreaker(
+            name,
+            failure_rate=float(os.getenv("BREAKER_FAILURE_RATE", 0.5)),
+            slow_seconds=float(os.getenv("BREAKER_SLOW_SECONDS", 5)),
+            min_calls=int(os.getenv("BREAKER_MIN_CALLS", 5)),
+            open_seconds=float(os.getenv("BREAKER_OPEN_SECONDS", 30))
+        )
+
+    def call(self, fn, *args, is_failure=None, **kwargs):
+        """
+        Runs fn(*args, **kwargs) inside the guard. Exceptions count as failures, as does
+        any result for which is_failure(result) is true. Raises UpstreamUnavailable
+        without calling fn when the breaker is open or the bulkhead is full.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} is failing; not calling it for now")
+        if not self.bulkhead.acquire():
+            self.breaker.cancel()
+            raise BulkheadFullError(f"{self.name} is saturated")
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = bool(is_failure and is_failure(result))
+            return result
+        finally:
+            self.bulkhead.release()
+            self.breaker.record(failed, time.perf_counter() - start)
+
+    async def acall(self, fn, *args, is_failure=None, **kwargs):
+        """call() for coroutine functions; shares the breaker and bulkhead with sync callers."""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} is failing; not calling it for now")
+        if not await self.bulkhead.acquire_async():
+            self.breaker.cancel()
+            raise BulkheadFullError(f"{self.name} is saturated")
+
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await fn(*args, **kwargs)
+            failed = bool(is_failure and is_failure(result))
+            return result
+        finally:
+            self.bulkhead.release()
+            self.breaker.record(failed, time.perf_counter() - start)
+
+    def stats(self):
+        bulkhead = self.bulkhead.stats()
+        bulkhead["bulkhead_rejected"] = bulkhead.pop("rejected")
+        return dict(self.breaker.stats(), **bulkhead)
+
+
+class GuardedTransport:
+    """
+    HttpTransport wrapper that sends every request through an UpstreamGuard.
+    429 and 5xx responses count as failures, and requests get a per-upstream
+    timeout so a hanging API can't hold a worker for the full read timeout.
+    """
+
+    def __init__(self, transport, guard, timeout=None):
+        self.transport = transport
+        self.guard = guard
+        self.timeout = timeout or (
+            float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)), float(os.getenv("UPSTREAM_TIMEOUT", 10))
+        )
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.guard.call(
+            self.transport.request, method, url,
+            is_failure=lambda response: response.status_code == 429 or response.status_code >= 500,
+            **kwargs
+        )
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def __getattr__(self, name):
+        # prewarm(), close() and the session go straight to the shared transport
+        return getattr(self.transport, name)
+
+
+class AsyncGuardedTransport(GuardedTransport):
+    """GuardedTransport over an AsyncHttpTransport; request/get/post are coroutines."""
+
+    async def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return await self.guard.acall(
+            self.transport.request, method, url,
+            is_failure=lambda response: response.status_code == 429 or response.status_code >= 500,
+            **kwargs
+        )
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(name):
+    """Returns the process-wide guard for an upstream, creating it on first use."""
+    with _guards_lock:
+        guard = _guards.get(name)
+        if guard is None:
+            guard = _guards[name] = UpstreamGuard(name)
+        return guard
+
+
+def guard_stats():
+    with _guards_lock:
+        guards = list(_guards.values())
+    return {guard.name: guard.stats() for guard in guards}
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_prompt(prompt):
+    """Lowercases, collapses whitespace and drops trailing punctuation so trivial variants share an entry."""
+    return " ".join((prompt or "").lower().split()).rstrip("?!. ")
+
+
+def attachment_hash(file_data):
+    if not file_data or not file_data.get('data'):
+        return None
+    if file_data.get('hash'):
+        # Already content-hashed by the attachment pipeline
+        return file_data['hash']
+    digest = hashlib.sha256()
+    for field in ('name', 'type', 'isText', 'data'):
+        digest.update(str(file_data.get(field)).encode("utf-8", "surrogatepass"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match cache for complete LLM answers ({"response", "emotion"} dicts).
+
+    Entries are keyed by the normalized prompt, model, system instruction,
+    attachment hash and conversation history, expire after `ttl` seconds, and are evicted least recently
+    used first once their JSON size exceeds `max_bytes`. With `path` set, entries
+    are also written to SQLite and reloaded on start, so they survive restarts.
+    Each entry remembers how long the original call took, which is reported as
+    saved latency whenever it is served again.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=3600, path=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()  # key -> (value_json, expires_at, latency)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "saved_seconds": 0.0}
+        if path:
+            self._load()
+
+    @staticmethod
+    def key(prompt, model, system_instruction, file_data=None, history=None):
+        # Earlier turns change the answer, so they are part of the key too
+        parts = [normalize_prompt(prompt), model, system_instruction, attachment_hash(file_data), history or []]
+        return hashlib.sha256(json.dumps(parts).encode("utf-8", "surrogatepass")).hexdigest()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                latency REAL NOT NULL
+            )
+        """)
+        return conn
+
+    def _load(self):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (time.time(),))
+            rows = conn.execute("SELECT key, value, expires_at, latency FROM llm_responses ORDER BY expires_at").fetchall()
+        finally:
+            conn.close()
+        with self.lock:
+            for key, value, expires_at, latency in rows:
+                self._insert(key, value, expires_at, latency)
+
+    def _persist(self, sql, params):
+        if not self.path:
+            return
+        try:
+            conn = self._connect()
+            try:
+                conn.execute(sql, params)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Error writing LLM response cache: {e}")
+
+    def get(self, key):
+        """Returns a copy of the cached answer, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() >= entry[1]:
+                self._remove(key)
+                self.counters["expired"] += 1
+                entry = None
+            if not entry:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            self.counters["saved_seconds"] += entry[2]
+        return json.loads(entry[0])
+
+    def put(self, key, value, latency):
+        """Stores a successful answer along with the latency of the call that produced it."""
+        value_json = json.dumps(value)
+        if len(value_json) > self.max_bytes:
+            return
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            evicted = self._insert(key, value_json, expires_at, latency)
+            self.counters["stores"] += 1
+            self.counters["evictions"] += len(evicted)
+        self._persist("INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?)", (key, value_json, expires_at, latency))
+        for old_key in evicted:
+            self._persist("DELETE FROM llm_responses WHERE key = ?", (old_key,))
+
+    def _insert(self, key, value_json, expires_at, latency):
+        # Called with the lock held; returns the keys evicted to stay within the byte budget
+        self.entries[key] = (value_json, expires_at, latency)
+        self.size += len(value_json)
+        evicted = []
+        while self.size > self.max_bytes:
+            old_key, _ = next(iter(self.entries.items()))
+            self._remove(old_key)
+            evicted.append(old_key)
+        return evicted
+
+    def _remove(self, key):
+        value_json = self.entries.pop(key)[0]
+        self.size -= len(value_json)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        self._persist("DELETE FROM llm_responses", ())
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, entries=len(self.entries), bytes=self.size, max_bytes=self.max_bytes)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+        return stats
@@ -0,0 +1,128 @@
+import json
+import re
+
+RESPONSE_KEY = re.compile(r'"response"\s*:\s*"')
+HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+def _hex4(digits):
+    """The value of a \\u escape's four hex digits, or None if they aren't four hex digits."""
+    return int(digits, 16) if HEX4.fullmatch(digits) else None
+
+
+def parse_response(text):
+    """Parses the {"response", "emotion"} JSON the models are asked for, tolerating fences and extra text."""
+    try:
+        if "{" in text and "}" in text:
+            data = json.loads(text[text.find("{"):text.rfind("}") + 1])
+            return {
+                "response": data.get("response", text),
+                "emotion": data.get("emotion", "Neutral")
+            }
+    except (ValueError, AttributeError):
+        pass
+    return {"response": text, "emotion": "Neutral"}
+
+
+class ResponseExtractor:
+    """
+    Incrementally pulls the "response" string out of a JSON completion that is still arriving.
+
+    feed() takes raw model output chunks and returns the newly decoded part of
+    the "response" value, so text can be forwarded while the JSON around it is
+    incomplete. If the model answers in plain text instead of JSON, the text is
+    passed through as-is. result() parses the whole completion at the end.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.mode = "seek"  # seek -> string -> done, or raw for non-JSON output
+        self.position = 0
+        self.pending = ""   # incomplete escape sequence carried between chunks
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.mode == "seek":
+            self._seek()
+        if self.mode == "raw":
+            delta = self.buffer[self.position:]
+            self.position = len(self.buffer)
+            return delta
+        if self.mode == "string":
+            return self._read_string()
+        return ""
+
+    def _seek(self):
+        found = RESPONSE_KEY.search(self.buffer)
+        if found:
+            self.mode = "string"
+            self.position = found.end()
+            return
+        # JSON output starts with "{", optionally inside a ```json fence; wait until we can tell
+        head = self.buffer.lstrip()
+        if not head or head.startswith("{"):
+            return
+        if head.startswith("`"):
+            body = head.lstrip("`")
+            if body[:4].lower() == "json":
+                body = body[4:]
+            body = body.lstrip()
+            if not body or body.startswith("{") or "json".startswith(body[:4].lower()):
+                return
+        self.mode = "raw"
+        self.position = 0
+
+    def _read_string(self):
+        out = []
+        text = self.pending + self.buffer[self.position:]
+        self.position = len(self.buffer)
+        self.pending = ""
+        i = 0
+        while i < len(text):
+            char = text[i]
+            if char == '"':
+                self.mode = "done"
+                break
+            if char != "\\":
+                out.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(text):
+                self.pending = text[i:]
+                break
+            code = text[i + 1]
+            if code == "u":
+                if i + 6 > len(text):
+                    self.pending = text[i:]
+                    break
+                codepoint = _hex4(text[i + 2:i + 6])
+                if codepoint is None:
+                    # Malformed escape in the model's output: keep the characters as they are
+                    out.append("\\u")
+                    i += 2
+                    continue
+                # Surrogate pairs arrive as two consecutive \\u escapes
+                if 0xD800 <= codepoint < 0xDC00:
+                    if i + 12 > len(text) and "\\u".startswith(text[i + 6:i + 8]):
+                        self.pending = text[i:]
+                        break
+                    low = _hex4(text[i + 8:i + 12]) if text[i + 6:i + 8] == "\\u" else None
+                    if low is not None and 0xDC00 <= low < 0xE000:
+                        out.append(chr(0x10000 + ((codepoint - 0xD800) << 10) + (low - 0xDC00)))
+                        i += 12
+                        continue
+                if 0xD800 <= codepoint < 0xE000:
+                    # Half of a surrogate pair can't be encoded; keep the escape as text
+                    out.append(text[i:i + 6])
+                    i += 6
+                    continue
+                out.append(chr(codepoint))
+                i += 6
+                continue
+            out.append(ESCAPES.get(code, code))
+            i += 2
+        return "".join(out)
+
+    def result(self):
+        return parse_response(self.buffer.strip())
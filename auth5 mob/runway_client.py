@@ -1,55 +1,62 @@
-from runwayml import RunwayML
 import os
 import time
 
 class RunwayClient:
-    def __init__(self, api_key):
-        self.client = RunwayML(api_key=api_key)
+    def __init__(self, api_key, client=None):
+        # `client` lets tests pass a local stand-in for the RunwayML SDK
+        if client is None:
+            from runwayml import RunwayML
+            client = RunwayML(api_key=api_key, base_url=os.getenv("RUNWAYML_BASE_URL") or None)
+        self.client = client
 
-    def generate_video(self, prompt, image_url=None, model="gen3a_turbo"):
+    @staticmethod
+    def _attempts(prompt, image_url=None):
+        """(endpoint, create() arguments) to try in order until one is accepted."""
+        if image_url:
+            # Image-to-Video: Gen-3 Turbo, then veo3.1
+            return [
+                ("image_to_video", dict(model="gen3a_turbo", prompt_image=image_url, prompt_text=prompt, duration=5, ratio="1280:720")),
+                ("image_to_video", dict(model="veo3.1", prompt_image=image_url, prompt_text=prompt)),
+            ]
+        # Text-to-Video: try veo3.1 first as it might be the standard available model
+        return [
+            ("text_to_video", dict(model="veo3.1", prompt_text=prompt, ratio="1280:720")),
+            ("text_to_video", dict(model="gen3a_turbo", prompt_text=prompt, duration=5, ratio="1280:720")),
+        ]
+
+    def start_video(self, prompt, image_url=None):
         """
-        Generates a video from a text prompt or image + prompt.
+        Creates a video task from a text prompt or image + prompt and returns its task id
+        without waiting for it. Progress is tracked by video_jobs.VideoJobPoller.
         """
         try:
             print(f"Starting RunwayML video generation for: {prompt}")
-            
-            if image_url:
-                # Image-to-Video
-                try:
-                    job = self.client.image_to_video.create(
-                        model="gen3a_turbo",
-                        prompt_image=image_url,
-                        prompt_text=prompt,
-                        duration=5,
-                        ratio="1280:720"
-                    )
-                except Exception as e:
-                    print(f"Gen-3 Turbo (Image) failed, trying veo3.1: {e}")
-                    job = self.client.image_to_video.create(
-                        model="veo3.1",
-                        prompt_image=image_url,
-                        prompt_text=prompt
-                    )
-            else:
-                # Text-to-Video
+            attempts = self._attempts(prompt, image_url)
+            for number, (endpoint, arguments) in enumerate(attempts, 1):
                 try:
-                    # Try veo3.1 first as it might be the standard available model
-                    job = self.client.text_to_video.create(
-                        model="veo3.1",
-                        prompt_text=prompt,
-                        ratio="1280:720"
-                    )
+                    job = getattr(self.client, endpoint).create(**arguments)
+                    break
                 except Exception as e:
-                    print(f"veo3.1 (Text) failed, trying gen3a_turbo: {e}")
-                    job = self.client.text_to_video.create(
-                        model="gen3a_turbo",
-                        prompt_text=prompt,
-                        duration=5,
-                        ratio="1280:720"
-                    )
-            
-            task_id = job.id
-            print(f"Task created with ID: {task_id}")
+                    if number == len(attempts):
+                        raise
+                    print(f"{arguments['model']} ({endpoint}) failed, trying {attempts[number][1]['model']}: {e}")
+
+            print(f"Task created with ID: {job.id}")
+            return job.id
+
+        except Exception as e:
+            print(f"Error in RunwayML generation: {e}")
+            return None
+
+    def generate_video(self, prompt, image_url=None, model="gen3a_turbo"):
+        """
+        Generates a video from a text prompt or image + prompt, blocking until it is done.
+        The web app uses start_video() and a background VideoJobPoller instead.
+        """
+        try:
+            task_id = self.start_video(prompt, image_url=image_url)
+            if not task_id:
+                return None
 
             # Poll for completion
             while True:
@@ -78,3 +85,43 @@ class RunwayClient:
         except Exception as e:
             print(f"Error retrieving task: {e}")
             return None
+
+
+class AsyncRunwayClient(RunwayClient):
+    """
+    asyncio variant of start_video() for the ASGI entry point. Rendering is
+    still followed by the VideoJobPoller thread with the sync client.
+    """
+
+    def __init__(self, api_key, client=None):
+        if client is None:
+            from runwayml import AsyncRunwayML
+            client = AsyncRunwayML(api_key=api_key, base_url=os.getenv("RUNWAYML_BASE_URL") or None)
+        self.client = client
+
+    async def start_video(self, prompt, image_url=None):
+        try:
+            print(f"Starting RunwayML video generation for: {prompt}")
+            attempts = self._attempts(prompt, image_url)
+            for number, (endpoint, arguments) in enumerate(attempts, 1):
+                try:
+                    job = await getattr(self.client, endpoint).create(**arguments)
+                    break
+                except Exception as e:
+                    if number == len(attempts):
+                        raise
+                    print(f"{arguments['model']} ({endpoint}) failed, trying {attempts[number][1]['model']}: {e}")
+
+            print(f"Task created with ID: {job.id}")
+            return job.id
+
+        except Exception as e:
+            print(f"Error in RunwayML generation: {e}")
+            return None
+
+    async def get_task_status(self, task_id):
+        try:
+            return await self.client.tasks.retrieve(task_id)
+        except Exception as e:
+            print(f"Error retrieving task: {e}")
+            return None
@@ -0,0 +1,102 @@
+import threading
+import time
+
+
+class ServiceRegistry:
+    """
+    Clients that are slow to import or build, constructed on first use.
+
+    app.py registers a factory per client instead of building it at import
+    time (the Supabase, RunwayML and Google SDKs, pyautogui and OpenCV take
+    seconds to import, and some need a display or the network). register()
+    returns a LazyService that stands in for the client until an attribute is
+    first used. warm_up() builds everything on a background thread once the
+    server is taking requests, so usually no request waits for a build either.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.factories = {}  # name -> (factory, setup)
+        self.build_locks = {}
+        self.instances = {}
+        self.built = {}  # name -> {"seconds", "by"}
+        self.failures = {}  # name -> last error
+        self.warming = None
+
+    def register(self, name, factory, setup=None):
+        """`setup(instance)` runs once after the build, e.g. to instrument the client."""
+        with self.lock:
+            self.factories[name] = (factory, setup)
+            self.build_locks[name] = threading.Lock()
+        return LazyService(self, name)
+
+    def get(self, name, by="request"):
+        """Returns the client, building it (once, whichever thread gets there first) if needed."""
+        instance = self.instances.get(name)
+        if instance is not None:
+            return instance
+        with self.build_locks[name]:
+            if name in self.instances:
+                return self.instances[name]
+            factory, setup = self.factories[name]
+            started = time.perf_counter()
+            try:
+                instance = factory()
+                if setup:
+                    setup(instance)
+            except Exception as e:
+                # Not cached: the next use tries again
+                print(f"Error initializing {name}: {e}")
+                self.failures[name] = str(e)
+                raise
+            self.instances[name] = instance
+            self.built[name] = {"seconds": round(time.perf_counter() - started, 4), "by": by}
+            self.failures.pop(name, None)
+        return instance
+
+    def warm_up(self, delay=0.0):
+        """Builds every registered client on a daemon thread; only the first call does anything."""
+        with self.lock:
+            if self.warming:
+                return self.warming
+            self.warming = threading.Thread(target=self._warm_up, args=(delay,), daemon=True, name="warm-up")
+        self.warming.start()
+        return self.warming
+
+    def _warm_up(self, delay):
+        time.sleep(delay)
+        for name in list(self.factories):
+            try:
+                self.get(name, by="warm_up")
+            except Exception:
+                pass  # already reported by get()
+
+    def stats(self):
+        """Per client: built (by a request or the warm-up, and how long it took), failed, or still pending."""
+        with self.lock:
+            names = list(self.factories)
+        stats = {}
+        for name in names:
+            if name in self.built:
+                stats[name] = dict(self.built[name], state="built")
+            elif name in self.failures:
+                stats[name] = {"state": "failed", "error": self.failures[name]}
+            else:
+                stats[name] = {"state": "pending"}
+        return stats
+
+
+class LazyService:
+    """Stand-in for a registered client: the first attribute access builds the real one."""
+
+    __slots__ = ("_registry", "_name")
+
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._registry.get(self._name), attr)
+
+    def __repr__(self):
+        return f"<LazyService {self._name}>"
@@ -1,19 +1,18 @@
-import requests
+from http_transport import get_transport
+from async_transport import get_async_transport
 import json
 import os
 import base64
 
 class StabilityClient:
-    def __init__(self, api_key, model=None):
+    def __init__(self, api_key, model=None, transport=None):
         self.api_key = api_key
         # Common models: sd3-large, sd3-large-turbo, sd3-medium, stable-diffusion-v1-6, stable-diffusion-xl-1024-v1-0
         self.model = model or "sd3-large-turbo"
-        self.base_url = "https://api.stability.ai/v2beta/stable-image/generate/core"
+        self.base_url = os.getenv("STABILITY_BASE_URL", "https://api.stability.ai").rstrip("/") + "/v2beta/stable-image/generate/core"
+        self.http = transport or get_transport()
 
-    def generate_image(self, prompt):
-        """Generates an image using the modern Stability API Core endpoint."""
-        url = "https://api.stability.ai/v2beta/stable-image/generate/core"
-        
+    def _request(self, prompt):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Accept": "application/json"
@@ -26,21 +25,45 @@ class StabilityClient:
             "aspect_ratio": (None, "1:1"),
             "model": (None, self.model)
         }
+        return headers, files
+
+    @staticmethod
+    def _parse_image(response):
+        if response.status_code == 200:
+            data = response.json()
+            base64_data = data.get('image')
+            if base64_data:
+                return f"data:image/png;base64,{base64_data}"
+        else:
+            print(f"Stability API Error {response.status_code}: {response.text}")
+            # Fallback to older v1 if v2 fails for some reason or just return None
+            return None
+
+    def generate_image(self, prompt):
+        """Generates an image using the modern Stability API Core endpoint."""
+        headers, files = self._request(prompt)
+        try:
+            print(f"Requesting image generation with model {self.model} for: {prompt}")
+            response = self.http.post(self.base_url, headers=headers, files=files)
+            return self._parse_image(response)
+        except Exception as e:
+            print(f"Error in Stability generation: {e}")
+            return None
+
+
+class AsyncStabilityClient(StabilityClient):
+    """asyncio variant for the ASGI entry point."""
+
+    def __init__(self, api_key, model=None, transport=None):
+        super().__init__(api_key, model)
+        self.http = transport or get_async_transport()
 
+    async def generate_image(self, prompt):
+        headers, files = self._request(prompt)
         try:
             print(f"Requesting image generation with model {self.model} for: {prompt}")
-            response = requests.post(url, headers=headers, files=files)
-            
-            if response.status_code == 200:
-                data = response.json()
-                base64_data = data.get('image')
-                if base64_data:
-                    return f"data:image/png;base64,{base64_data}"
-            else:
-                print(f"Stability API Error {response.status_code}: {response.text}")
-                # Fallback to older v1 if v2 fails for some reason or just return None
-                return None
-                
+            response = await self.http.post(self.base_url, headers=headers, files=files)
+            return self._parse_image(response)
         except Exception as e:
             print(f"Error in Stability generation: {e}")
             return None
@@ -283,27 +283,66 @@ document.addEventListener('DOMContentLoaded', () => {
         chatWrapper.scrollTop = chatWrapper.scrollHeight;
 
         try {
+            // Signed-in users' conversations are kept server-side under a chat id the server issues
+            const chat = chatHistory.find(c => c.id === currentChatId);
             const payload = {
                 prompt: prompt,
+                chat_id: chat ? chat.server_id || null : null,
                 file: attachedFile ? {
                     name: attachedFile.name,
                     type: attachedFile.type,
-                    data: attachedFile.data
+                    data: attachedFile.data,
+                    // Text files are indexed server-side rather than pasted into the prompt
+                    isText: attachedFile.isText
                 } : null
             };
 
             attachedFile = null; // Clear after prep
 
-            const response = await fetch('/ask', {
+            const response = await fetch('/ask/stream', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: authHeaders(),
                 body: JSON.stringify(payload),
             });
+            if (response.status === 401) endSession();
+
+            // Render tokens as they arrive; in voice mode start speaking at the first full sentence
+            let streamedText = '';
+            const speakStream = lastInputWasVoice;
+            if (speakStream) voiceAssistant.startStream();
+
+            const data = await readEventStream(response, (text) => {
+                if (!streamedText) thinkingDiv.classList.remove('thinking');
+                streamedText += text;
+                thinkingDiv.innerText = streamedText;
+                chatWrapper.scrollTop = chatWrapper.scrollHeight;
+                if (speakStream) voiceAssistant.pushStream(text);
+            });
+
+            if (chat && data.chat_id && chat.server_id !== data.chat_id) {
+                chat.server_id = data.chat_id;
+                saveChatToLocalStorage();
+            }
 
-            const data = await response.json();
             chatContainer.removeChild(thinkingDiv);
+            if (speakStream) {
+                if (streamedText) {
+                    voiceAssistant.endStream();
+                    lastInputWasVoice = false; // Already spoken sentence by sentence
+                } else {
+                    voiceAssistant.streaming = false;
+                }
+            }
             addMessage(data.response, true, data.emotion);
 
+            if (data.image_url) {
+                showGeneratedImage(data.image_url, data.preview_url);
+            }
+
+            if (data.job_id) {
+                pollVideoJob(data.job_id);
+            }
+
         } catch (error) {
             console.error('Error:', error);
             if (chatContainer.contains(thinkingDiv)) chatContainer.removeChild(thinkingDiv);
@@ -311,6 +350,100 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Paints the small preview first and swaps in the full image once it has downloaded
+    function showGeneratedImage(imageUrl, previewUrl) {
+        const img = document.createElement('img');
+        img.className = 'generated-image';
+        img.alt = 'Generated Image';
+        img.src = previewUrl || imageUrl;
+        if (previewUrl) {
+            const full = new Image();
+            full.onload = () => { img.src = imageUrl; };
+            full.src = imageUrl;
+        }
+        const messages = chatContainer.querySelectorAll('.ai-message .message-content');
+        const target = messages[messages.length - 1] || chatContainer;
+        target.appendChild(img);
+        chatWrapper.scrollTop = chatWrapper.scrollHeight;
+    }
+
+    // Reads the server-sent events from /ask/stream, calling onDelta for each text chunk.
+    // Resolves with the final `done` payload, which has the same shape as the /ask JSON.
+    async function readEventStream(response, onDelta) {
+        // Errors such as an oversized upload come back as plain JSON
+        if (!(response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+            return response.json();
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let result = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let eventData = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) eventData += line.slice(5).trim();
+                });
+                if (!eventData) continue;
+
+                const payload = JSON.parse(eventData);
+                if (eventName === 'delta') onDelta(payload.text);
+                else if (eventName === 'done') result = payload;
+            }
+        }
+
+        if (!result) throw new Error('Stream ended without a response');
+        return result;
+    }
+
+    // Video generation runs as a background job; long-poll its status until it finishes
+    async function pollVideoJob(jobId) {
+        const statusDiv = document.createElement('div');
+        statusDiv.classList.add('message', 'ai-message', 'thinking');
+        statusDiv.innerText = 'Generating video...';
+        chatContainer.appendChild(statusDiv);
+        chatWrapper.scrollTop = chatWrapper.scrollHeight;
+
+        let since = 0;
+        let failures = 0;
+        while (true) {
+            try {
+                const response = await fetch(`/jobs/${jobId}?wait=25&since=${since}`);
+                const job = await response.json();
+                if (!response.ok) throw new Error(job.error || response.status);
+                failures = 0;
+                since = job.updated_at;
+
+                if (job.response) {
+                    chatContainer.removeChild(statusDiv);
+                    addMessage(job.response, true, job.emotion);
+                    return;
+                }
+                const percent = Math.round((job.progress || 0) * 100);
+                statusDiv.innerText = percent > 0 ? `Generating video... ${percent}%` : 'Generating video...';
+            } catch (error) {
+                console.error('Video job error:', error);
+                if (++failures >= 5) {
+                    chatContainer.removeChild(statusDiv);
+                    addMessage("I lost track of that video. Please try again in a moment.");
+                    return;
+                }
+                await new Promise(resolve => setTimeout(resolve, 3000));
+            }
+        }
+    }
+
     sendBtn.addEventListener('click', () => {
         lastInputWasVoice = false;
         handleSendMessage();
@@ -452,6 +585,49 @@ document.addEventListener('DOMContentLoaded', () => {
     const userMenu = document.getElementById('user-menu');
     const logoutBtn = document.getElementById('logout-btn');
 
+    // Server avatars are thumbnails picked by size; data URLs (not yet uploaded) are used as-is
+    function avatarSrc(avatarUrl, size) {
+        return avatarUrl.startsWith('/avatars/') ? `${avatarUrl}?s=${size}` : avatarUrl;
+    }
+
+    // The Supabase access token from /login identifies the user; the server verifies it on every request
+    function authHeaders() {
+        const headers = { 'Content-Type': 'application/json' };
+        const token = localStorage.getItem('access_token');
+        if (token) headers['Authorization'] = `Bearer ${token}`;
+        return headers;
+    }
+
+    // A picture chosen at sign-up is uploaded on the first sign-in, when the server can verify the user
+    function uploadPendingAvatar(user) {
+        const pending = JSON.parse(localStorage.getItem('pending_avatar') || 'null');
+        if (!pending || pending.email !== (user.email || '').toLowerCase()) return;
+        localStorage.removeItem('pending_avatar');
+        if (user.avatar_url) return;
+
+        fetch('/update_profile', {
+            method: 'POST',
+            headers: authHeaders(),
+            body: JSON.stringify({ avatar_url: pending.dataUrl })
+        })
+            .then(res => res.json())
+            .then(data => {
+                if (data.avatar_url) {
+                    user.avatar_url = data.avatar_url;
+                    localStorage.setItem('user', JSON.stringify(user));
+                    updateUserInterface(user);
+                }
+            })
+            .catch(err => console.error("Error uploading avatar:", err));
+    }
+
+    // Expired or rejected token: back to the signed-out state so the user logs in again
+    function endSession() {
+        localStorage.removeItem('access_token');
+        localStorage.removeItem('user');
+        updateUserInterface(null);
+    }
+
     function updateUserInterface(user) {
         // 1. Update Sidebar Button
         const sidebarLoginBtn = document.getElementById('sidebar-login-btn');
@@ -464,7 +640,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (span) span.innerText = user.full_name || "User";
 
                 let img = sidebarLoginBtn.querySelector('img');
-                if (user.avatar_url && user.avatar_url.length > 50) {
+                if (user.avatar_url) {
                     if (!img) {
                         img = document.createElement('img');
                         img.style.width = '24px';
@@ -475,7 +651,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         if (svg) svg.replaceWith(img);
                         else sidebarLoginBtn.prepend(img);
                     }
-                    img.src = user.avatar_url;
+                    img.src = avatarSrc(user.avatar_url, 64);
                 }
             } else {
                 // Reset Sidebar
@@ -502,7 +678,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
             if (user) {
                 let img = btn.querySelector('img');
-                if (user.avatar_url && user.avatar_url.length > 50) {
+                if (user.avatar_url) {
                     if (!img) {
                         img = document.createElement('img');
                         // Styling for header profile image
@@ -516,7 +692,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     } else {
                         if (svg) svg.remove(); // specific cleanup
                     }
-                    img.src = user.avatar_url;
+                    img.src = avatarSrc(user.avatar_url, 64);
                 }
             } else {
                 // Reset Header Button
@@ -545,9 +721,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 welcomeMessage.innerText = `Welcome back, ${name}`;
 
                 if (welcomeAvatar) {
-                    if (user.avatar_url && user.avatar_url.length > 50) {
+                    if (user.avatar_url) {
                         welcomeAvatar.style.display = 'block';
-                        welcomeAvatar.querySelector('img').src = user.avatar_url;
+                        welcomeAvatar.querySelector('img').src = avatarSrc(user.avatar_url, 256);
                     } else {
                         welcomeAvatar.style.display = 'none';
                     }
@@ -606,9 +782,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     if (logoutBtn) {
         logoutBtn.addEventListener('click', () => {
-            localStorage.removeItem('access_token');
-            localStorage.removeItem('user');
-            updateUserInterface(null);
+            endSession();
             if (userMenu) userMenu.style.display = 'none';
         });
     }
@@ -637,13 +811,15 @@ document.addEventListener('DOMContentLoaded', () => {
                 // Send to Backend
                 fetch('/update_profile', {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
+                    headers: authHeaders(),
                     body: JSON.stringify({
-                        user_id: user.id,
                         full_name: updatedName
                     })
                 })
-                    .then(res => res.json())
+                    .then(res => {
+                        if (res.status === 401) endSession();
+                        return res.json();
+                    })
                     .then(data => {
                         console.log("Name updated on server:", data);
                     })
@@ -674,8 +850,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     const canvas = document.createElement('canvas');
                     const ctx = canvas.getContext('2d');
 
-                    // Resize to thumbnail
-                    const MAX_SIZE = 150; // Increased resolution slightly
+                    // Resize to the largest thumbnail size the server keeps
+                    const MAX_SIZE = 256;
                     let sourceX, sourceY, sourceWidth, sourceHeight;
 
                     // Calculate crop
@@ -707,15 +883,26 @@ document.addEventListener('DOMContentLoaded', () => {
                         localStorage.setItem('user', JSON.stringify(user));
                         updateUserInterface(user);
 
-                        // Send to Backend
+                        // Send to Backend; it answers with the short thumbnail URL to keep instead of the data URL
                         fetch('/update_profile', {
                             method: 'POST',
-                            headers: { 'Content-Type': 'application/json' },
+                            headers: authHeaders(),
                             body: JSON.stringify({
-                                user_id: user.id,
                                 avatar_url: dataUrl
                             })
-                        }).catch(err => console.error("Error updating profile:", err));
+                        })
+                            .then(res => {
+                                if (res.status === 401) endSession();
+                                return res.json();
+                            })
+                            .then(data => {
+                                if (data.avatar_url) {
+                                    user.avatar_url = data.avatar_url;
+                                    localStorage.setItem('user', JSON.stringify(user));
+                                    updateUserInterface(user);
+                                }
+                            })
+                            .catch(err => console.error("Error updating profile:", err));
                     }
                 };
                 img.src = event.target.result;
@@ -818,7 +1005,14 @@ document.addEventListener('DOMContentLoaded', () => {
             const payload = { email, password };
             if (!isLoginMode) {
                 payload.full_name = fullName;
-                payload.avatar_url = avatarUrl;
+                if (avatarUrl) {
+                    // The server only stores pictures for signed-in users; upload it after the first sign-in
+                    try {
+                        localStorage.setItem('pending_avatar', JSON.stringify({ email: email.trim().toLowerCase(), dataUrl: avatarUrl }));
+                    } catch (err) {
+                        console.error("Could not keep the avatar for later:", err);
+                    }
+                }
             }
 
             try {
@@ -840,6 +1034,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         if (data.user) {
                             localStorage.setItem('user', JSON.stringify(data.user));
                             updateUserInterface(data.user);
+                            uploadPendingAvatar(data.user);
                         }
 
                         setTimeout(() => {
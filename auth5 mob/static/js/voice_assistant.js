@@ -7,6 +7,8 @@ class VoiceAssistant {
         this.callbacks = callbacks || {};
         this.voices = [];
         this.currentUtterance = null;
+        this.streaming = false;
+        this.streamBuffer = '';
 
         // Bind methods
         this.toggle = this.toggle.bind(this);
@@ -166,6 +168,18 @@ class VoiceAssistant {
         const cleanedText = this.cleanText(text);
         console.log("VoiceAssistant: Preparing to speak:", cleanedText.substring(0, 50) + "...");
 
+        const utterance = this.createUtterance(cleanedText);
+
+        // Important: keep a reference to prevent garbage collection
+        this.currentUtterance = utterance;
+
+        // Use a small timeout to ensure cancel() has taken effect in some browsers
+        setTimeout(() => {
+            this.synthesis.speak(utterance);
+        }, 50);
+    }
+
+    createUtterance(cleanedText) {
         const utterance = new SpeechSynthesisUtterance(cleanedText);
 
         // Ensure voices are loaded
@@ -216,12 +230,39 @@ class VoiceAssistant {
             console.error("VoiceAssistant: Synthesis Error:", e);
         };
 
-        // Important: keep a reference to prevent garbage collection
-        this.currentUtterance = utterance;
+        return utterance;
+    }
 
-        // Use a small timeout to ensure cancel() has taken effect in some browsers
-        setTimeout(() => {
-            this.synthesis.speak(utterance);
-        }, 50);
+    // Streaming speech: start talking at the first complete sentence instead of waiting for the whole answer
+    startStream() {
+        if (!this.synthesis) return;
+        this.synthesis.cancel();
+        this.streamBuffer = '';
+        this.streaming = true;
+    }
+
+    pushStream(text) {
+        if (!this.streaming) return;
+        this.streamBuffer += text;
+
+        let match;
+        while ((match = this.streamBuffer.match(/^([\s\S]*?[.!?\n])\s+/))) {
+            this.enqueue(match[1]);
+            this.streamBuffer = this.streamBuffer.slice(match[0].length);
+        }
+    }
+
+    endStream() {
+        if (!this.streaming) return;
+        this.enqueue(this.streamBuffer);
+        this.streamBuffer = '';
+        this.streaming = false;
+    }
+
+    enqueue(text) {
+        const cleanedText = this.cleanText(text);
+        if (!this.synthesis || !cleanedText) return;
+        // speechSynthesis queues utterances itself, so sentences play back to back
+        this.synthesis.speak(this.createUtterance(cleanedText));
     }
 }
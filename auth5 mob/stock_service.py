@@ -1,40 +1,132 @@
-import requests
+from http_transport import get_transport
+from quota_scheduler import LastResults
+from resilience import GuardedTransport, UpstreamUnavailable, get_guard
+from datetime import datetime, timezone
 import os
+import time
+
+class AlphaVantageLimitError(Exception):
+    """Alpha Vantage answered with its call-frequency note instead of data."""
 
 class StockService:
-    def __init__(self, api_key):
+    def __init__(self, api_key, transport=None, scheduler=None, guard=None, last_results=None):
         self.api_key = api_key
-        self.base_url = "https://www.alphavantage.co/query"
+        self.base_url = os.getenv("ALPHA_VANTAGE_BASE_URL", "https://www.alphavantage.co").rstrip("/") + "/query"
+        self.guard = guard or get_guard("alphavantage")
+        self.http = GuardedTransport(transport or get_transport(), self.guard)
+        # Optional quota_scheduler.QuotaScheduler enforcing the calls-per-minute/day budget
+        self.scheduler = scheduler
+        # Last good quote/news text per symbol, served when the budget runs out
+        self.last_results = last_results or LastResults()
+
+    def _query(self, parameters):
+        response = self.http.get(self.base_url, params=parameters)
+        response.raise_for_status()
+        data = response.json()
+        # Over the limit, Alpha Vantage returns 200 with only a "Note"/"Information" message
+        if "Note" in data or ("Information" in data and len(data) == 1):
+            if self.scheduler:
+                self.scheduler.bucket.drain()
+            raise AlphaVantageLimitError(data.get("Note") or data.get("Information"))
+        return data
+
+    def _cached(self, key, reason="live data is rate-limited right now"):
+        """Last good answer for `key` when we can't spend a call on it, or None."""
+        cached = self.last_results.get(key)
+        if cached is None:
+            return None
+        text, fetched_at = cached
+        if self.scheduler:
+            self.scheduler.record_stale()
+        return f"{text}\n_(Cached from {time.strftime('%H:%M', time.localtime(fetched_at))} — {reason}.)_"
 
     def get_stock_price(self, symbol):
         """Fetches the latest price for a given stock symbol (e.g., AAPL, TSLA)."""
         if not self.api_key:
             return "Alpha Vantage API key not configured."
 
+        symbol = symbol.upper()
+        if self.scheduler and not self.scheduler.acquire():
+            return self._cached(f"quote:{symbol}") or "⚠️ The stock data quota is used up for now. Please try again in a minute."
+
         parameters = {
             "function": "GLOBAL_QUOTE",
-            "symbol": symbol.upper(),
+            "symbol": symbol,
             "apikey": self.api_key
         }
 
         try:
-            response = requests.get(self.base_url, params=parameters)
-            response.raise_for_status()
-            data = response.json()
+            data = self._query(parameters)
             
             if "Global Quote" in data and data["Global Quote"]:
                 quote = data["Global Quote"]
                 price = float(quote["05. price"])
                 change_percent = quote["10. change percent"]
-                return f"The current price of {symbol.upper()} is ${price:,.2f} ({change_percent})."
+                text = f"The current price of {symbol} is ${price:,.2f} ({change_percent})."
+                self.last_results.put(f"quote:{symbol}", text)
+                return text
             else:
-                return f"Sorry, I couldn't find stock data for {symbol.upper()}. Please check the symbol."
+                return f"Sorry, I couldn't find stock data for {symbol}. Please check the symbol."
+        except AlphaVantageLimitError as e:
+            print(f"Alpha Vantage limit reached: {e}")
+            return self._cached(f"quote:{symbol}") or "⚠️ The stock data quota is used up for now. Please try again in a minute."
+        except UpstreamUnavailable:
+            return (self._cached(f"quote:{symbol}", "stock data is temporarily unavailable")
+                    or "⚠️ Stock data is temporarily unavailable. Please try again in a minute.")
         except Exception as e:
             print(f"Error fetching stock price: {e}")
-            return f"Error fetching stock data for {symbol.upper()}."
+            return f"Error fetching stock data for {symbol}."
+
+    def fetch_market_news(self, symbol=None, since=None, limit=50, deadline=None, reserve=0):
+        """
+        Raw NEWS_SENTIMENT articles for news_aggregator.NewsAggregator, as
+        {"title", "url", "source", "description", "published_at"} dicts,
+        only those published from `since` (a timestamp) on when given.
+        Raises AlphaVantageLimitError when the call budget (keeping `reserve`
+        daily calls) is spent, and ValueError when no API key is configured.
+        """
+        if not self.api_key:
+            raise ValueError("Alpha Vantage API key not configured.")
+        if self.scheduler and not self.scheduler.acquire(deadline, reserve=reserve):
+            raise AlphaVantageLimitError("market news budget used up")
+
+        parameters = {
+            "function": "NEWS_SENTIMENT",
+            "sort": "LATEST",
+            "limit": limit,
+            "apikey": self.api_key
+        }
+        if symbol:
+            parameters["tickers"] = symbol.upper()
+        if since:
+            parameters["time_from"] = datetime.fromtimestamp(since, timezone.utc).strftime("%Y%m%dT%H%M")
+
+        return [
+            {
+                "title": article["title"],
+                "url": article.get("url"),
+                "source": article.get("source") or "Unknown",
+                "description": article.get("summary"),
+                "published_at": self._timestamp(article.get("time_published"))
+            }
+            for article in self._query(parameters).get("feed", [])
+            if article.get("title")
+        ]
+
+    @staticmethod
+    def _timestamp(time_published):
+        # "20240501T123000", in UTC; None when missing or malformed
+        try:
+            return datetime.strptime(time_published, "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            return None
 
     def get_market_news(self, symbol=None):
         """Fetches market news, optionally filtered by symbol."""
+        key = symbol.upper() if symbol else ""
+        if self.scheduler and not self.scheduler.acquire():
+            return self._cached(f"news:{key}") or "⚠️ The market news quota is used up for now. Please try again in a minute."
+
         parameters = {
             "function": "NEWS_SENTIMENT",
             "apikey": self.api_key
@@ -43,18 +135,23 @@ class StockService:
             parameters["tickers"] = symbol.upper()
 
         try:
-            response = requests.get(self.base_url, params=parameters)
-            response.raise_for_status()
-            data = response.json()
+            data = self._query(parameters)
             
             if "feed" in data:
                 articles = data["feed"][:3]
                 news_text = "Latest Stock Market News:\n"
                 for article in articles:
                     news_text += f"- {article['title']} ({article['source']})\n"
+                self.last_results.put(f"news:{key}", news_text)
                 return news_text
             else:
                 return "No recent market news found."
+        except AlphaVantageLimitError as e:
+            print(f"Alpha Vantage limit reached: {e}")
+            return self._cached(f"news:{key}") or "⚠️ The market news quota is used up for now. Please try again in a minute."
+        except UpstreamUnavailable:
+            return (self._cached(f"news:{key}", "market news is temporarily unavailable")
+                    or "⚠️ Market news is temporarily unavailable. Please try again in a minute.")
         except Exception as e:
             print(f"Error fetching market news: {e}")
             return "Error fetching market news."
@@ -0,0 +1,69 @@
+import os
+import threading
+
+# Bump the version when the wording changes, rather than editing a template in place:
+# the text is the prefix providers cache, and the response cache keys on it too.
+TEMPLATES = {
+    "1": (
+        "You are {name}, a powerful AI assistant with advanced multimodal capabilities. "
+        "You CAN generate images, videos, and search YouTube. "
+        "If a user asks for an image, tell them you are generating it. "
+        "If a user asks for a video, tell them you are generating it. "
+        "If a user asks to find a YouTube video or trending videos, tell them you are looking for them. "
+        "You should also mention that you can animate images if they attach one. "
+        "Return your response in JSON format with exactly two keys: "
+        "'response' (your helpful text) and 'emotion' (one word describing user's mood, e.g., Happy, Neutral, Sad)."
+    ),
+}
+
+SYSTEM_PROMPT_VERSION = os.getenv("SYSTEM_PROMPT_VERSION", "1")
+
+
+def render(version=None, name="GlobleXGPT"):
+    """The system prompt text for a template version (default: SYSTEM_PROMPT_VERSION)."""
+    version = version or SYSTEM_PROMPT_VERSION
+    if version not in TEMPLATES:
+        raise ValueError(f"Unknown system prompt version: {version}")
+    return TEMPLATES[version].format(name=name)
+
+
+# Rendered once; every chat client sends exactly these bytes, so it stays a cacheable prefix
+SYSTEM_INSTRUCTION = render()
+
+
+class PromptUsage:
+    """
+    Token accounting for one chat client: prompt, cached, cache-write and
+    completion tokens as reported by the provider, plus time to first token
+    split by whether the provider served part of the prompt from its cache.
+    For non-streamed calls the first token is the whole response.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "calls_with_cache_hit": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                         "cache_write_tokens": 0, "completion_tokens": 0}
+        self.first_token = {"hit": [0, 0.0], "miss": [0, 0.0]}  # [calls, total seconds]
+
+    def record(self, prompt_tokens=0, cached_tokens=0, cache_write_tokens=0, completion_tokens=0, first_token=None):
+        with self.lock:
+            self.counters["calls"] += 1
+            self.counters["calls_with_cache_hit"] += int(cached_tokens > 0)
+            self.counters["prompt_tokens"] += prompt_tokens
+            self.counters["cached_tokens"] += cached_tokens
+            self.counters["cache_write_tokens"] += cache_write_tokens
+            self.counters["completion_tokens"] += completion_tokens
+            if first_token is not None:
+                totals = self.first_token["hit" if cached_tokens else "miss"]
+                totals[0] += 1
+                totals[1] += first_token
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            first_token = {kind: list(totals) for kind, totals in self.first_token.items()}
+        stats["system_prompt_version"] = SYSTEM_PROMPT_VERSION
+        stats["cached_share"] = round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else 0.0
+        for kind, (calls, seconds) in first_token.items():
+            stats[f"first_token_ms_cache_{kind}"] = round(seconds / calls * 1000, 1) if calls else None
+        return stats
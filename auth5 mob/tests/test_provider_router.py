@@ -0,0 +1,219 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from provider_router import AsyncProviderRouter, ProviderRouter
+
+
+class FakeProvider:
+    """Local stand-in for an LLM client: answers after `delay`, or fails with `failure`."""
+
+    def __init__(self, name, delay=0.0, failure=None, words=3, gap=0.0):
+        self.name = name
+        self.delay = delay
+        self.failure = failure
+        self.words = words
+        self.gap = gap
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.pulled = 0  # stream events handed to the router
+        self.closed = 0  # streams that ended early because the router stopped reading
+
+    def _start(self):
+        with self.lock:
+            self.calls += 1
+
+    def _error(self):
+        return {"response": f"API Error {self.failure.get('status')} from {self.name}", "emotion": "Neutral",
+                "failure": self.failure}
+
+    def fetch_full_response(self, prompt, file_data=None, history=None):
+        self._start()
+        time.sleep(self.delay)
+        if self.failure:
+            return self._error(), False
+        return {"response": self.name, "emotion": "Neutral"}, True
+
+    def stream_full_response(self, prompt, file_data=None, history=None):
+        self._start()
+        time.sleep(self.delay)
+        if self.failure:
+            yield "error", self._error()
+            return
+        finished = False
+        try:
+            for _ in range(self.words):
+                self.pulled += 1
+                yield "delta", f"{self.name} "
+                time.sleep(self.gap)
+            finished = True
+            yield "done", {"response": self.name, "emotion": "Neutral"}
+        finally:
+            if not finished:
+                self.closed += 1
+
+
+class AsyncFakeProvider(FakeProvider):
+    async def fetch_full_response(self, prompt, file_data=None, history=None):
+        self._start()
+        await asyncio.sleep(self.delay)
+        if self.failure:
+            return self._error(), False
+        return {"response": self.name, "emotion": "Neutral"}, True
+
+    async def stream_full_response(self, prompt, file_data=None, history=None):
+        self._start()
+        await asyncio.sleep(self.delay)
+        if self.failure:
+            yield "error", self._error()
+            return
+        finished = False
+        try:
+            for _ in range(self.words):
+                self.pulled += 1
+                yield "delta", f"{self.name} "
+                await asyncio.sleep(self.gap)
+            finished = True
+            yield "done", {"response": self.name, "emotion": "Neutral"}
+        finally:
+            if not finished:
+                self.closed += 1
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_fast_primary_is_not_hedged():
+    primary, backup = FakeProvider("primary", delay=0.01), FakeProvider("backup")
+    router = ProviderRouter([primary, backup], hedge_default=1.0)
+
+    assert router.fetch_full_response("hi") == ({"response": "primary", "emotion": "Neutral"}, True)
+    assert router.stats()["hedged"] == 0
+    assert backup.calls == 0
+
+
+def test_primary_slower_than_its_p95_is_hedged():
+    primary, backup = FakeProvider("primary", delay=1.0), FakeProvider("backup", delay=0.01)
+    # hedge_default is far off, so a hedge after ~50 ms can only come from the primary's own p95
+    router = ProviderRouter([primary, backup], hedge_default=10.0, hedge_min=0.01)
+    router.health[id(primary)].latencies.extend([0.05] * 20)
+
+    start = time.perf_counter()
+    result, ok = router.fetch_full_response("hi")
+
+    assert (result["response"], ok) == ("backup", True)
+    assert time.perf_counter() - start < 0.5
+    stats = router.stats()
+    assert stats["hedged"] == 1
+    assert stats["providers"]["backup"]["hedges_won"] == 1
+
+
+def test_hedged_stream_keeps_the_first_answer_and_stops_the_loser():
+    # The primary starts answering only after the backup has won, then would keep streaming
+    primary = FakeProvider("primary", delay=0.3, words=50, gap=0.01)
+    backup = FakeProvider("backup", delay=0.0, words=3)
+    router = ProviderRouter([primary, backup], hedge_default=0.05, hedge_min=0.01)
+
+    events = list(router.stream_full_response("hi"))
+
+    assert events[-1] == ("done", {"response": "backup", "emotion": "Neutral"})
+    assert all(payload == "backup " for kind, payload in events if kind == "delta")
+    assert router.stats()["providers"]["backup"]["hedges_won"] == 1
+    # The primary's pump gives up at its next event instead of draining all 50
+    assert wait_for(lambda: primary.closed == 1)
+    assert primary.pulled <= 2
+
+
+def test_stream_consumer_leaving_stops_the_provider():
+    provider = FakeProvider("primary", words=50, gap=0.01)
+    router = ProviderRouter([provider], hedge_default=1.0)
+
+    stream = router.stream_full_response("hi")
+    assert next(stream) == ("delta", "primary ")
+    stream.close()
+
+    assert wait_for(lambda: provider.closed == 1)
+    assert provider.pulled < 10
+
+
+def test_primary_failure_fails_over_immediately():
+    primary = FakeProvider("primary", failure={"status": 503})
+    backup = FakeProvider("backup")
+    router = ProviderRouter([primary, backup], hedge_default=10.0)
+
+    start = time.perf_counter()
+    assert router.fetch_full_response("hi")[0]["response"] == "backup"
+    assert time.perf_counter() - start < 1.0
+    assert router.stats()["failovers"] == 1
+
+
+@pytest.mark.parametrize("failure", [{"status": 503}, {"status": 429}, {"error": "timeout"}])
+def test_consecutive_provider_faults_eject_until_the_cooldown_ends(failure):
+    primary = FakeProvider("primary", failure=failure)
+    backup = FakeProvider("backup")
+    router = ProviderRouter([primary, backup], hedge_default=10.0, eject_after=3, eject_seconds=0.3)
+
+    for _ in range(3):
+        assert router.fetch_full_response("hi")[0]["response"] == "backup"
+    assert primary.calls == 3
+    assert router.stats()["providers"]["primary"]["ejections"] == 1
+
+    # Ejected: requests go straight to the backup
+    router.fetch_full_response("hi")
+    assert primary.calls == 3
+
+    # Re-admitted after the cooldown, and it gets live traffic again
+    time.sleep(0.35)
+    primary.failure = None
+    assert router.fetch_full_response("hi")[0]["response"] == "primary"
+    assert primary.calls == 4
+    assert router.stats()["providers"]["primary"]["consecutive_failures"] == 0
+
+
+def test_streamed_faults_eject_too():
+    primary = FakeProvider("primary", failure={"status": 500})
+    backup = FakeProvider("backup")
+    router = ProviderRouter([primary, backup], hedge_default=10.0, eject_after=2, eject_seconds=30)
+
+    for _ in range(2):
+        assert list(router.stream_full_response("hi"))[-1][0] == "done"
+    list(router.stream_full_response("hi"))
+
+    assert primary.calls == 2
+    assert router.stats()["providers"]["primary"]["ejections"] == 1
+
+
+def test_request_errors_do_not_eject():
+    # A 400 is about this request (e.g. an attachment the model can't read), not the provider
+    primary = FakeProvider("primary", failure={"status": 400})
+    backup = FakeProvider("backup")
+    router = ProviderRouter([primary, backup], hedge_default=10.0, eject_after=2, eject_seconds=30)
+
+    for _ in range(5):
+        router.fetch_full_response("hi")
+
+    assert primary.calls == 5
+    assert router.stats()["providers"]["primary"]["ejections"] == 0
+
+
+def test_async_hedged_stream_cancels_the_loser():
+    primary = AsyncFakeProvider("primary", delay=0.3, words=50, gap=0.01)
+    backup = AsyncFakeProvider("backup", words=3)
+    router = AsyncProviderRouter([primary, backup], hedge_default=0.05, hedge_min=0.01)
+
+    async def run():
+        events = [event async for event in router.stream_full_response("hi")]
+        await asyncio.sleep(0.4)  # long enough for an uncancelled primary to start streaming
+        return events
+
+    events = asyncio.run(run())
+
+    assert events[-1] == ("done", {"response": "backup", "emotion": "Neutral"})
+    assert primary.pulled == 0
+    assert router.stats()["hedged"] == 1
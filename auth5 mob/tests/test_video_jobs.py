@@ -0,0 +1,135 @@
+import time
+from types import SimpleNamespace
+
+from runway_client import RunwayClient
+from video_jobs import VideoJobPoller, VideoJobStore
+
+
+class FakeTasks:
+    """Stands in for the RunwayML SDK's `tasks`: retrieve() replays each task's scripted states."""
+
+    def __init__(self):
+        self.states = {}
+        self.retrieved = []
+
+    def retrieve(self, task_id):
+        self.retrieved.append(task_id)
+        states = self.states[task_id]
+        # Stay on the last state once the script runs out
+        return states.pop(0) if len(states) > 1 else states[0]
+
+
+class FakeRunwaySDK:
+    def __init__(self):
+        self.tasks = FakeTasks()
+        self.created = 0
+        self.text_to_video = SimpleNamespace(create=self._create)
+
+    def _create(self, **arguments):
+        self.created += 1
+        return SimpleNamespace(id=f"task-{self.created}")
+
+
+def task(status, progress=None, output=None, failure=None):
+    return SimpleNamespace(status=status, progress=progress, output=output, failure=failure)
+
+
+def make_poller(path, sdk, **options):
+    return VideoJobPoller(RunwayClient("test-key", client=sdk), VideoJobStore(str(path)), **options)
+
+
+def test_succeeded_job_stores_the_output_url(tmp_path):
+    sdk = FakeRunwaySDK()
+    poller = make_poller(tmp_path / "jobs.db", sdk, min_interval=1.0)
+    job_id = poller.submit("a cat surfing")
+    sdk.tasks.states["task-1"] = [
+        task("RUNNING", progress=0.5),
+        task("SUCCEEDED", output=["https://cdn.example/cat.mp4"]),
+    ]
+
+    now = time.time() + 1.0
+    assert poller.poll_once(now=now) == 1.0
+    assert poller.store.get(job_id)["progress"] == 0.5
+
+    assert poller.poll_once(now=now + 1.0) is None
+    job = poller.store.get(job_id)
+    assert (job["status"], job["progress"], job["video_url"]) == ("SUCCEEDED", 1.0, "https://cdn.example/cat.mp4")
+    assert poller.store.in_flight() == []
+
+
+def test_failed_job_keeps_the_runway_error(tmp_path):
+    sdk = FakeRunwaySDK()
+    poller = make_poller(tmp_path / "jobs.db", sdk)
+    job_id = poller.submit("a cat surfing")
+    sdk.tasks.states["task-1"] = [task("FAILED", failure="Content moderation")]
+
+    poller.poll_once(now=time.time() + 5)
+
+    job = poller.store.get(job_id)
+    assert (job["status"], job["error"], job["video_url"]) == ("FAILED", "Content moderation", None)
+
+
+def test_idle_job_backs_off_and_is_failed_after_max_age(tmp_path):
+    sdk = FakeRunwaySDK()
+    poller = make_poller(tmp_path / "jobs.db", sdk, min_interval=2.0, max_interval=5.0, backoff=2.0, max_age=60.0)
+    job_id = poller.submit("a cat surfing")
+    sdk.tasks.states["task-1"] = [task("RUNNING", progress=0.1)]
+
+    start = time.time() + 2.0
+    assert poller.poll_once(now=start) == 2.0  # progress moved: back to the minimum
+    assert poller.poll_once(now=start + 2.0) == 4.0  # no news: interval doubles
+    assert poller.poll_once(now=start + 6.0) == 5.0  # ...up to max_interval
+
+    calls = len(sdk.tasks.retrieved)
+    assert poller.poll_once(now=start + 61.0) is None
+    job = poller.store.get(job_id)
+    assert (job["status"], job["error"]) == ("FAILED", "Video generation timed out")
+    # Given up without asking Runway again
+    assert len(sdk.tasks.retrieved) == calls
+
+
+def test_status_lookup_errors_back_off_until_max_age(tmp_path):
+    sdk = FakeRunwaySDK()
+    poller = make_poller(tmp_path / "jobs.db", sdk, min_interval=2.0, backoff=2.0, max_age=60.0)
+    job_id = poller.submit("a cat surfing")
+    # No scripted state: retrieve() raises and get_task_status() returns None
+
+    start = time.time() + 2.0
+    assert poller.poll_once(now=start) == 4.0
+    assert poller.store.get(job_id)["status"] == "PENDING"
+
+    poller.poll_once(now=start + 61.0)
+    assert poller.store.get(job_id)["status"] == "FAILED"
+
+
+def test_new_poller_resumes_in_flight_jobs_after_restart(tmp_path):
+    path = tmp_path / "jobs.db"
+    sdk = FakeRunwaySDK()
+    before = make_poller(path, sdk)
+    job_id = before.submit("a cat surfing")
+    sdk.tasks.states["task-1"] = [task("RUNNING", progress=0.3)]
+    before.poll_once(now=time.time() + 2.0)
+    before.store.conn.close()
+
+    # "Restart": a fresh store and poller on the same file pick the job up
+    sdk.tasks.states["task-1"] = [task("SUCCEEDED", output=["https://cdn.example/cat.mp4"])]
+    after = make_poller(path, sdk)
+    resumed = after.store.in_flight()
+    assert [(job["id"], job["task_id"], job["progress"]) for job in resumed] == [(job_id, "task-1", 0.3)]
+
+    after.poll_once(now=time.time() + 10.0)
+    assert after.store.get(job_id)["video_url"] == "https://cdn.example/cat.mp4"
+
+
+def test_background_thread_finishes_jobs_and_wakes_waiters(tmp_path):
+    sdk = FakeRunwaySDK()
+    poller = make_poller(tmp_path / "jobs.db", sdk, min_interval=0.01)
+    sdk.tasks.states["task-1"] = [task("SUCCEEDED", output=["https://cdn.example/cat.mp4"])]
+    poller.start()
+    try:
+        job_id = poller.submit("a cat surfing")
+        job = poller.store.wait_for_change(job_id, since=time.time(), timeout=5)
+    finally:
+        poller.stop()
+
+    assert job["status"] == "SUCCEEDED"
@@ -0,0 +1,253 @@
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+
+from http_transport import get_transport
+
+try:
+    import jwt
+    HAS_JWT = True
+except ImportError:
+    HAS_JWT = False
+
+EXPIRED = "Your session has expired. Please log in again."
+INVALID = "Your sign-in is not valid. Please log in again."
+
+_user = contextvars.ContextVar("auth_user", default=None)
+
+
+def set_user(user):
+    """Attaches the verified user (or None when anonymous) to this request/thread."""
+    _user.set(user)
+
+
+def current_user():
+    return _user.get()
+
+
+class AuthError(Exception):
+    """A bearer token that can't be accepted; the message is shown to the user."""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+class SigningKeys:
+    """
+    The Supabase project's JWT signing keys.
+
+    Projects on the legacy shared secret sign access tokens with HS256 and
+    `secret`; projects with asymmetric signing keys publish them at
+    /auth/v1/.well-known/jwks.json. The JWKS is fetched once at startup and
+    refreshed every `refresh` seconds on a daemon thread, and again when a
+    token names a key id that isn't known yet (the project rotated its keys),
+    at most once every `min_refetch` seconds so junk key ids can't hammer
+    Supabase.
+    """
+
+    def __init__(self, jwks_url=None, secret=None, api_key=None, refresh=600, min_refetch=30):
+        self.jwks_url = jwks_url
+        self.secret = secret
+        self.api_key = api_key
+        self.refresh = refresh
+        self.min_refetch = min_refetch
+        self.keys = {}  # kid -> jwt.PyJWK
+        self.fetched_at = None
+        self.attempted_at = 0.0
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.refresher = None
+        self.counters = {"fetches": 0, "fetch_errors": 0, "unknown_kid_fetches": 0, "keys_removed": 0}
+
+    def start(self):
+        """Fetches the JWKS and starts the refresher; returns self so it can be a ServiceRegistry factory."""
+        if not self.jwks_url:
+            return self
+        with self.lock:
+            if self.refresher:
+                return self
+            self.refresher = threading.Thread(target=self._run, daemon=True, name="jwks-refresh")
+        self.fetch()
+        self.refresher.start()
+        return self
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh)
+            self.fetch()
+
+    def fetch(self):
+        """Replaces the cached keys with the published ones. Returns False if it didn't (or couldn't) fetch."""
+        with self.fetch_lock:
+            if time.time() - self.attempted_at < self.min_refetch:
+                return False
+            self.attempted_at = time.time()
+            headers = {"apikey": self.api_key} if self.api_key else {}
+            try:
+                response = get_transport().get(self.jwks_url, headers=headers, timeout=5)
+                response.raise_for_status()
+                published = response.json().get("keys", [])
+            except Exception as e:
+                print(f"Error fetching Supabase signing keys: {e}")
+                with self.lock:
+                    self.counters["fetch_errors"] += 1
+                return False
+            keys = {}
+            for jwk in published:
+                try:
+                    keys[jwk["kid"]] = jwt.PyJWK(jwk)
+                except (KeyError, jwt.PyJWTError) as e:
+                    print(f"Skipping unusable signing key {jwk.get('kid')}: {e}")
+            with self.lock:
+                self.counters["fetches"] += 1
+                self.counters["keys_removed"] += len(set(self.keys) - set(keys))
+                self.keys = keys
+                self.fetched_at = time.time()
+            return True
+
+    def key_for(self, header):
+        """(key, algorithm) to check a token with the given header, or AuthError."""
+        algorithm = header.get("alg")
+        if algorithm == "HS256":
+            if not self.secret:
+                raise AuthError(INVALID, "unsupported_algorithm")
+            return self.secret, algorithm
+        kid = header.get("kid")
+        key = self.keys.get(kid)
+        if key is None and self.jwks_url and kid:
+            # Probably signed with a key published after our last fetch
+            with self.lock:
+                self.counters["unknown_kid_fetches"] += 1
+            self.fetch()
+            key = self.keys.get(kid)
+        if key is None:
+            raise AuthError(INVALID, "unknown_key")
+        if key.algorithm_name != algorithm:
+            raise AuthError(INVALID, "unsupported_algorithm")
+        return key.key, algorithm
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["keys"] = len(self.keys)
+            stats["age_seconds"] = int(time.time() - self.fetched_at) if self.fetched_at else None
+        stats["shared_secret"] = bool(self.secret)
+        return stats
+
+
+class TokenVerifier:
+    """
+    Verifies Supabase access tokens locally: signature, expiry, audience and issuer.
+
+    Checking a token through supabase.auth.get_user() is a network round trip
+    per request; decoding it here costs a signature check, and the result is
+    kept in a small LRU keyed by the token so the next request with the same
+    token is a dictionary lookup. Entries are dropped at the token's expiry
+    and ignored once the key that signed them is no longer published.
+    """
+
+    def __init__(self, keys, audience="authenticated", issuer=None, leeway=30, cache_size=4096):
+        self.keys = keys
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # token -> (user, expires_at, kid)
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "verified": 0, "evicted": 0}
+        self.rejected = {}  # reason -> count
+
+    @staticmethod
+    def bearer(header):
+        """The token from an Authorization header; None if there is no header."""
+        if not header:
+            return None
+        scheme, _, token = header.partition(" ")
+        if scheme.lower() != "bearer" or not token.strip():
+            raise AuthError(INVALID, "malformed")
+        return token.strip()
+
+    def authenticate(self, header):
+        """The user for an Authorization header, None without one, or AuthError."""
+        token = self.bearer(header)
+        return self.verify(token) if token else None
+
+    def cached(self, header):
+        """The user if the header's token is already verified, without doing any work otherwise."""
+        try:
+            token = self.bearer(header)
+        except AuthError:
+            return None
+        return token and self._lookup(token)
+
+    def _lookup(self, token):
+        with self.lock:
+            entry = self.cache.get(token)
+            if entry is None:
+                return None
+            user, expires_at, kid = entry
+            if expires_at <= time.time() or (kid is not None and kid not in self.keys.keys):
+                del self.cache[token]
+                return None
+            self.cache.move_to_end(token)
+            self.counters["hits"] += 1
+            return user
+
+    def verify(self, token):
+        user = self._lookup(token)
+        if user is not None:
+            return user
+        with self.lock:
+            self.counters["misses"] += 1
+        try:
+            header = jwt.get_unverified_header(token)
+            key, algorithm = self.keys.key_for(header)
+            claims = jwt.decode(
+                token, key, algorithms=[algorithm], audience=self.audience, issuer=self.issuer,
+                leeway=self.leeway, options={"require": ["exp", "sub"]}
+            )
+        except AuthError as e:
+            self._reject(e.reason)
+            raise
+        except jwt.ExpiredSignatureError:
+            self._reject("expired")
+            raise AuthError(EXPIRED, "expired")
+        except jwt.InvalidAudienceError:
+            self._reject("audience")
+            raise AuthError(INVALID, "audience")
+        except jwt.InvalidIssuerError:
+            self._reject("issuer")
+            raise AuthError(INVALID, "issuer")
+        except jwt.InvalidSignatureError:
+            self._reject("signature")
+            raise AuthError(INVALID, "signature")
+        except jwt.PyJWTError:
+            self._reject("malformed")
+            raise AuthError(INVALID, "malformed")
+
+        user = {"id": claims["sub"], "email": claims.get("email"), "role": claims.get("role"),
+                "session_id": claims.get("session_id")}
+        with self.lock:
+            self.counters["verified"] += 1
+            self.cache[token] = (user, claims["exp"], header.get("kid") if algorithm != "HS256" else None)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+                self.counters["evicted"] += 1
+        return user
+
+    def _reject(self, reason):
+        with self.lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def stats(self):
+        """Verified-token LRU hit ratio, rejections by reason, and the signing key cache."""
+        with self.lock:
+            stats = dict(self.counters)
+            stats["rejected"] = dict(self.rejected)
+            stats["cached_tokens"] = len(self.cache)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["signing_keys"] = self.keys.stats()
+        return stats
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with time-to-live and stale-while-revalidate.
+
+    get(key, loader) serves fresh entries from memory. Entries older than `ttl`
+    but younger than `ttl + stale_ttl` are still served immediately while one
+    background thread reloads them. Anything older is loaded synchronously.
+
+    The loader returns (value, kind): kind "ok" caches for `ttl`, "negative"
+    caches for `negative_ttl` (e.g. unknown cities), and None means the value
+    must not be cached (e.g. a network error). aget() is the same for an async
+    loader, refreshing in a task instead of a thread.
+    """
+
+    def __init__(self, maxsize=256, ttl=600, stale_ttl=1800, negative_ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # key -> (value, expires_at, negative)
+        self.refreshing = set()
+        self.tasks = set()  # keeps background refresh tasks referenced until they finish
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "stale_hits": 0, "negative_hits": 0, "misses": 0, "refreshes": 0, "evictions": 0}
+
+    def _lookup(self, key):
+        """Returns (found, value, refresh); refresh means the caller must reload the stale entry in the background."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                value, expires_at, negative = entry
+                if now < expires_at:
+                    self.entries.move_to_end(key)
+                    self.counters["negative_hits" if negative else "hits"] += 1
+                    return True, value, False
+                if not negative and now < expires_at + self.stale_ttl:
+                    self.entries.move_to_end(key)
+                    self.counters["stale_hits"] += 1
+                    refresh = key not in self.refreshing
+                    self.refreshing.add(key)
+                    return True, value, refresh
+            self.counters["misses"] += 1
+        return False, None, False
+
+    def get(self, key, loader):
+        found, value, refresh = self._lookup(key)
+        if refresh:
+            threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+        if found:
+            return value
+
+        value, kind = loader()
+        self._store(key, value, kind)
+        return value
+
+    async def aget(self, key, loader):
+        found, value, refresh = self._lookup(key)
+        if refresh:
+            task = asyncio.ensure_future(self._arefresh(key, loader))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        if found:
+            return value
+
+        value, kind = await loader()
+        self._store(key, value, kind)
+        return value
+
+    def _refresh(self, key, loader):
+        try:
+            self._refreshed(key, *loader())
+        except Exception as e:
+            print(f"Error refreshing cache entry {key}: {e}")
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    async def _arefresh(self, key, loader):
+        try:
+            self._refreshed(key, *(await loader()))
+        except Exception as e:
+            print(f"Error refreshing cache entry {key}: {e}")
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def _refreshed(self, key, value, kind):
+        self._store(key, value, kind)
+        with self.lock:
+            self.counters["refreshes"] += 1
+
+    def _store(self, key, value, kind):
+        if kind not in ("ok", "negative"):
+            return
+        negative = kind == "negative"
+        expires_at = time.time() + (self.negative_ttl if negative else self.ttl)
+        with self.lock:
+            self.entries[key] = (value, expires_at, negative)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def peek(self, key):
+        """Returns the stored value even if it has expired, or None. Doesn't count as a lookup."""
+        with self.lock:
+            entry = self.entries.get(key)
+        return entry[0] if entry and not entry[2] else None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, size=len(self.entries), maxsize=self.maxsize)
+        lookups = stats["hits"] + stats["stale_hits"] + stats["negative_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        return stats
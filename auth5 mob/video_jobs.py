@@ -0,0 +1,198 @@
+import sqlite3
+import threading
+import time
+import uuid
+
+FINISHED = ("SUCCEEDED", "FAILED", "CANCELLED")
+
+
+class VideoJobStore:
+    """Video generation jobs in a small local SQLite file, so in-flight jobs survive a restart."""
+
+    def __init__(self, path="video_jobs.db"):
+        self.path = path
+        self.lock = threading.RLock()
+        # Signalled on every job update, so long-polling requests can wake up
+        self.changed = threading.Condition(self.lock)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS video_jobs (
+                id TEXT PRIMARY KEY,
+                task_id TEXT,
+                prompt TEXT,
+                status TEXT NOT NULL,
+                progress REAL DEFAULT 0,
+                video_url TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                next_poll_at REAL NOT NULL,
+                poll_interval REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def create(self, task_id, prompt, poll_interval):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO video_jobs (id, task_id, prompt, status, created_at, updated_at, next_poll_at, poll_interval) "
+                "VALUES (?, ?, ?, 'PENDING', ?, ?, ?, ?)",
+                (job_id, task_id, prompt, now, now, now + poll_interval, poll_interval)
+            )
+            self.conn.commit()
+            self.changed.notify_all()
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM video_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self.lock:
+            self.conn.execute(f"UPDATE video_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self.conn.commit()
+            self.changed.notify_all()
+
+    def reschedule(self, job_id, poll_interval, next_poll_at):
+        """Records the next poll time without counting it as a job update."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE video_jobs SET poll_interval = ?, next_poll_at = ? WHERE id = ?",
+                (poll_interval, next_poll_at, job_id)
+            )
+            self.conn.commit()
+
+    def in_flight(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM video_jobs WHERE status NOT IN (?, ?, ?) ORDER BY next_poll_at", FINISHED
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def wait_for_change(self, job_id, since, timeout):
+        """Blocks until the job is updated after `since` or finishes, or the timeout passes."""
+        deadline = time.time() + timeout
+        with self.changed:
+            while True:
+                job = self.get(job_id)
+                if not job or job["status"] in FINISHED or job["updated_at"] > since:
+                    return job
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return job
+                self.changed.wait(remaining)
+
+
+class VideoJobPoller:
+    """
+    One background thread that checks every in-flight Runway task.
+
+    Each job keeps its own poll interval: it starts at `min_interval`, grows by
+    `backoff` every time the task reports no new progress (up to `max_interval`)
+    and drops back to the minimum when progress moves, so a batch of long
+    renders costs a handful of cheap status calls instead of one sleeping
+    request thread per video. A job still unfinished `max_age` seconds after it
+    was created (a task that never completes, or status lookups that keep
+    failing) is marked FAILED, so clients waiting on it get an answer.
+    """
+
+    def __init__(self, runway_client, store, min_interval=2.0, max_interval=20.0, backoff=1.5, max_age=1800.0):
+        self.runway = runway_client
+        self.store = store
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_age = max_age
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="video-job-poller", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+
+    def submit(self, prompt, image_url=None):
+        """Starts a Runway task and returns the job id, or None if the task could not be created."""
+        task_id = self.runway.start_video(prompt, image_url=image_url)
+        if not task_id:
+            return None
+        return self.track(task_id, prompt)
+
+    def track(self, task_id, prompt):
+        """Starts following a Runway task created elsewhere (e.g. by the async client). Returns the job id."""
+        job_id = self.store.create(task_id, prompt, self.min_interval)
+        self.wakeup.set()
+        return job_id
+
+    def poll_once(self, now=None):
+        """Polls every due job once. Returns the number of seconds until the next job is due."""
+        now = now or time.time()
+        next_due = None
+        for job in self.store.in_flight():
+            if job["next_poll_at"] <= now:
+                job = self._poll(job, now)
+                if job is None:
+                    continue
+            due = job["next_poll_at"]
+            next_due = due if next_due is None else min(next_due, due)
+        if next_due is None:
+            return None
+        return max(0.0, next_due - now)
+
+    def _poll(self, job, now):
+        if now - job["created_at"] > self.max_age:
+            self.store.update(job["id"], status="FAILED", error="Video generation timed out")
+            print(f"Video job {job['id']} gave up after {int(now - job['created_at'])}s")
+            return None
+
+        task = self.runway.get_task_status(job["task_id"])
+        if task is None:
+            # Transient lookup error, try again later
+            interval = min(job["poll_interval"] * self.backoff, self.max_interval)
+            self.store.reschedule(job["id"], interval, now + interval)
+            return dict(job, poll_interval=interval, next_poll_at=now + interval)
+
+        status = task.status
+        if status == "SUCCEEDED":
+            self.store.update(job["id"], status=status, progress=1.0, video_url=task.output[0])
+            print(f"Video job {job['id']} finished")
+            return None
+        if status in FINISHED:
+            error = getattr(task, "failure", None) or getattr(task, "error", None) or "Video generation failed"
+            self.store.update(job["id"], status=status, error=str(error))
+            print(f"Video job {job['id']} {status.lower()}: {error}")
+            return None
+
+        progress = getattr(task, "progress", None) or 0.0
+        if status != job["status"] or progress > job["progress"]:
+            interval = self.min_interval
+            self.store.update(job["id"], status=status, progress=progress, poll_interval=interval, next_poll_at=now + interval)
+        else:
+            interval = min(job["poll_interval"] * self.backoff, self.max_interval)
+            self.store.reschedule(job["id"], interval, now + interval)
+        return dict(job, status=status, progress=progress, poll_interval=interval, next_poll_at=now + interval)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.wakeup.clear()
+            try:
+                delay = self.poll_once()
+            except Exception as e:
+                print(f"Error polling video jobs: {e}")
+                delay = self.min_interval
+            self.wakeup.wait(self.max_interval if delay is None else delay)
@@ -1,33 +1,101 @@
-import requests
+from http_transport import get_transport
+from async_transport import get_async_transport
+from resilience import AsyncGuardedTransport, GuardedTransport, UpstreamUnavailable, get_guard
+from ttl_cache import TTLCache
 import os
+import re
 
 class WeatherService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, transport=None, cache=None, guard=None):
         self.api_key = (api_key or os.getenv("OPENWEATHER_API_KEY", "")).strip()
-        self.base_url = "https://api.openweathermap.org/data/2.5/weather"
+        self.base_url = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org").rstrip("/") + "/data/2.5/weather"
+        self.guard = guard or get_guard("openweather")
+        self.http = GuardedTransport(transport or get_transport(), self.guard)
+        # OpenWeather data only changes every ~10 minutes, so serve repeats from memory
+        self.cache = cache or TTLCache(
+            maxsize=int(os.getenv("WEATHER_CACHE_SIZE", 256)),
+            ttl=float(os.getenv("WEATHER_CACHE_TTL", 600)),
+            stale_ttl=float(os.getenv("WEATHER_STALE_TTL", 1800)),
+            negative_ttl=float(os.getenv("WEATHER_NEGATIVE_TTL", 3600))
+        )
+
+    def _configured(self):
+        return self.api_key and self.api_key != "YOUR_OPENWEATHER_API_KEY"
+
+    @staticmethod
+    def _normalize(city):
+        # Cities extracted by ask() may carry stray whitespace and trailing punctuation;
+        # the cache key also ignores case, so "London" and "london?" share an entry
+        return re.sub(r"\s+", " ", city).strip().rstrip("?.!,;:").strip()
 
     def get_weather(self, city):
-        if not self.api_key or self.api_key == "YOUR_OPENWEATHER_API_KEY":
+        if not self._configured():
             return "Weather API key is not configured. Please add your OpenWeather API key to the .env file."
-        
+
+        city = self._normalize(city)
+        return self.cache.get(city.lower(), lambda: self._fetch_weather(city))
+
+    def _params(self, city):
+        return {
+            "q": city,
+            "appid": self.api_key,
+            "units": "metric"
+        }
+
+    def _fetch_weather(self, city):
+        """Returns (text, cache kind) for TTLCache: 404s are cached negatively, errors not at all."""
+        try:
+            response = self.http.get(self.base_url, params=self._params(city))
+            return self._parse_weather(city, response)
+        except UpstreamUnavailable:
+            return self._unavailable(city), None
+        except Exception as e:
+            return f"Error fetching weather: {str(e)}", None
+
+    def _parse_weather(self, city, response):
+        data = response.json()
+
+        if response.status_code == 200:
+            name = data.get("name") or city
+            temp = data["main"]["temp"]
+            desc = data["weather"][0]["description"]
+            humidity = data["main"]["humidity"]
+            wind_speed = data["wind"]["speed"]
+            return f"The weather in {name} is currently {desc} with a temperature of {temp}°C. Humidity is {humidity}% and wind speed is {wind_speed} m/s.", "ok"
+        elif response.status_code == 401:
+            return f"⚠️ **Weather API Error**: Your OpenWeather API key is invalid or not yet active. If you just created it, it can take up to 2 hours to activate. Please verify your key in the .env file.", None
+        elif response.status_code == 404:
+            return f"Could not get weather for {city}. Error: {data.get('message', 'city not found')}", "negative"
+        else:
+            return f"Could not get weather for {city}. Error: {data.get('message', 'Unknown error')}", None
+
+    def _unavailable(self, city):
+        # Fail fast; an expired answer is still better than none
+        cached = self.cache.peek(city.lower())
+        if cached:
+            return f"{cached}\n_(Weather updates are temporarily unavailable; this may be out of date.)_"
+        return "⚠️ The weather service is temporarily unavailable. Please try again in a minute."
+
+
+class AsyncWeatherService(WeatherService):
+    """asyncio variant for the ASGI entry point; pass the sync service's cache to share it."""
+
+    def __init__(self, api_key=None, transport=None, cache=None, guard=None):
+        super().__init__(api_key, cache=cache, guard=guard)
+        self.http = AsyncGuardedTransport(transport or get_async_transport(), self.guard)
+
+    async def get_weather(self, city):
+        if not self._configured():
+            return "Weather API key is not configured. Please add your OpenWeather API key to the .env file."
+
+        city = self._normalize(city)
+        return await self.cache.aget(city.lower(), lambda: self._fetch_weather(city))
+
+    async def _fetch_weather(self, city):
         try:
-            params = {
-                "q": city,
-                "appid": self.api_key,
-                "units": "metric"
-            }
-            response = requests.get(self.base_url, params=params)
-            data = response.json()
-            
-            if response.status_code == 200:
-                temp = data["main"]["temp"]
-                desc = data["weather"][0]["description"]
-                humidity = data["main"]["humidity"]
-                wind_speed = data["wind"]["speed"]
-                return f"The weather in {city} is currently {desc} with a temperature of {temp}°C. Humidity is {humidity}% and wind speed is {wind_speed} m/s."
-            elif response.status_code == 401:
-                return f"⚠️ **Weather API Error**: Your OpenWeather API key is invalid or not yet active. If you just created it, it can take up to 2 hours to activate. Please verify your key in the .env file."
-            else:
-                return f"Could not get weather for {city}. Error: {data.get('message', 'Unknown error')}"
+            response = await self.http.get(self.base_url, params=self._params(city))
+            return self._parse_weather(city, response)
+        except UpstreamUnavailable:
+            return self._unavailable(city), None
         except Exception as e:
-            return f"Error fetching weather: {str(e)}"
+            return f"Error fetching weather: {str(e)}", None
@@ -1,68 +1,208 @@
-from googleapiclient.discovery import build
+from resilience import UpstreamUnavailable, get_guard
+from ttl_cache import TTLCache
 import os
+import re
+import threading
+import time
+
+UNAVAILABLE = "⚠️ YouTube is temporarily unavailable. Please try again in a minute."
+OUT_OF_QUOTA = "⚠️ I've used up today's YouTube search quota. Trending videos still work, and search is back after midnight Pacific time."
+QUOTA_USED_UP = "⚠️ I've used up today's YouTube quota. Please try again after midnight Pacific time."
+
+# Trimmed copy (search.list and videos.list only) of the discovery document that
+# google-api-python-client ships, so building the client never fetches it over the network
+DISCOVERY_DOC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery", "youtube.v3.json")
+
+# Quota units per call (https://developers.google.com/youtube/v3/determine_quota_cost)
+SEARCH_UNITS = 100
+LIST_UNITS = 1
 
 class YouTubeService:
-    def __init__(self, api_key):
+    """
+    YouTube search and trending charts, spending as little of the daily quota as possible.
+
+    Searches are cached by normalized query, since a search costs 100 of the
+    10,000 daily units. Trending charts cost 1 unit but are the same for every
+    user, so each requested region is refreshed on a background schedule and
+    served from memory. With a quota_scheduler.QuotaLedger, searches stop once
+    only `search_reserve` units are left (keeping trending refreshes alive) and
+    fall back to cached results, however old.
+    """
+
+    def __init__(self, api_key, guard=None, ledger=None, search_cache=None, search_reserve=200,
+                 trending_refresh=1800, trending_idle=86400):
         self.api_key = api_key
-        if api_key:
-            self.youtube = build('youtube', 'v3', developerKey=api_key)
-        else:
-            self.youtube = None
+        # googleapiclient has its own HTTP stack, so calls go through the guard directly
+        self.guard = guard or get_guard("youtube")
+        self.ledger = ledger
+        self.search_reserve = search_reserve
+        self.search_cache = search_cache or TTLCache(maxsize=1024, ttl=6 * 3600, stale_ttl=18 * 3600, negative_ttl=6 * 3600)
+        self.trending_refresh = trending_refresh
+        self.trending_idle = trending_idle
+        self.trending = {}  # (region, max_results) -> (text, fetched_at)
+        self.trending_requested = {}  # (region, max_results) -> last time a user asked
+        self.lock = threading.Lock()
+        self.scheduler = None
+        self.counters = {"trending_hits": 0, "trending_misses": 0, "trending_refreshes": 0, "served_stale": 0}
+        self.youtube = None  # discovery client, built by client() on first use
+
+    def client(self):
+        """The googleapiclient resource, built from the bundled discovery document; None without an API key."""
+        if self.youtube is None and self.api_key:
+            from googleapiclient.discovery import build_from_document
+            with open(DISCOVERY_DOC, encoding="utf-8") as f:
+                document = f.read()
+            youtube = build_from_document(document, developerKey=self.api_key)
+            with self.lock:
+                self.youtube = self.youtube or youtube
+        return self.youtube
+
+    @staticmethod
+    def _normalize(query):
+        # ask() already strips "youtube"/"search"/"find"; fold case, spacing and trailing punctuation too
+        return " ".join(re.sub(r"[^\w\s'-]", " ", query.lower()).split())
 
     def search_videos(self, query, max_results=5):
-        if not self.youtube:
+        if not self.api_key:
             return "YouTube API key not configured."
-        
+
+        key = f"{max_results}:{self._normalize(query)}"
+        return self.search_cache.get(key, lambda: self._fetch_search(query, max_results, key))
+
+    def _fetch_search(self, query, max_results, key):
+        """Returns (text, cache kind) for TTLCache."""
+        if self.ledger and not self.ledger.spend("search.list", SEARCH_UNITS, reserve=self.search_reserve):
+            return self._stale(key, OUT_OF_QUOTA, "today's search quota is nearly used up"), None
+
         try:
-            request = self.youtube.search().list(
+            request = self.client().search().list(
                 q=query,
                 part='snippet',
                 type='video',
                 maxResults=max_results
             )
-            response = request.execute()
-            
+            response = self.guard.call(request.execute)
+
             videos = []
             for item in response.get('items', []):
                 title = item['snippet']['title']
                 video_id = item['id']['videoId']
                 video_url = f"https://www.youtube.com/watch?v={video_id}"
                 videos.append(f"- **{title}**\n  [Watch on YouTube]({video_url})")
-            
+
             if not videos:
-                return "No videos found for that search."
-                
-            return "\n\n".join(videos)
-            
+                return "No videos found for that search.", "negative"
+
+            return "\n\n".join(videos), "ok"
+
+        except UpstreamUnavailable:
+            return self._stale(key, UNAVAILABLE, "YouTube is temporarily unavailable"), None
         except Exception as e:
             error_str = str(e)
+            if "quotaExceeded" in error_str and self.ledger:
+                # Another project or tool spent the quota; stop trying until the reset
+                self.ledger.exhaust()
+                return self._stale(key, OUT_OF_QUOTA, "today's search quota is used up"), None
             if "referer" in error_str.lower() or "blocked" in error_str.lower():
-                return "⚠️ **YouTube API Restriction Error**: Your API key has 'Website Restrictions' enabled in Google Cloud Console. \n\n**To fix this:**\n1. Go to [Google Cloud Credentials](https://console.cloud.google.com/apis/credentials).\n2. Edit your YouTube API Key.\n3. Under 'Application restrictions', set it to **'None'** for local testing.\n4. Save and try again."
-            return f"Error searching YouTube: {error_str}"
+                return "⚠️ **YouTube API Restriction Error**: Your API key has 'Website Restrictions' enabled in Google Cloud Console. \n\n**To fix this:**\n1. Go to [Google Cloud Credentials](https://console.cloud.google.com/apis/credentials).\n2. Edit your YouTube API Key.\n3. Under 'Application restrictions', set it to **'None'** for local testing.\n4. Save and try again.", None
+            return f"Error searching YouTube: {error_str}", None
+
+    def _stale(self, key, fallback, reason):
+        cached = self.search_cache.peek(key)
+        if not cached:
+            return fallback
+        with self.lock:
+            self.counters["served_stale"] += 1
+        return f"{cached}\n\n_({reason[0].upper()}{reason[1:]}; these results may be out of date.)_"
 
     def get_trending_videos(self, region_code='US', max_results=5):
-        if not self.youtube:
+        if not self.api_key:
             return "YouTube API key not configured."
-            
+
+        key = (region_code.upper(), max_results)
+        with self.lock:
+            self.trending_requested[key] = time.time()
+            entry = self.trending.get(key)
+            self.counters["trending_hits" if entry else "trending_misses"] += 1
+        self._start_scheduler()
+        if entry:
+            return entry[0]
+        # First request for this chart: fetch it now; the scheduler keeps it fresh from here on
+        return self._fetch_trending(key)
+
+    def _fetch_trending(self, key):
+        region_code, max_results = key
+        if self.ledger and not self.ledger.spend("videos.list", LIST_UNITS):
+            return QUOTA_USED_UP
+
         try:
-            request = self.youtube.videos().list(
+            request = self.client().videos().list(
                 part='snippet,contentDetails,statistics',
                 chart='mostPopular',
                 regionCode=region_code,
                 maxResults=max_results
             )
-            response = request.execute()
-            
+            response = self.guard.call(request.execute)
+
             videos = []
             for item in response.get('items', []):
                 title = item['snippet']['title']
                 video_id = item['id']
                 video_url = f"https://www.youtube.com/watch?v={video_id}"
                 videos.append(f"- **{title}**\n  [Watch on YouTube]({video_url})")
-                
-            return "\n\n".join(videos)
+
+            text = "\n\n".join(videos)
+            with self.lock:
+                self.trending[key] = (text, time.time())
+            return text
+        except UpstreamUnavailable:
+            return UNAVAILABLE
         except Exception as e:
             error_str = str(e)
+            if "quotaExceeded" in error_str and self.ledger:
+                self.ledger.exhaust()
             if "referer" in error_str.lower() or "blocked" in error_str.lower():
                 return "⚠️ **YouTube API Restriction Error**: Your API Key is restricted. Please go to your Google Cloud Console and set 'Application restrictions' to **'None'** for testing."
             return f"Error getting trending videos: {error_str}"
+
+    def _start_scheduler(self):
+        with self.lock:
+            if self.scheduler:
+                return
+            self.scheduler = threading.Thread(target=self._refresh_trending, daemon=True)
+        self.scheduler.start()
+
+    def _refresh_trending(self):
+        """Re-fetches every chart asked for within `trending_idle`, every `trending_refresh` seconds."""
+        while True:
+            time.sleep(self.trending_refresh)
+            now = time.time()
+            with self.lock:
+                for key, asked in list(self.trending_requested.items()):
+                    if now - asked > self.trending_idle:
+                        del self.trending_requested[key]
+                        self.trending.pop(key, None)
+                keys = list(self.trending_requested)
+            for key in keys:
+                try:
+                    self._fetch_trending(key)
+                    with self.lock:
+                        self.counters["trending_refreshes"] += 1
+                except Exception as e:
+                    print(f"Error refreshing trending videos for {key[0]}: {e}")
+
+    def stats(self):
+        """Search cache hit ratio, trending chart ages, and quota spent and left today."""
+        now = time.time()
+        with self.lock:
+            stats = dict(self.counters)
+            ages = {f"{region}:{count}": int(now - fetched_at) for (region, count), (_, fetched_at) in self.trending.items()}
+        trending_lookups = stats["trending_hits"] + stats["trending_misses"]
+        stats["trending_hit_ratio"] = round(stats["trending_hits"] / trending_lookups, 4) if trending_lookups else 0.0
+        stats["trending_age_seconds"] = ages
+        stats["search_cache"] = self.search_cache.stats()
+        if self.ledger:
+            quota = self.ledger.stats()
+            quota["searches_left"] = max(0, quota["remaining"] - self.search_reserve) // SEARCH_UNITS
+            stats["quota"] = quota
+        return stats